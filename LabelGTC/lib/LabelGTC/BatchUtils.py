@@ -0,0 +1,276 @@
+"""
+Functions for the correction of several gene families against a single species tree
+"""
+
+"""
+A batch manifest is a tab-separated file with one gene family per line:
+    genetree    covering_set    [threshold]    [output]
+    - genetree : either the filename or the newick string of the genetree
+    - covering_set : either a filename or a list of trees separated by ';'
+    - threshold : optional, the threshold used for this family (default to the one given to readManifest)
+    - output : optional, the file in which the corrected genetree should be written
+Empty lines and lines starting with '#' are ignored.
+"""
+
+import os
+import re
+import logging
+import traceback
+import multiprocessing
+
+from ..TreeLib import TreeUtils, TreeClass
+from .LabelGTCRec import LabelGTC, LabelGTCContext
+from .ResolutionCache import ResolutionCache
+
+
+def prepareSpeciesTree(speciesTree):
+    """Build once the TreeUtils.SpeciesTreeIndex of the species tree (labeled internal nodes, euler tour, ...),
+    so that it can be shared by all the corrections of a batch. Return the index"""
+
+    if isinstance(speciesTree, basestring):
+        speciesTree = TreeClass(speciesTree)
+
+    return TreeUtils.getSpeciesTreeIndex(speciesTree)
+
+
+
+def readCoveringSet(covset):
+    """Read a covering set of trees, either from a file or from a list of trees separated by ';'"""
+
+    covering_set = []
+
+    if os.path.exists(covset):
+        with open(covset) as COVIN:
+            for ct in COVIN:
+                ct = ct.strip().split(';')
+                if ct:
+                    covering_set.extend([TreeClass(ctt.strip()+';') for ctt in ct if ctt.strip()])
+    else:
+        covering_set = [TreeClass(ct+";") for ct in covset.split(";") if ct.strip()]
+
+    if not covering_set:
+        raise ValueError("Covering set is invalid")
+
+    return covering_set
+
+
+
+def readSpeciesMap(smap):
+    """Read a gene to species map (standard format) and return a dict of compiled regex to species name"""
+
+    regexmap = {}
+
+    with open(smap, 'rU') if isinstance(smap, basestring) else smap as INPUT:
+        for line in INPUT:
+            g, s = line.strip().split()
+            if ('*') in g and '.*' not in g:
+                g = g.replace('*', '.*')
+            g_regex = re.compile(g, re.IGNORECASE)
+            regexmap[g_regex] = s
+
+    return regexmap
+
+
+
+def getSpeciesMap(genetree, regexmap):
+    """Return the species of each leaf of the genetree according to regexmap"""
+
+    smap = {}
+
+    for leaf in genetree:
+        for key, value in regexmap.iteritems():
+            if key.match(leaf.name):
+                smap[leaf.name] = value
+
+    return smap
+
+
+
+def reformatWithSep(genetree, sep, spos, smap={}, geneRemapping=None):
+    """Change input tree leaves name to follow format used by LabelGTC,
+    and return the map from the new names to the original ones"""
+
+    if geneRemapping is None:
+        geneRemapping = {}
+
+    if smap:
+        for node in genetree.traverse():
+            node_specie = smap.get(
+                node.name, TreeClass.DEFAULT_SPECIE)
+            if node.name:
+                new_name = node.name.replace('_', '')+ "_" + node_specie
+                if not geneRemapping.get(new_name, None):
+                    geneRemapping[new_name] = node.name
+                node.name = new_name
+    elif sep!='_':
+        for leaf in genetree:
+            node_specie = leaf._extract_feature_name(separator=sep, order=spos)
+            new_name = leaf.name.replace('_', '')+ "_" + node_specie
+            if not geneRemapping.get(new_name, None):
+                geneRemapping[new_name] = leaf.name
+            leaf.name = new_name
+
+    return geneRemapping
+
+
+
+def readManifest(manifest, threshold=None):
+    """Iterate over the records of a batch manifest.
+    Yield (genetree, covering_set, threshold, output) tuples, output is None when not specified"""
+
+    with open(manifest, 'rU') if isinstance(manifest, basestring) else manifest as INPUT:
+        for nline, line in enumerate(INPUT, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+
+            fields = [x.strip() for x in line.split('\t')]
+            if len(fields) < 2:
+                raise ValueError("Line %d of the manifest should at least contain a genetree and a covering set" % nline)
+
+            record_threshold = threshold
+            if len(fields) > 2 and fields[2]:
+                try:
+                    record_threshold = float(fields[2])
+                except ValueError:
+                    raise ValueError("Invalid threshold on line %d of the manifest" % nline)
+            if record_threshold is None:
+                raise ValueError("No threshold given for line %d of the manifest" % nline)
+
+            output = fields[3] if len(fields) > 3 and fields[3] else None
+
+            yield fields[0], fields[1], record_threshold, output
+
+
+
+def _readFamily(genetree, covset, sep, spos, regexmap):
+    """Read the genetree and the covering set of a family (filenames or strings), and reformat their leaf names.
+    Return (genetree, covering_set, geneRemapping), geneRemapping giving the original name of each leaf"""
+
+    gtree = TreeClass(genetree) if isinstance(genetree, basestring) else genetree
+    covering_set = readCoveringSet(covset) if isinstance(covset, basestring) else covset
+
+    smap = getSpeciesMap(gtree, regexmap) if regexmap else {}
+
+    # reformat the name of gtree and set of tree in covset
+    geneRemapping = {}
+    for t in [gtree]+covering_set:
+        reformatWithSep(t, sep, spos, smap, geneRemapping)
+
+    return gtree, covering_set, geneRemapping
+
+
+
+def correctGeneTree(speciesTree, genetree, covset, threshold, sep="_", spos="postfix", regexmap=None, threads=1, sgtCache=None):
+    """Correct a single gene family, from its genetree and covering set (filenames or strings),
+    and return the corrected genetree with its original leaf names.
+    Up to threads threads are used to resolve sibling subtrees concurrently.
+    sgtCache is an optional SGTCache or ResolutionCache, that can be reused for the next families"""
+
+    logger = logging.getLogger("LabelGTC")
+
+    gtree, covering_set, geneRemapping = _readFamily(genetree, covset, sep, spos, regexmap)
+
+    lgtc = LabelGTC(speciesTree, gtree, covering_set, threshold, context=LabelGTCContext(threads, sgtCache))
+    lgtc.mergeResolutions()
+    res = lgtc.getResultedTree()
+
+    for leaf in res:
+        leaf.name = geneRemapping.get(leaf.name, leaf.name)
+
+    context = lgtc.getContext()
+    logger.debug("Family corrected with case %s (%d instances, max depth %d, cases %s)" % (lgtc.getCase(), context.nbCalls, context.maxDepth, context.cases))
+
+    return res
+
+
+
+def sweepGeneTree(speciesTree, genetree, covset, thresholds, sep="_", spos="postfix", regexmap=None, threads=1, sgtCache=None):
+    """Correct a single gene family with each threshold of thresholds (see LabelGTC.sweepThresholds),
+    and return the list of (threshold, corrected genetree) with the original leaf names"""
+
+    logger = logging.getLogger("LabelGTC")
+
+    gtree, covering_set, geneRemapping = _readFamily(genetree, covset, sep, spos, regexmap)
+
+    results = []
+    for threshold, res, case in LabelGTC.sweepThresholds(speciesTree, gtree, covering_set, thresholds, threads, sgtCache):
+        for leaf in res:
+            leaf.name = geneRemapping.get(leaf.name, leaf.name)
+        logger.debug("Family corrected with threshold %s and case %s" % (threshold, case))
+        results.append((threshold, res))
+
+    return results
+
+
+
+def batchCorrection(speciesTree, records, sep="_", spos="postfix", regexmap=None):
+    """Correct each (genetree, covering_set, threshold, output) record against the same species tree, one after the other
+    (parallelCorrection with a single job). Yield (record, corrected_tree) in input order, and raise a ValueError
+    with the traceback of the failure when a family can't be corrected"""
+
+    for record, newick, error in parallelCorrection(speciesTree, records, 1, sep, spos, regexmap):
+        if error:
+            raise ValueError("Family %s could not be corrected\n%s" % (record[0], error))
+        yield record, TreeClass(newick)
+
+
+
+# species tree and options of the correction, set once in each worker process
+_worker_state = {}
+
+def _initWorker(speciesTree, sep, spos, regexmap, threads=1, sgtCacheSize=0, cacheFile=None):
+    """Store the preprocessed species tree and the correction options in the worker process,
+    with the cache of resolutions of the worker (loaded from cacheFile if it exists)"""
+    sgtCache = ResolutionCache(sgtCacheSize, path=cacheFile) if sgtCacheSize > 0 else None
+    _worker_state.update(speciesTree=speciesTree, sep=sep, spos=spos, regexmap=regexmap, threads=threads, sgtCache=sgtCache)
+
+
+def _correctRecord(record):
+    """Correct a single record in a worker process.
+    Return (record, newick, error), where error is None on success and newick is None on failure"""
+
+    genetree, covset, threshold = record[:3]
+    try:
+        res = correctGeneTree(_worker_state['speciesTree'], genetree, covset, threshold,
+                              _worker_state['sep'], _worker_state['spos'], _worker_state['regexmap'], _worker_state['threads'],
+                              _worker_state['sgtCache'])
+        return record, res.write(format=9), None
+    except Exception:
+        return record, None, traceback.format_exc()
+
+
+
+def parallelCorrection(speciesTree, records, jobs=None, sep="_", spos="postfix", regexmap=None, chunksize=1, threads=1, sgtCacheSize=0, cacheFile=None):
+    """Correct each (genetree, covering_set, threshold, output) record against the same species tree,
+    using a pool of jobs worker processes (the number of cpu by default), each using up to threads threads.
+    The species tree is preprocessed once, and sent once to each worker.
+    When sgtCacheSize is positive, each worker keeps a ResolutionCache of that many resolutions (minSGT and PolyRes)
+    for all its families, initialized from cacheFile if it exists, and saved to cacheFile at the end. The caches of
+    several workers can't be saved to the same file, so a ValueError is raised when cacheFile is given with jobs != 1.
+    Yield (record, newick, error) in input order. The failure of a family does not stop the others:
+    newick is then None and error contains the traceback of the failure"""
+
+    if cacheFile and sgtCacheSize > 0 and jobs != 1:
+        raise ValueError("The cache of resolutions can only be saved to %s with a single job" % cacheFile)
+
+    speciesTree = prepareSpeciesTree(speciesTree)
+
+    if jobs == 1:
+        _initWorker(speciesTree, sep, spos, regexmap, threads, sgtCacheSize, cacheFile)
+        for record in records:
+            yield _correctRecord(record)
+        if cacheFile and _worker_state['sgtCache'] is not None:
+            _worker_state['sgtCache'].save(cacheFile)
+        return
+
+    pool = multiprocessing.Pool(jobs, _initWorker, (speciesTree, sep, spos, regexmap, threads, sgtCacheSize, cacheFile))
+    try:
+        for result in pool.imap(_correctRecord, records, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
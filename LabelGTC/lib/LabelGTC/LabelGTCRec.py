@@ -24,23 +24,189 @@ import time
 
 import copy
 
+import threading
+
+import numpy as np
+
+from .Scheduler import SubtreeScheduler
+from .ResolutionCache import ResolutionCache
 from ..PolyRes import ZhengPS
-from ..SGT import getMinSGT
-from ete3 import Tree
+from ..SGT import getMinSGTFromArrays
 
 from ..TreeLib import *
-from ..TreeLib import TreeUtils, TreeClass
+from ..TreeLib import TreeUtils, TreeClass, CompactTree, CladeIndex
 import logging
 
-#Special case detected
-special_case = False
 
-#Number of instance created
-nbCalls = 0
 
-#Clades to be preserved during minSGT call
-global clades_to_preserve_sgt
-clades_to_preserve_sgt = []
+class LabelGTCContext:
+
+    """
+    State shared by all the instances of LabelGTC created for the correction of a single genes tree :
+    - the number of instances created, the first one being the root instance
+    - the maximal recursion depth
+    - the clades to be preserved during minSGT call
+    - whether a special case has been detected, and the number of instances resolved with each case
+    - the number of threads that can be used to resolve independent subtrees concurrently,
+      or the executor running the steps of the instances (see Scheduler)
+    - an optional cache of minSGT results (SGT.SGTCache), that can be shared by several corrections,
+      which is also used by PolyRes and M-PolyRes when it is a ResolutionCache
+    - the ThresholdSweep the correction is part of, if any (see LabelGTC.sweepThresholds)
+    - the index of the clades of the genes tree (CladeIndex), built by the root instance
+
+    A new context is created for each correction, so that several genes trees can be corrected
+    one after the other, or concurrently, in the same process.
+    """
+
+    def __init__(self, threads=1, sgtCache=None, executor=None, sweep=None):
+
+        #Number of instance created
+        self.nbCalls = 0
+
+        #Maximal recursion depth of the instances
+        self.maxDepth = 0
+
+        #Clades to be preserved during minSGT call
+        self.clades_to_preserve_sgt = []
+
+        #Special case detected
+        self.special_case = False
+
+        #Number of instances resolved with each case
+        self.cases = {}
+
+        #Number of threads that can be used to resolve independent subtrees concurrently
+        self.threads = max(1, threads)
+
+        #Executor running the steps of the instances, None to use a pool of self.threads threads (or the current thread only)
+        self.executor = executor
+
+        #Lock protecting the state shared by the threads
+        self.lock = threading.RLock()
+
+        #Cache of minSGT results (and of PolyRes results for a ResolutionCache), None to disable it
+        self.sgtCache = sgtCache
+
+        #Threshold sweep sharing the resolutions of the subtrees between the corrections, None for a single correction
+        self.sweep = sweep
+
+        #Index of the clades of the genes tree, shared by the instances
+        self.clades = None
+
+
+
+    def newInstance(self, depth=0):
+        """Register a new instance of LabelGTC at the given recursion depth and return its id"""
+        with self.lock:
+            self.nbCalls += 1
+            self.maxDepth = max(self.maxDepth, depth)
+            return self.nbCalls
+
+
+
+    def addCase(self, case):
+        with self.lock:
+            self.cases[case] = self.cases.get(case, 0) + 1
+
+
+
+    def getScheduler(self):
+        """Return the scheduler resolving the instances of this correction"""
+        return SubtreeScheduler(self.executor, self.threads)
+
+
+
+class ThresholdSweep:
+
+    """
+    State shared by the corrections of a single genes tree with several thresholds (see LabelGTC.sweepThresholds) :
+    - ctree : the CompactTree of the genes tree, corrected with each threshold, its covering set of trees being validated once (label cst)
+    - topology : the topology id of the subtree of each node (see CompactTree.topologyIds)
+    - order : the node ids sorted by support, so that the binconfidence labels of a threshold are given by a binary search
+    - binconfidence : the binconfidence labels of the current threshold
+    - resolutions : the resolutions of the subtrees resolved by the instances created by globalSteps, by
+      (topology, binconfidence labels of the subtree, threshold range), with their case and the minSGT results
+      they added to the clades to preserve. Nothing outside of a subtree changes its resolution, so a subtree
+      is only resolved again when one of its labels flips.
+
+    The resolutions are stored as CompactTree, and a new TreeClass is built each time one is reused.
+    """
+
+    def __init__(self, speciesIndex, genesTree, covSetTree):
+
+        #Checking the covering set of trees once, the cst labels being kept in ctree
+        self.ctree = CompactTree.fromTreeClass(genesTree)
+        lgtc = LabelGTC(speciesIndex, self.ctree, covSetTree, 1.0)
+        if not lgtc.checkCovSetTree():
+            raise Exception("The covering set of tree is not conform with the tree of genes")
+
+        self.topology = self.ctree.topologyIds({})
+
+        #The nodes sorted by support once for all the thresholds
+        self.order = np.argsort(self.ctree.support, kind='mergesort')
+        self.sortedSupport = self.ctree.support[self.order]
+        self.rank = None
+        self.threshold = None
+        self.binconfidence = None
+
+        self.resolutions = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+
+
+    def setThreshold(self, threshold):
+        """Compute the binconfidence labels of the threshold, and return the ids of the nodes
+        whose label flipped since the previous threshold"""
+
+        #The nodes labeled 1 are the ones after rank in order (support >= threshold)
+        rank = int(np.searchsorted(self.sortedSupport, threshold, 'left'))
+        binconfidence = np.zeros(len(self.ctree), dtype=np.int8)
+        binconfidence[self.order[rank:]] = 1
+
+        if self.rank is None:
+            flipped = self.order
+        else:
+            flipped = self.order[min(rank, self.rank):max(rank, self.rank)]
+
+        self.rank = rank
+        self.threshold = threshold
+        self.binconfidence = binconfidence
+        return flipped
+
+
+
+    def key(self, i):
+        """Return the key of the resolution of the subtree rooted at the node i of ctree with the current threshold"""
+
+        end = self.ctree.end[i]
+        #M-PolyRes contracts the nodes whose binconfidence is lower than the threshold
+        return (self.topology[i], self.binconfidence[i:end].tostring(), self.threshold > 0, self.threshold > 1)
+
+
+
+    def get(self, key):
+        """Return the (case, resolved subtree, minSGT results) of a key, or None if it was never resolved"""
+
+        with self.lock:
+            resolution = self.resolutions.get(key)
+            if resolution is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        case, tree, clades = resolution
+        return case, tree.toTreeClass() if tree is not None else None, list(clades)
+
+
+
+    def put(self, key, case, tree, clades):
+        """Store the resolution of a key, the clades added to the clades to preserve being CompactTree"""
+
+        resolution = (case, CompactTree.fromTreeClass(tree) if tree is not None else None, list(clades))
+        with self.lock:
+            self.resolutions[key] = resolution
 
 
 
@@ -57,29 +223,47 @@ class LabelGTC:
     lgtc = LabelGTC(speciesTree, genesTree, coveringSetTree, threshold)
 
     lgtc.mergeResolutions()
+
+    The genes tree can be corrected with several thresholds at once with LabelGTC.sweepThresholds.
+
+    When several genes trees are corrected against the same species tree, the species tree
+    can be given as TreeUtils.getSpeciesTreeIndex(speciesTree), so that it is indexed only once.
+
+    The genes tree is stored once as a CompactTree, that is shared by the instances created for its subtrees,
+    each of them being given the id of the root of its subtree (node). TreeClass trees are only built for
+    the resolution algorithms, and the genes tree given is never modified by the correction.
     """
 
-    def __init__(self, speciesTree, genesTree, covSetTree, threshold, debug=None):
+    def __init__(self, speciesTree, genesTree, covSetTree, threshold, debug=None, context=None, depth=0, node=0):
 
-        global nbCalls
-        nbCalls += 1
+        #The state shared with the other instances of the same correction, a new one for the root instance
+        if context is None:
+            context = LabelGTCContext()
+        self.context = context
 
-        self.id = nbCalls
+        #Recursion depth of this instance, 0 for the root instance
+        self.depth = depth
 
-        self.speciesTree = speciesTree
+        self.id = context.newInstance(depth)
 
-        self.genesTree = genesTree
+        #The species tree can be given with its TreeUtils.SpeciesTreeIndex, it is then shared by all the instances
+        #and never relabeled nor preprocessed again
+        self.speciesIndex = TreeUtils.getSpeciesTreeIndex(speciesTree)
+        self.speciesTree = self.speciesIndex.tree
 
-        self.genesTree.label_internal_node()
+        #The compact tree of genes, and the id of the root of the subtree of this instance
+        if isinstance(genesTree, CompactTree):
+            self.ctree = genesTree
+        else:
+            genesTree.label_internal_node()
+            self.ctree = CompactTree.fromTreeClass(genesTree)
+        self.node = node
 
         self.covSetTree = covSetTree
 
         self.threshold = threshold
 
-        #The set of leaves of the genesTree
-        self.all_leaves = self.genesTree.get_leaf_names()
-
-        #The covering set of edges of the current geneTree (useful for minSGT call)
+        #The covering set of edges of the current geneTree, as the ids of the nodes below the edges (useful for minSGT call)
         self.covSetEdge_minSGT = []
 
         #The case detected by mergeResolutions
@@ -90,6 +274,15 @@ class LabelGTC:
         #The returned tree
         self.resultedTree = None
 
+        #The resolved subtrees of the instances created for the subtrees of the genesTree, as CompactTree by node id
+        self.resolvedSubtrees = {}
+
+        #The resolved subtree of this instance, when it was created for a subtree
+        self.resolvedSubtree = None
+
+        #The trees added to the clades to preserve by the minSGT calls of this instance and of the instances created for its subtrees
+        self.sgtClades = []
+
         if debug is not None:
             self.logger.setLevel(logging.DEBUG)
 
@@ -101,7 +294,19 @@ class LabelGTC:
 
 
     def getGenesTree(self):
-        return self.genesTree
+        """Return a TreeClass of the tree of genes of this instance, with its labels as features. The subtrees resolved
+        by the instances created for them (see globalSteps) are replaced by their resolution, at the same place"""
+
+        genesTree = self.ctree.toTreeClass(self.node, self.ctree.labels.keys())
+        if self.resolvedSubtrees:
+            nodes = list(genesTree.traverse("preorder"))
+            for i, resolved in self.resolvedSubtrees.iteritems():
+                node = nodes[i - self.node]
+                up = node.up
+                modified_tree = resolved.toTreeClass()
+                up.children[up.children.index(node)] = modified_tree
+                modified_tree.up = up
+        return genesTree
 
 
 
@@ -115,48 +320,100 @@ class LabelGTC:
 
 
 
+    def getResolvedSubtree(self):
+        return self.resolvedSubtree
+
+
+
+    def getContext(self):
+        return self.context
+
+
+
     def setThreshold(self, newThreshold):
         self.threshold = newThreshold
 
 
 
+    @staticmethod
+    def sweepThresholds(speciesTree, genesTree, covSetTree, thresholds, threads=1, sgtCache=None):
+        """Correct the genes tree with each threshold of thresholds, and return the list of (threshold, resulted tree, case).
+        The covering set of trees is checked once, and the subtrees whose binconfidence labels are the same as with a
+        previous threshold are not resolved again (see ThresholdSweep). The genes tree is not modified"""
+
+        logger = logging.getLogger("LabelGTC")
+
+        speciesIndex = TreeUtils.getSpeciesTreeIndex(speciesTree)
+        sweep = ThresholdSweep(speciesIndex, genesTree, covSetTree)
+
+        #The resulted trees by labels of the whole tree, reused when no label flips
+        corrected = {}
+
+        results = []
+        for threshold in thresholds:
+            flipped = sweep.setThreshold(threshold)
+            logger.debug("Threshold %s : %d labels flipped" % (threshold, len(flipped)))
+
+            key = sweep.key(0)
+            if key in corrected:
+                case, tree = corrected[key]
+                results.append((threshold, tree.toTreeClass(), case))
+                continue
+
+            lgtc = LabelGTC(speciesIndex, sweep.ctree, covSetTree, threshold, context=LabelGTCContext(threads, sgtCache, sweep=sweep))
+            lgtc.mergeResolutions()
+            results.append((threshold, lgtc.getResultedTree(), lgtc.getCase()))
+            corrected[key] = (lgtc.getCase(), CompactTree.fromTreeClass(lgtc.getResultedTree()))
+
+        logger.debug("Threshold sweep : %d subtrees resolved, %d reused" % (sweep.misses, sweep.hits))
+        return results
+
+
+
     def checkCovSetTree(self):
         """check if the covering set of tree is conform with the tree of genes, and add the label cst to each node of the tree of genes that is also a node of a tree from the covering set of tree (except the root node of each tree)
         cst = 0 for internal nodes not in the covering set of tree
         cst = 1 for internal nodes in the covering set of tree
-        cst = 2 if the node is the root of a tree in the covering set of tree"""
+        cst = 2 if the node is the root of a tree in the covering set of tree
+        Each subtree of the tree of genes and each tree of the covering set is given a topology id once, and they are matched through a dictionary"""
 
         cpt = 0
         #List containing all the leaves of each tree from the set of cevering trees
         leaves_list_cst = []
 
-        #List of all the leaves of the tree of genes
-        leaves_list_gt = self.genesTree.get_leaf_names()
-
-        for subtree in self.covSetTree:
-
-            if subtree.is_leaf():
-                leaves_list_cst.append(subtree.name)
-
-            else:
-                leaves_list_cst.extend(subtree.get_leaf_names())
+        ctree = self.ctree
+        start, end = self.node, ctree.end[self.node]
 
-            #Searching in the tree of genes a subtree identical to the current subtree
-            for g_node in self.genesTree.traverse("postorder"):
+        #List of all the leaves of the tree of genes
+        leaves_list_gt = ctree.leafNames(start)
 
-                #Initializing the cst value
-                if not g_node.has_feature('cst'):
-                    g_node.add_features(cst=0)
+        #Topology id of the subtree rooted at each node of the tree of genes
+        shapes = {}
+        nodes_by_topology = {}
+        for i, topology in enumerate(ctree.topologyIds(shapes)[start:end], start):
+            nodes_by_topology.setdefault(topology, []).append(i)
 
-                #Testing if the tree rooted at the current node has the same topology than the current subtree
-                if g_node.has_same_topo(subtree):
-                    cpt += 1
-                    if g_node.cst == 0:
-                        g_node.add_features(cst=2)
+        matched = [False] * len(ctree)
+        for subtree in self.covSetTree:
 
-                    #Add the cst feature to all descendants of the current node
-                    for child in g_node.get_descendants():
-                        child.add_features(cst=1)
+            leaves_list_cst.extend(subtree.get_leaf_names())
+
+            #Searching in the tree of genes the subtrees identical to the current subtree
+            for i in nodes_by_topology.get(CompactTree.fromTreeClass(subtree).topologyIds(shapes)[0], []):
+                cpt += 1
+                matched[i] = True
+
+        #The nodes found get cst = 2 (if they had no label), and all their descendants get cst = 1
+        cst = ctree.labels.setdefault('cst', np.zeros(len(ctree), dtype=np.int8))
+        parent = ctree.parent.tolist()
+        covered = [False] * len(ctree)
+        for i in xrange(start, end):
+            if i > start:
+                covered[i] = covered[parent[i]] or matched[parent[i]]
+            if covered[i]:
+                cst[i] = 1
+            elif matched[i] and cst[i] == 0:
+                cst[i] = 2
 
         #All the subtrees have been found in the tree of genes
         return (cpt==len(self.covSetTree) and len(leaves_list_cst) == len(leaves_list_gt) and set(leaves_list_cst)==set(leaves_list_gt))
@@ -166,229 +423,238 @@ class LabelGTC:
     def binaryLabeling(self):
         """Binarization of the support for each node according to the threshold"""
 
-        global clades_to_preserve_sgt
+        clades_to_preserve_sgt = self.context.clades_to_preserve_sgt
 
-        #Only on first instance
-        if self.id == 1:
+        #Only on first instance, the covering set of trees being checked once for a threshold sweep
+        if self.id == 1 and self.context.sweep is None:
             #Checking if the covering set of tree is conform with the tree of genes
             if not self.checkCovSetTree():
                 raise Exception("The covering set of tree is not conform with the tree of genes")
-            else:
-                for g_node in self.genesTree.traverse("levelorder"):
-
-                    #Adding the clades to preserve that are in the covering set of trees
-                    if g_node.support >= self.threshold:
-                        if g_node.has_feature("cst") and not g_node.is_leaf():
-                            if g_node.cst == 2 or g_node.cst == 1:
-                                clades_to_preserve_sgt.append(g_node)
 
-        #adding the binary feature
-        for g_node in self.genesTree.traverse("levelorder"):
+        #The labels are computed once for the whole tree of genes, and read by the instances created for its subtrees
+        ctree = self.ctree
+        binconfidence = (ctree.support >= self.threshold).astype(np.int8)
+        ctree.labels['binconfidence'] = binconfidence
 
-            if g_node.support >= self.threshold:
-                g_node.add_features(binconfidence = 1)
-            else:
-                g_node.add_features(binconfidence = 0)
+        if self.id == 1:
+            #Adding the clades to preserve that are in the covering set of trees, except the ones under another
+            #clade to preserve, that minSGT would remove
+            cst = ctree.labels['cst']
+            preserved = ((binconfidence == 1) & ((cst == 1) | (cst == 2)) & ~ctree.isLeaf()).tolist()
+            outermost = [False] * len(ctree)
+            end = ctree.end.tolist()
+            i = 0
+            while i < len(ctree):
+                if preserved[i]:
+                    outermost[i] = True
+                    i = end[i]
+                else:
+                    i += 1
+            for i in ctree.levelorder():
+                if outermost[i]:
+                    clades_to_preserve_sgt.append(ctree.subtree(i))
 
 
 
     def largerCSE(self):
-        """Identify the larger covering set of edges such that each edge of this set has no ancestral edge labelled 1, by adding lcse feature to the concerned nodes"""
-
-        #To know when the loop should be stopped
-        leaves_to_compare = []
-        lcse_list = []
+        """Identify the larger covering set of edges such that each edge of this set has no ancestral edge labelled 1,
+        add it to the covering set of edges for minSGT and return it, as the ids of the nodes below the edges in levelorder"""
 
-        for g_node in self.genesTree.traverse("levelorder"):
-
-            #Initializing the lcse feature
-            if g_node.has_feature("lcse"):
-                g_node.lcse = 0
-            else:
-                g_node.add_features(lcse = 0)
+        ctree = self.ctree
+        start, end = self.node, ctree.end[self.node]
+        cst = ctree.labels['cst'][start:end]
+        binconfidence = ctree.labels['binconfidence'][start:end]
 
-            #Finding children that should not be treated
-            children = g_node.get_children()
-            children_to_remove = []
+        #The edges that can be in the set
+        candidate = ((binconfidence == 1) & (cst != 1)) | (cst == 2)
+        candidate[0] = False
 
-            for child in children:
+        #An edge is in the set if it is a candidate and none of its ancestral edges is in the set (parents come first in preorder)
+        parent = (ctree.parent[start:end] - start).tolist()
+        candidate = candidate.tolist()
+        lcse = [0] * (end - start)
+        covered = [False] * (end - start)
+        for i in xrange(1, end - start):
+            covered[i] = covered[parent[i]] or lcse[parent[i]] == 1
+            if candidate[i] and not covered[i]:
+                lcse[i] = 1
 
-                if (set(child.get_leaf_names())).issubset(set(leaves_to_compare)) or (child.name in leaves_to_compare):
-                    children_to_remove.append(child)
+        #The edges of the set, in levelorder
+        edges = [i for i in ctree.levelorder(start) if lcse[i - start]]
+        self.covSetEdge_minSGT.extend(edges)
+        return edges
 
-            #And removing them
-            for child in children_to_remove:
-                children.remove(child)
 
-            #Searching for potential children for the set, and adding to them a feature indicating that they are in the set
-            for child in children:
 
-                if (child.binconfidence == 1 and child.cst != 1):
-                    child.add_features(lcse=1)
-                    leaves_to_compare += child.get_leaf_names()
-                    self.covSetEdge_minSGT.append(child.name)
-
-                elif child.cst == 2:
-                    child.add_features(lcse=1)
-                    leaves_to_compare += child.get_leaf_names()
-                    self.covSetEdge_minSGT.append(child.name)
+    def globalProcessing(self):
+        """Calling LabelGTC on concerned subtrees of the tree of genes, and returning the resulted tree"""
 
-            #Stopping the loop when the larger covering set of edges is found
-            if set(self.all_leaves).issubset(set(leaves_to_compare)):
-                break
+        self.context.getScheduler().run(self, self.globalSteps())
+        return self.resultedTree
 
 
 
-    def globalProcessing(self):
-        """Calling LabelGTC recursively on concerned subtrees of the tree of genes"""
+    def globalSteps(self):
+        """Steps of globalProcessing (see Scheduler) : the new instances of LabelGTC created for the concerned subtrees
+        are yielded at once, and their resolved subtrees are used in place of the subtrees by minSGT"""
 
         self.logger.debug("\n\n")
         self.logger.debug("************************************************* NEW INSTANCE **********************************************")
         self.logger.debug("\n\n")
 
         #Computing first the larger covering set of edges
-        self.largerCSE()
+        edges = self.largerCSE()
 
-        #List of leaves to compare with all the leaves in order to know when the loop should be stopped
-        sub_leaves = []
+        ctree = self.ctree
+        cst = ctree.labels['cst']
+        binconfidence = ctree.labels['binconfidence']
+        isleaf = ctree.isLeaf()
 
-        true_covSetEdge_minSGT = [self.genesTree&csename for csename in self.covSetEdge_minSGT]
-        
-        #Applying recursively the LabelGTC algorithm
-        for g_node in self.genesTree.traverse("levelorder"):
+        #Index of the clades of the genesTree, built once by the root instance, and range of the leaves of each tree of the covering set in this index
+        if self.context.clades is None:
+            self.context.clades = CladeIndex(ctree)
+        clades = self.context.clades
+        cst_ranges = [clades.leafRange(tree.get_leaf_names()) for tree in self.covSetTree]
 
-            #Testing if all the covering set of edges has been checked
-            if sub_leaves == self.all_leaves:
-                break
+        #The instances of LabelGTC created for the subtrees, and the ids of the roots of the subtrees
+        subtrees = []
+        subtrees_ids = []
 
-            #Testing only the subtrees of the covering set of edges
-            if g_node in true_covSetEdge_minSGT and (not g_node.is_root()) and (not g_node.has_feature('root')):
-                sub_leaves += g_node.get_leaf_names()
+        #Finding all the subtrees of the covering set of edges to resolve with a new instance of LabelGTC
+        for i in edges:
 
-                #Testing if the tree to treat is big enough (more than 1 internal node)
-                big_enough = False
+            #Testing if the tree to treat is big enough (more than 1 internal node)
+            big_enough = False
 
-                for child in g_node.get_children():
-                    if not child.is_leaf():
-                        big_enough = True
+            for child in ctree.children(i):
+                if not isleaf[child]:
+                    big_enough = True
 
-                #Applying recursively the LabelGTC algorithm to the nodes that have a 1 confidence in the covering set of edges
-                if g_node.binconfidence == 1 and g_node.cst == 0 and big_enough:
+            #Applying the LabelGTC algorithm to the nodes that have a 1 confidence in the covering set of edges
+            if binconfidence[i] == 1 and cst[i] == 0 and big_enough:
 
-                    #The covering set of tree for the new instance of LabelGTC
-                    cst_subtree = []
+                #The covering set of tree for the new instance of LabelGTC
+                cst_subtree = []
 
-                    #Building the covering set of tree for the new instance
-                    for tree in self.covSetTree:
+                #Building the covering set of tree for the new instance, with the trees whose leaves are all under the current node
+                for tree, cst_range in zip(self.covSetTree, cst_ranges):
+                    if clades.isUnder(cst_range, i):
+                        cst_subtree.append(tree)
 
-                        tree_leaf_names = tree.get_leaf_names()
-                        g_node_leaf_name = g_node.get_leaf_names()
-                        included = True
+                #New instance with the current subtree, given by its root, and the reduced covering set of tree (limited to the subtree)
+                subtrees.append(LabelGTC(self.speciesIndex, ctree, cst_subtree, self.threshold, context=self.context, depth=self.depth + 1, node=i))
+                subtrees_ids.append(i)
 
-                        for element in tree_leaf_names:
+        #Resolving the subtrees, that are independent (see Scheduler)
+        modified_trees = yield subtrees
 
-                            if not element in g_node_leaf_name:
-                                included = False
-                                break
+        #The resolved subtrees replace the subtrees for minSGT
+        for lgtc, i, modified_tree in zip(subtrees, subtrees_ids, modified_trees):
 
-                        if included:
-                            cst_subtree.append(tree)
+            if modified_tree is not None:
+                modified_tree.name = ctree.names[ctree.name[i]]
+                self.resolvedSubtrees[i] = CompactTree.fromTreeClass(modified_tree)
 
-                    #This node is the root of the tree of genes of the new instance
-                    g_node.add_features(root=1)
+            self.sgtClades.extend(lgtc.sgtClades)
 
-                    up = g_node.up
+        #On first instance
+        if self.id == 1:
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("________________________________________________________________________________________________________________________")
+                self.logger.debug(self.getGenesTree().get_ascii(show_internal=True, attributes=["binconfidence", "name"]))
+                self.logger.debug("________________________________________________________________________________________________________________________")
 
-                    #The new genes tree of the next instance
-                    g_node.detach()
+            #Using minSGT to resolve the entire genesTree
+            self.resultedTree = self.minSGT()
 
-                    g_node_name = g_node.name
-                    #New instance with the current subtree and the reduced covering set of tree (limited to the subtree)
-                    lgtc = LabelGTC(self.speciesTree, g_node, cst_subtree, self.threshold)
+            clades_to_preserve_sgt = self.context.clades_to_preserve_sgt
+            self.logger.debug(clades_to_preserve_sgt)
 
-                    #Resolving the subtree
-                    lgtc.mergeResolutions()
+            for tree in clades_to_preserve_sgt:
+                self.logger.debug(tree)
 
-                    lgtc.binaryLabeling()
 
-                    #Global case detected
-                    if lgtc.getCase() == "global":
-                        self.logger.debug("CALLING ________________________________________________________________________________________________________________")
-                        self.logger.debug(lgtc.getGenesTree().get_ascii(show_internal=True, attributes=["binconfidence", "name", "lcse"]))
-                        self.logger.debug("________________________________________________________________________________________________________________________")
-                        #Using minSGT to resolve the subtree
-                        modified_tree = lgtc.minSGT()
-                        modified_tree.name =  g_node_name
-                        #Attaching back the subtree to the current genesTree
-                        up.add_child(modified_tree)
 
-                    #PolyRes case detected
-                    elif lgtc.getCase() == "polyres":
+    def resolveSteps(self):
+        """Steps of the resolution of the subtree of an instance created by globalSteps (see Scheduler),
+        the resolved subtree (None if no case was detected) is then given by getResolvedSubtree"""
 
-                        if lgtc.resultedTree:
-                            modified_tree = lgtc.getResultedTree()
-                        else:
-                            modified_tree = lgtc.init_polyRes()
-                        modified_tree.name =  g_node_name
-                        #Attaching back the subtree to the current genesTree
-                        up.add_child(modified_tree)
+        #Reusing the resolution of the same subtree with the same labels during a threshold sweep
+        sweep = self.context.sweep
+        key = sweep.key(self.node) if sweep is not None else None
+        resolution = sweep.get(key) if key is not None else None
+        if resolution is not None:
+            self.case, self.resolvedSubtree, self.sgtClades = resolution
+            with self.context.lock:
+                self.context.clades_to_preserve_sgt.extend(self.sgtClades)
+            self.context.addCase(self.case)
+            return
 
-                    #Multi PolyRes case detected
-                    elif lgtc.getCase() == "m-polyres":
+        yield self.mergeSteps()
 
-                        #Using MPolyRes to resolve the subtree
-                        modified_tree = lgtc.init_m_polyRes()
-                        modified_tree.name =  g_node_name
-                        #Attaching back the subtree to the current genesTree
-                        up.add_child(modified_tree)
+        modified_tree = None
 
-                    g_node.name = g_node_name
+        #Global case detected
+        if self.getCase() == "global":
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("CALLING ________________________________________________________________________________________________________________")
+                self.logger.debug(self.getGenesTree().get_ascii(show_internal=True, attributes=["binconfidence", "name"]))
+                self.logger.debug("________________________________________________________________________________________________________________________")
+            #Using minSGT to resolve the subtree
+            modified_tree = self.minSGT()
 
-        #On first instance
-        if self.id == 1:
-            self.logger.debug("________________________________________________________________________________________________________________________")
-            self.logger.debug(self.genesTree.get_ascii(show_internal=True, attributes=["binconfidence", "name", "lcse"]))
-            self.logger.debug("________________________________________________________________________________________________________________________")
+        #PolyRes case detected
+        elif self.getCase() == "polyres":
 
-            #Using minSGT to resolve the entire genesTree
-            self.resultedTree = self.minSGT()
+            if self.resultedTree:
+                modified_tree = self.getResultedTree()
+            else:
+                modified_tree = self.init_polyRes()
 
-            global clades_to_preserve_sgt
-            self.logger.debug(clades_to_preserve_sgt)
+        #Multi PolyRes case detected
+        elif self.getCase() == "m-polyres":
 
-            for tree in clades_to_preserve_sgt:
-                self.logger.debug(tree)
+            #Using MPolyRes to resolve the subtree
+            modified_tree = self.init_m_polyRes()
+
+        self.resolvedSubtree = modified_tree
+
+        if key is not None:
+            sweep.put(key, self.case, modified_tree, self.sgtClades)
 
-        return self.resultedTree
 
 
-    def polyRes(self):
-        """Using PolytomySolver Algorithm"""
+    def polyRes(self, genesTree, kind="polyres"):
+        """Using PolytomySolver Algorithm on genesTree (the TreeClass of the subtree of this instance with its polytomies),
+        that is resolved in place and returned, the resolution being looked up in the ResolutionCache of the context first"""
 
-        self.logger.debug(self.genesTree)
+        self.logger.debug(genesTree)
 
         dupcost = 1
         losscost = 1
 
-        self.genesTree.set_species()
+        cache = self.context.sgtCache if isinstance(self.context.sgtCache, ResolutionCache) else None
+        if cache is not None:
+            key, leaves = cache.treeKey(genesTree, self.speciesIndex, (dupcost, losscost))
+            r = cache.getTree(kind, key, leaves)
+            if r is not None:
+                return r
 
-        self.speciesTree.label_internal_node()
+        genesTree.set_species()
 
         #Maping the genesTree
-        lcamap = TreeUtils.lcaMapping(self.genesTree, self.speciesTree, multspeciename=False)
+        lcamap = TreeUtils.lcaMapping(genesTree, self.speciesIndex, multspeciename=False)
 
         self.logger.debug(self.speciesTree.write(features=[]))
-        self.logger.debug(self.genesTree)
+        self.logger.debug(genesTree)
 
-        #Solving the tree
-        gts = ZhengPS.DynPolySolver(self.genesTree, self.speciesTree, lcamap, dupcost, losscost)
-        r = [gts.reconstruct()]
-
-        self.logger.debug("NBSOLS = %d"%len(r))
+        #Solving the tree, the resolutions of the polytomies being spliced in genesTree
+        gts = ZhengPS.DynPolySolver(genesTree, self.speciesIndex, lcamap, dupcost, losscost)
+        r = gts.resolve()
         self.logger.debug(r)
 
-        #Reconstructing the result as a TreeClass object
-        r = TreeClass(str(r[0]))
+        if cache is not None:
+            cache.putTree(key, r, leaves)
         return r
 
 
@@ -396,15 +662,17 @@ class LabelGTC:
     def init_polyRes(self):
         """Initializing PolytomySolver Algorithm"""
 
-        self.logger.debug(self.genesTree.get_ascii(show_internal=True, attributes=["binconfidence", "name", "lcse"]))
+        genesTree = self.ctree.toTreeClass(self.node, ['cst'])
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(genesTree.get_ascii(show_internal=True, attributes=["name", "cst"]))
 
         #Transforming the genes Tree in a single polytomy
-        for g_node in self.genesTree.traverse("levelorder"):
+        for g_node in genesTree.traverse("levelorder"):
             if not g_node.is_root() and g_node.cst == 0:
                 g_node.delete()
 
         #Calling polyRes
-        self.resultedTree = self.polyRes()
+        self.resultedTree = self.polyRes(genesTree)
         return self.resultedTree
 
 
@@ -413,11 +681,12 @@ class LabelGTC:
         """Iinitializing M-PolyRes Algorithm"""
 
         #Transforming the genes Tree in a multi polytomies tree
-        self.genesTree.contract_tree(self.threshold, 'binconfidence')
-        self.logger.debug(self.genesTree)
+        genesTree = self.ctree.toTreeClass(self.node, ['binconfidence'])
+        genesTree.contract_tree(self.threshold, 'binconfidence')
+        self.logger.debug(genesTree)
 
         #Calling polyRes
-        self.resultedTree = self.polyRes()
+        self.resultedTree = self.polyRes(genesTree, "m-polyres")
         return self.resultedTree
 
 
@@ -425,97 +694,83 @@ class LabelGTC:
     def minSGT(self):
         """Using minSGT algorithm"""
 
-        #Clades to preserve formatted as a string
-        ctp_minSGT = ""
-
-        #Covering set of trees formatted as a string
-        cst_minSGT = ""
-
-        #SpeciesTree formatted as a string
-        str_speciesTree = ""
-
-        #Removing clades to preserve that are subtrees of the others
-        global clades_to_preserve_sgt
-        clades_to_remove = set([])
-        for clade1 in clades_to_preserve_sgt:
-            for clade2 in clades_to_preserve_sgt:
-                if clade1 != clade2:
-                    if set(clade1.get_leaf_names()).issubset(set(clade2.get_leaf_names())):
-                        clades_to_remove.add(clade1)
-        for ctr_ in clades_to_remove:
-            clades_to_preserve_sgt.remove(ctr_)
-
-        #Formating the clades to preserve for the minSGT call
-        for tree in clades_to_preserve_sgt:
-
-            strTree = tree.write()
-            newStrTree = strTree.replace("_", "__")
-            ctp_minSGT += newStrTree
-
-        ctp_minSGT2 = ctp_minSGT.replace("____", "__")
-
-        #Formating the covering set of trees for the minSGT call
-        self.logger.debug("-----------------\n"+" ".join([csename for csename in self.covSetEdge_minSGT]))
-        self.logger.debug(self.genesTree.get_ascii(show_internal=True, attributes=['name']))
-        self.logger.debug('#####################')
-        for tree in [self.genesTree&csename for csename in self.covSetEdge_minSGT]:
-
-            strTree = tree.write()
-            newStrTree = strTree.replace("_", "__")
-            cst_minSGT += newStrTree
-
-        res_cst_minSGT = cst_minSGT.replace("____", "__")
-
-        cst_minSGT2 = res_cst_minSGT[0:len(res_cst_minSGT)-1]
-
-        self.logger.debug(cst_minSGT2)
-
-        gtreelist = [Tree(x+";") for x in cst_minSGT2.split(';')]
-
-        #Formating the trees of genes to give to the minSGT call
-        gcontent = "".join([gt.write(format=9) for gt in gtreelist])
-
-        #Formating the species tree to give to the minSGT call
-        scontent = self.speciesTree.write(format=9).strip(';')
-
-        self.logger.debug("STR SPECIES TREE :")
-        self.logger.debug(scontent)
+        #The clades to preserve are shared with the instances resolved in other threads
+        with self.context.lock:
+
+            #Removing clades to preserve that are subtrees of the others, their leaves being compared as bitsets
+            clades_to_preserve_sgt = self.context.clades_to_preserve_sgt
+            bitsets = CladeIndex.bitsets([clade.leafNames(0) for clade in clades_to_preserve_sgt])
+            clades_to_remove = set([])
+            for clade1, bits1 in zip(clades_to_preserve_sgt, bitsets):
+                for clade2, bits2 in zip(clades_to_preserve_sgt, bitsets):
+                    if clade1 != clade2:
+                        if CladeIndex.isSubset(bits1, bits2):
+                            clades_to_remove.add(clade1)
+            for ctr_ in clades_to_remove:
+                clades_to_preserve_sgt.remove(ctr_)
+
+            #Formating the clades to preserve for the minSGT call
+            cparents, clabels, _ = CompactTree.parentArray([(clade, 0) for clade in clades_to_preserve_sgt])
+
+        #The trees are given to minSGT as parent index arrays, the species of the genes being given by their index in the species tree arrays
+        sparents, slabels, name2ind = self.speciesIndex.parentArray()
+
+        #Formating the covering set of trees for the minSGT call, the resolved subtrees being used in place of the subtrees of the genes tree
+        self.logger.debug("-----------------\n"+" ".join([self.ctree.names[self.ctree.name[i]] for i in self.covSetEdge_minSGT]))
+        gtreelist = [(self.resolvedSubtrees[i], 0) if i in self.resolvedSubtrees else (self.ctree, i) for i in self.covSetEdge_minSGT]
+        gparents, glabels, gleaves = CompactTree.parentArray(gtreelist)
+
+        gspecies = [-1] * len(gparents)
+        for k in gleaves:
+            specie = glabels[k].split("_", 1)[-1]
+            if specie not in name2ind:
+                raise ValueError("Could not find species for gene %s" % glabels[k])
+            gspecies[k] = name2ind[specie]
+
+        self.logger.debug("SPECIES TREE :")
+        self.logger.debug(self.speciesTree.write(format=9))
         self.logger.debug("\n")
         self.logger.debug("CLADES TO PRESERVE :")
         self.logger.debug(clades_to_preserve_sgt)
         self.logger.debug("\n")
-        self.logger.debug("STR CLADES TO PRESERVE :")
-        self.logger.debug(ctp_minSGT2)
-        self.logger.debug("\n")
-        self.logger.debug("GENES TREE :")
-        self.logger.debug(self.genesTree.get_ascii(show_internal=True, attributes=["support", "name"]))
-        self.logger.debug("\n")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("GENES TREE :")
+            self.logger.debug(self.getGenesTree().get_ascii(show_internal=True, attributes=["support", "name"]))
+            self.logger.debug("\n")
         self.logger.debug("COV SET TREE MINSGT :")
         self.logger.debug(self.covSetEdge_minSGT)
         self.logger.debug("\n")
-        self.logger.debug("STR COV SET TREE MINSGT :")
-        self.logger.debug(gcontent)
-        self.logger.debug("\n")
 
         #MinSGT call
-        res = getMinSGT(gcontent, scontent, False, ctp_minSGT2, "", "")
-
-        #Reformating the resulted tree
-        res2 = res.replace("__","_")
+        rparents, rlabels, rspecies = getMinSGTFromArrays(gparents, glabels, gspecies, sparents, slabels, False, cparents, clabels, self.context.sgtCache)
 
-        returned_tree = TreeClass(res2.strip().split("\n")[-1])
+        #Building the resulted tree
+        returned_tree, _ = TreeUtils.fromParentArray(rparents, rlabels)
+        if returned_tree is None:
+            returned_tree = TreeClass()
 
         self.logger.debug(returned_tree)
 
         #Adding the resulted tree to the clades to preserve
-        clades_to_preserve_sgt.append(returned_tree)
+        clade = CompactTree.fromTreeClass(returned_tree)
+        with self.context.lock:
+            clades_to_preserve_sgt.append(clade)
+        self.sgtClades.append(clade)
 
         return returned_tree
 
 
 
     def mergeResolutions(self):
-        """Using the different kind of resolutions according to the labeling of the gene trees
+        """Resolving the tree of genes, with the instances created for its subtrees (see mergeSteps)"""
+
+        self.context.getScheduler().run(self, self.mergeSteps())
+
+
+
+    def mergeSteps(self):
+        """Steps of mergeResolutions (see Scheduler).
+        Using the different kind of resolutions according to the labeling of the gene trees
         - M-PolyRes if the covering set of trees is the leafset of the geneTrees
         - PolyRes if all terminal edges are labeled 1 and all non-terminal edges are labelled 0
         - MinTRS if all terminal edges are labeled 0 and all non-terminal are labelled 1 (not implemented yet, considered as a global case)
@@ -548,46 +803,34 @@ class LabelGTC:
 
         #Testing other cases
         else:
-            for g_node in self.genesTree.traverse("levelorder"):
-
-                #Not considering the root
-                if not (g_node.is_root() or g_node.has_feature('root')):
-
-                    #Processing on non-terminal edges
-                    if g_node.cst == 0:
-
-                        if g_node.binconfidence == 1:
-                            polyResCompatible = False
-                            minSGTCompatible = False
-                            cpt += 1
-
-                        elif g_node.binconfidence == 0:
-                            minTRSCompatible = False
-                            cpt += 1
-
-                    #Processing on terminal edges
-                    elif g_node.cst == 2:
-
-                        if g_node.binconfidence == 0:
-                            polyResCompatible = False
-                            cpt += 1
-
-                        elif g_node.binconfidence == 1:
-                            minTRSCompatible = False
-                            minSGTCompatible = False
-                            cpt += 1
-
-                    #Global case detected
-                    if (not polyResCompatible) and (not minTRSCompatible) and (not minSGTCompatible):
-                        break
-
-            global special_case
+            #Not considering the root
+            start, end = self.node + 1, self.ctree.end[self.node]
+            cst = self.ctree.labels['cst'][start:end]
+            binconfidence = self.ctree.labels['binconfidence'][start:end]
+
+            #Processing on non-terminal edges
+            nonterminal = cst == 0
+            #Processing on terminal edges
+            terminal = cst == 2
+
+            if np.any(nonterminal & (binconfidence == 1)):
+                polyResCompatible = False
+                minSGTCompatible = False
+            if np.any(nonterminal & (binconfidence == 0)):
+                minTRSCompatible = False
+            if np.any(terminal & (binconfidence == 0)):
+                polyResCompatible = False
+            if np.any(terminal & (binconfidence == 1)):
+                minTRSCompatible = False
+                minSGTCompatible = False
+
+            cpt = int(np.count_nonzero(nonterminal) + np.count_nonzero(terminal))
 
             #PolyRes case detected
             if polyResCompatible:
                 self.logger.debug("-------> Using polyRes algorithm")
 
-                special_case = True
+                self.context.special_case = True
 
                 self.case = "polyres"
 
@@ -598,12 +841,12 @@ class LabelGTC:
             if minTRSCompatible and cpt > 2:
                 self.logger.debug("-------> Using minTRS algorithm")
 
-                special_case = True
+                self.context.special_case = True
 
                 self.case = "global"
 
                 #Referring to the global case as minTRS resolution is not implemented
-                self.resultedTree = self.globalProcessing()
+                yield self.globalSteps()
 
             #MinSGT case detected, considered as a global case
             if minSGTCompatible:
@@ -612,7 +855,7 @@ class LabelGTC:
                 self.case = "global"
 
                 #Using the global case processing to resolve the tree
-                self.resultedTree = self.globalProcessing()
+                yield self.globalSteps()
 
             #No special case detected
             if not (polyResCompatible or minTRSCompatible or minSGTCompatible):
@@ -621,4 +864,6 @@ class LabelGTC:
                 self.case = "global"
 
                 #Using the global case processing to resolve the tree
-                self.resultedTree = self.globalProcessing()
+                yield self.globalSteps()
+
+        self.context.addCase(self.case)
@@ -0,0 +1,192 @@
+"""
+Bounded cache of the resolutions of subtrees, shared by the corrections of the gene families of a database
+"""
+
+"""
+The same polytomies and minSGT subproblems are met again and again, in the different gene families
+and in the instances of a single correction. A resolution only depends on the topology of the subproblem
+and on the species of its leaves, so it is stored once by canonical form (the children of each node being
+sorted by their own canonical form, the leaves being written with their species), the leaves of the
+resolution being given by their position in the canonical order. The labels of the genes tree (cst,
+binconfidence) are part of the key through the subproblem they give : the polytomy left by PolyRes or
+M-PolyRes, or the covering subtrees and the clades to preserve of minSGT.
+
+The cache can be saved to a file and loaded again for the next runs.
+"""
+
+import os
+import cPickle as pickle
+
+from ..SGT import SGTCache
+from ..TreeLib import TreeUtils, CompactTree
+
+
+def canonicalTree(tree, leafKey):
+    """Canonical string of a tree up to leaf relabelling, the leaves being written with leafKey(name).
+    Return (canon, leaves), leaves being the names of the leaves in canonical order"""
+
+    ctree = CompactTree.fromTreeClass(tree)
+    n = len(ctree)
+    parent = ctree.parent.tolist()
+    names = [ctree.names[j] for j in ctree.name.tolist()]
+
+    children = [[] for i in xrange(n)]
+    for i in xrange(1, n):
+        children[parent[i]].append(i)
+
+    # the children have larger ids than their parent in preorder
+    canon = [None] * n
+    for i in xrange(n - 1, -1, -1):
+        if children[i]:
+            children[i].sort(key=canon.__getitem__)
+            canon[i] = "(" + ",".join([canon[c] for c in children[i]]) + ")"
+        else:
+            canon[i] = leafKey(names[i])
+
+    leaves = []
+    stack = [0] if n else []
+    while stack:
+        i = stack.pop()
+        if children[i]:
+            stack.extend(reversed(children[i]))
+        else:
+            leaves.append(names[i])
+
+    return (canon[0] if n else ""), leaves
+
+
+
+class ResolutionCache(SGTCache):
+
+    """
+    Cache of the resolutions of PolyRes, M-PolyRes and minSGT, with LRU eviction once it holds more than
+    maxsize resolutions or more than maxnodes nodes (None for no limit). It can be given wherever an SGT.SGTCache
+    is expected (LabelGTCContext, BatchUtils), and is then also used by polyRes. The hits and misses are
+    counted for each kind of resolution ('polyres', 'm-polyres', 'minsgt'), see stats.
+    When path is given, the cache is loaded from this file if it exists, and save() writes it there.
+    The cache can be used by several threads.
+    """
+
+    def __init__(self, maxsize=1024, maxnodes=None, path=None):
+        SGTCache.__init__(self, maxsize)
+        self.maxnodes = maxnodes
+        self.nodes = 0
+        self.evictions = 0
+        self.kinds = {}
+        self.indexes = {}
+        self.path = path
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+
+    def __repr__(self):
+        return "ResolutionCache(maxsize=%d, size=%d, nodes=%d, hits=%d, misses=%d)" % (self.maxsize, len(self.entries), self.nodes, self.hits, self.misses)
+
+
+    def clear(self):
+        with self.lock:
+            SGTCache.clear(self)
+            self.nodes = 0
+            self.evictions = 0
+            self.kinds = {}
+            self.indexes = {}
+
+
+    def stats(self):
+        """Return the size of the cache, and its hits, misses and hit rate, overall and for each kind of resolution"""
+        with self.lock:
+            stats = SGTCache.stats(self)
+            stats.update(nodes=self.nodes, maxnodes=self.maxnodes, evictions=self.evictions, hitRate=self._hitRate(self.hits, self.misses))
+            for kind, (hits, misses) in self.kinds.iteritems():
+                stats[kind] = {'hits': hits, 'misses': misses, 'hitRate': self._hitRate(hits, misses)}
+            return stats
+
+
+    @staticmethod
+    def _hitRate(hits, misses):
+        return float(hits) / (hits + misses) if hits + misses else 0.0
+
+
+    def indexId(self, speciesIndex):
+        """Return the identifier of the species tree of a SpeciesTreeIndex (see speciesId), computed once for each index"""
+        with self.lock:
+            if speciesIndex not in self.indexes:
+                sparents, slabels, _ = speciesIndex.parentArray()
+                self.indexes[speciesIndex] = self.speciesId(sparents, slabels)
+            return self.indexes[speciesIndex]
+
+
+    def get(self, key, kind='minsgt'):
+        """Return the resolution stored for key (None if there is none), counted as a resolution of kind"""
+        with self.lock:
+            value = SGTCache.get(self, key)
+            counts = self.kinds.setdefault(kind, [0, 0])
+            counts[value is None] += 1
+            return value
+
+
+    def put(self, key, value):
+        """Store the resolution value of key, value[0] being its parent index array"""
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nodes -= len(old[0])
+            self.entries[key] = value
+            self.nodes += len(value[0])
+            while len(self.entries) > self.maxsize or (self.maxnodes is not None and self.nodes > self.maxnodes and len(self.entries) > 1):
+                _, old = self.entries.popitem(last=False)
+                self.nodes -= len(old[0])
+                self.evictions += 1
+
+
+    def treeKey(self, tree, speciesIndex, costs=()):
+        """Return (key, leaves) for the resolution of tree by a polytomy solver against the SpeciesTreeIndex speciesIndex,
+        with the given costs. The species of a leaf is given by its name (gene_species), leaves being the
+        leaf names in the canonical order of tree"""
+        name2id = speciesIndex.name2id
+        canon, leaves = canonicalTree(tree, lambda name: str(name2id.get(name.split("_", 1)[-1], name)))
+        return ('polytomy', self.indexId(speciesIndex), tuple(costs), canon), leaves
+
+
+    def getTree(self, kind, key, leaves):
+        """Return the TreeClass of the resolution stored for key, with the leaves given by treeKey (None if there is none)"""
+        value = self.get(key, kind)
+        if value is None:
+            return None
+        parents, labels = value
+        tree, _ = TreeUtils.fromParentArray(parents, [leaves[l] if isinstance(l, int) else l for l in labels])
+        return tree
+
+
+    def putTree(self, key, tree, leaves):
+        """Store the TreeClass tree as the resolution of key, with the leaves given by treeKey"""
+        position = dict((name, pos) for pos, name in enumerate(leaves))
+        parents, labels, _ = TreeUtils.toParentArray([tree])
+        self.put(key, (tuple(parents), tuple([position.get(label, label) for label in labels])))
+
+
+    def save(self, path=None):
+        """Write the resolutions of the cache to path (by default the one the cache was created with)"""
+        path = path or self.path
+        with self.lock:
+            state = {'entries': list(self.entries.iteritems()), 'species': self.species}
+            # written to a temporary file first, so that an interrupted save does not lose the previous cache
+            with open(path + ".tmp", 'wb') as OUTPUT:
+                pickle.dump(state, OUTPUT, pickle.HIGHEST_PROTOCOL)
+        os.rename(path + ".tmp", path)
+
+
+    def load(self, path):
+        """Add the resolutions saved in path to the cache"""
+        with open(path, 'rb') as INPUT:
+            state = pickle.load(INPUT)
+        with self.lock:
+            # the species trees are renumbered, as this cache may already know other species trees
+            renumber = dict((oldId, self.speciesId(*sptree)) for sptree, oldId in state['species'].iteritems())
+            for key, value in state['entries']:
+                if key[0] == 'polytomy':
+                    key = (key[0], renumber[key[1]]) + key[2:]
+                else:
+                    key = (renumber[key[0]],) + key[1:]
+                self.put(key, value)
@@ -0,0 +1,120 @@
+"""
+Work queue resolving the instances of LabelGTC of a correction without recursion
+"""
+
+"""
+The resolution of an instance of LabelGTC is written as a generator of steps. A step runs until the
+instance needs other work to be done first, and yields it :
+    - a list of new instances (the subtrees to resolve) : the generator is resumed with the list of their
+      resolved subtrees (getResolvedSubtree) once they are all resolved
+    - another generator of steps : it is run first, and the generator is resumed with None when it is over
+The scheduler keeps the instances waiting for their subtrees, and runs all the steps that are ready
+at once with an executor, bottom-up, until the root instance is resolved. The subtrees of an instance
+are independent, so their steps can be run concurrently.
+
+An executor is any object with a map(function, iterable) method returning the list of the results
+in order, as multiprocessing.pool.ThreadPool. The steps share the context of the correction and
+are not picklable, so they can't be run in other processes.
+"""
+
+import types
+from multiprocessing.pool import ThreadPool
+
+
+class SerialExecutor(object):
+
+    """Executor running the steps one after the other, in the current thread"""
+
+    def map(self, function, iterable):
+        return [function(x) for x in iterable]
+
+
+
+class _Task(object):
+
+    """An instance being resolved, with the stack of its running generators of steps"""
+
+    def __init__(self, instance, steps, parent=None, index=0):
+        self.instance = instance
+        self.stack = [steps]
+        self.parent = parent
+        self.index = index
+        #Value sent to the generator when it is resumed
+        self.value = None
+        #Subtrees being resolved, and their resolved subtrees
+        self.pending = 0
+        self.results = []
+
+
+
+def _advance(task):
+    """Run the steps of a task until it yields new instances, return them (None when the task is over)"""
+    while task.stack:
+        value, task.value = task.value, None
+        try:
+            request = task.stack[-1].send(value)
+        except StopIteration:
+            task.stack.pop()
+            continue
+        if isinstance(request, types.GeneratorType):
+            task.stack.append(request)
+        elif request:
+            return request
+        else:
+            #No subtree to resolve
+            task.value = []
+    return None
+
+
+
+class SubtreeScheduler(object):
+
+    """
+    Resolve an instance of LabelGTC and all the instances created for its subtrees, from their generators of steps.
+    The ready steps are run with executor (a SerialExecutor by default, or a pool of threads threads if threads > 1)
+    """
+
+    def __init__(self, executor=None, threads=1):
+        self.executor = executor
+        self.threads = threads
+
+
+
+    def run(self, instance, steps):
+        """Run the generator of steps of instance and the ones of the instances it creates, until it is over"""
+
+        pool = None
+        executor = self.executor
+        if executor is None:
+            if self.threads > 1:
+                executor = pool = ThreadPool(self.threads)
+            else:
+                executor = SerialExecutor()
+
+        try:
+            ready = [_Task(instance, steps)]
+            while ready:
+                requests = executor.map(_advance, ready)
+                tasks, ready = ready, []
+
+                for task, request in zip(tasks, requests):
+
+                    #New instances to resolve before resuming the task
+                    if request is not None:
+                        task.pending = len(request)
+                        task.results = [None] * len(request)
+                        for i, subinstance in enumerate(request):
+                            ready.append(_Task(subinstance, subinstance.resolveSteps(), task, i))
+
+                    #The task is over, its parent is resumed when all its subtrees are resolved
+                    elif task.parent is not None:
+                        parent = task.parent
+                        parent.results[task.index] = task.instance.getResolvedSubtree()
+                        parent.pending -= 1
+                        if parent.pending == 0:
+                            parent.value = parent.results
+                            ready.append(parent)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
@@ -1,2 +1,5 @@
-from LabelGTCRec import LabelGTC
-__all__ = ["LabelGTC"]
+from LabelGTCRec import LabelGTC, LabelGTCContext, ThresholdSweep
+from Scheduler import SubtreeScheduler, SerialExecutor
+from ResolutionCache import ResolutionCache
+import BatchUtils
+__all__ = ["LabelGTC", "LabelGTCContext", "ThresholdSweep", "SubtreeScheduler", "SerialExecutor", "ResolutionCache", "BatchUtils"]
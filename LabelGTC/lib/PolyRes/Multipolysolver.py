@@ -4,6 +4,7 @@ Date: 05/2014
 MultiPolysolver is a python module for polytomy solving
 """
 
+import itertools
 import numpy
 import random
 from pprint import pprint
@@ -14,104 +15,113 @@ from ..TreeLib import *
 Gene matrix are represented by a numpy array
 """
 
-DUP = 'd'
-LOST = 'l'
-SPEC = 's'
+# events of the path table, as bits of a uint8 : a case can be reached by several events
+SPEC = 1
+LOST = 2
+DUP = 4
+# set on a case whose lost was found before its duplication
+LOST_FIRST = 8
 PARTIAL_RESOLUTION_ITERATOR = 1
 numpy.set_printoptions(threshold='nan', precision=10)
 
 
-@memorize
-def polySolver(genetree, specietree, gene_matrix, node_order, limit=-1, cluster_method='upgma', verbose=False, mode="solve"):
+# bounded, so that long batch runs do not keep the tables of all the polytomies met. The key given by the callers
+# includes params.costKey, so that a table computed with previous costs is not reused
+@memorize(maxsize=512)
+def polySolver(genetree, specietree, gene_matrix, node_order, limit=-1, cluster_method='upgma', verbose=False, mode="solve", spindex=None):
     """This assume we that we are using the correct specietree for this genetree
-    the specie tree root is the latest common ancestor of all the specie in genetree"""
+    the specie tree root is the latest common ancestor of all the specie in genetree.
+    specietree is pruned, so it should be a copy. When spindex, the SpeciesTreeIndex of the species tree
+    specietree is a copy of, is given, the costs of the species are read from its params.costTable"""
     count = TreeUtils.getSpecieCount(
         genetree)  # number of specie in the genetree
     max_y = max(count.values()) + 1
     # assigning a correspondance between each row and a node
-    # the assignment is done in level order
-    polytomy_specie_set, row_node_corr = findMaxX(genetree, specietree)
+    # the assignment is done in level order, so the children of a node have smaller rows
+    polytomy_specie_set, row_node_corr, child_rows = findMaxX(genetree, specietree)
     max_x = len(polytomy_specie_set)
     # cost cost_table to fill
     cost_table = numpy.zeros((max_x, max_y), dtype=float)
-    # table to save the possible path
-    path_table = numpy.ndarray((max_x, max_y), dtype='object')
+    # table to save the possible path, as a bitmask of the events that reach each case (0 for none)
+    path_table = numpy.zeros((max_x, max_y), dtype=numpy.uint8)
+    # the costs of the species of each row, by species id in the cost table of the index,
+    # or read once from params for each row of a species tree without index
+    if spindex is not None:
+        table = params.costTable(spindex)
+        ids = [spindex.name2id[row_node_corr[n].name] for n in xrange(max_x)]
+        dupcost = numpy.asarray(table.dup[ids], dtype=float)
+        losscost = numpy.asarray(table.loss[ids], dtype=float)
+    else:
+        dupcost = numpy.array([params.getdup(row_node_corr[n]) for n in xrange(max_x)], dtype=float)
+        losscost = numpy.array([params.getloss(row_node_corr[n]) for n in xrange(max_x)], dtype=float)
+    # We have zeropos when the number of node from a specie is the same as the column number
+    zeropos = numpy.array([count[row_node_corr[n].name] - 1 for n in xrange(max_x)], dtype=int)
 
     # fill the cost_table and the path_table
 
-    for n in xrange(0, max_x):
-        node = row_node_corr[n]
-        zeropos = count[node.name] - 1
-        # We have zeropos when the number of node from a specie is the same as the column number
-        # Fill the table, using the next/previous case cost
-        # The node is a leaf, just fill with dupcost and losscost
-        if(node.is_leaf()):
-            # find the column with a cost of zero (zeropos) and fill the table
-            # according to this position
-            # by default, all the position in the table are 0
-            i = zeropos - 1
+    # The leaves are filled all at once with dupcost before zeropos and losscost after it,
+    # the costs being accumulated one case after the other from zeropos (cost 0), as cumsum does
+    leaves = numpy.nonzero(child_rows[:, 0] < 0)[0]
+    columns = numpy.arange(max_y)
+    before = columns < zeropos[leaves, None]
+    after = columns > zeropos[leaves, None]
+    dups = numpy.where(before, dupcost[leaves, None], 0.0)
+    losses = numpy.where(after, losscost[leaves, None], 0.0)
+    cost_table[leaves] = numpy.cumsum(dups[:, ::-1], axis=1)[:, ::-1] + numpy.cumsum(losses, axis=1)
+    path_table[leaves] = numpy.where(before, DUP, numpy.where(after, LOST, 0))
+
+    # Then the internal nodes, bottom-up (their children have smaller rows)
+    for n in numpy.nonzero(child_rows[:, 0] >= 0)[0]:
+        l_child_id, r_child_id = child_rows[n]
+        zp = zeropos[n]
+        # Fill the table using only the speciation cost(sum of the
+        # children's cost of this node)
+        shift = max_y - zp - 1
+        cost_table[n, :zp + 1] = numpy.inf
+        cost_table[n, zp + 1:] = cost_table[l_child_id, :shift] + cost_table[r_child_id, :shift]
+        path_table[n, zp + 1:] = SPEC
+
+        # Find all the min score position and try to minimize the score of its
+        # neighborhood by lost/dup cost
+        # (each case depends on the one updated just before, so this stays a loop)
+        costs = cost_table[n]
+        row_paths = path_table[n]
+        dup, loss = dupcost[n], losscost[n]
+        minpos = numpy.where(costs == costs.min())
+        for pos in minpos[0]:
+            i = pos - 1
             while(i >= 0):
-                cost_table[n, i] = cost_table[n, i + 1] + params.getdup(node)
-                path_table[n, i] = DUP
+                if(costs[i] == costs[i + 1] + dup):
+                    if not row_paths[i] & DUP:
+                        row_paths[i] |= DUP | (LOST_FIRST if row_paths[i] & LOST else 0)
+                elif (costs[i] > costs[i + 1] + dup):
+                    costs[i] = costs[i + 1] + dup
+                    row_paths[i] = DUP
                 i -= 1
-            i = zeropos + 1
+
+            i = pos + 1
             while(i < max_y):
-                cost_table[n, i] = cost_table[n, i - 1] + params.getloss(node)
-                path_table[n, i] = LOST
+                if(costs[i] == costs[i - 1] + loss):
+                    row_paths[i] |= LOST
+                elif (costs[i] > costs[i - 1] + loss):
+                    costs[i] = costs[i - 1] + loss
+                    row_paths[i] = LOST
                 i += 1
-            # We should take into account the special case here
-        # Here we have an internal node (not a leaf in the genetree)
-        else:
-            l_child_id = [key for key, value in row_node_corr.iteritems() if(
-                value == node.get_child_at(0))][0]
-            r_child_id = [key for key, value in row_node_corr.iteritems() if(
-                value == node.get_child_at(1))][0]
-            # Fill the table using only the speciation cost(sum of the
-            # children's cost of this node)
-            for k in xrange(0, max_y):
-                if(k > zeropos):
-                    cost_table[n, k] = cost_table[
-                        l_child_id, k - zeropos - 1] + cost_table[r_child_id, k - zeropos - 1]
-                    path_table[n, k] = SPEC
-                else:
-                    cost_table[n, k] = numpy.inf
-
-            # Find all the min score position and try to minimize the score of its
-            # neighborhood by lost/dup cost
-            minpos = numpy.where(cost_table[n, :] == cost_table[n, :].min())
-            for pos in minpos[0]:
-                i = pos - 1
-                while(i >= 0):
-                    if(cost_table[n, i] == cost_table[n, i + 1] + params.getdup(node)):
-                        if DUP not in path_table[n, i]:
-                            path_table[n, i] += DUP
-                    elif (cost_table[n, i] > cost_table[n, i + 1] + params.getdup(node)):
-                        cost_table[n, i] = min(
-                            cost_table[n, i + 1] + params.getdup(node), cost_table[n, i])
-                        path_table[n, i] = DUP
-                    i -= 1
-
-                i = pos + 1
-                while(i < max_y):
-                    if(cost_table[n, i] == cost_table[n, i - 1] + params.getloss(node)):
-                        if LOST not in path_table[n, i]:
-                            path_table[n, i] += LOST
-                    elif (cost_table[n, i] > cost_table[n, i - 1] + params.getloss(node)):
-                        cost_table[n, i] = min(
-                            cost_table[n, i - 1] + params.getloss(node), cost_table[n, i])
-                        path_table[n, i] = LOST
-                    i += 1
 
     # find the shape of the cost_table
     xsize, ysize = cost_table.shape
     if(mode is not "solve"):
         return cost_table, row_node_corr
     else:
+        # the paths are generated one by one, and only the limit first ones are built
         paths = findPathFromTable(
-            path_table, row_node_corr, count, xsize - 1, 0)
+            path_table, row_node_corr, count, xsize - 1, 0, child_rows)
+        if(limit > 0):
+            paths = itertools.islice(paths, limit)
         solution = []
 
         if(verbose):
+            paths = list(paths)
             print("Matrix M: \n")
             print(cost_table)
             print()
@@ -132,116 +142,110 @@ def polySolver(genetree, specietree, gene_matrix, node_order, limit=-1, cluster_
                 print(path)
             print()
 
-        i = 1
         for path in paths:
-            if(limit > 0 and i > limit):
-                break
             solution.append(constructFromPath(path, genetree, specietree, numpy.copy(gene_matrix), node_order[
                             :], verbose=verbose, method=cluster_method, cost=cost_table[xsize - 1, 0]))
-            i += 1
 
         return solution
 
 
-def findSpeciationPathFromTable(path_table, row_node_corr, count, xpos, ypos):
-    """DEBUG, choose the path that privilegie speciation only"""
+def _replay(cache, paths):
+    """Iterate over the paths already kept in cache, then over the next ones of the generator paths,
+    which are kept in cache for the next iterations"""
+    for path in cache:
+        yield path
+    for path in paths:
+        cache.append(path)
+        yield path
+
+
+def _childRows(row_node_corr, xpos, child_rows=None):
+    """Rows of the two children of the species of the row xpos, read in child_rows (see findMaxX) when it is given"""
+    if child_rows is not None:
+        return child_rows[xpos]
+    # this is bad for perfomance
+    spec_pos_1 = [x for x in row_node_corr.keys() if row_node_corr[
+        xpos].get_child_at(0) == row_node_corr[x]][0]
+    spec_pos_2 = [x for x in row_node_corr.keys() if row_node_corr[
+        xpos].get_child_at(1) == row_node_corr[x]][0]
+    return spec_pos_1, spec_pos_2
 
-    chemin = []
-    if(row_node_corr[xpos].is_leaf() and (ypos < 0 or path_table[xpos, ypos] is None)):
-        case = row_node_corr[xpos].name + ':%i' % (ypos + 1)
-        chemin.append(case)
+
+def _events(events):
+    """The events of a case, in the order they were found when filling the path table :
+    the speciation first, then the duplication and the lost, unless the lost was found first"""
+    order = (SPEC, LOST, DUP) if events & LOST_FIRST else (SPEC, DUP, LOST)
+    return [event for event in order if events & event]
+
+
+def findSpeciationPathFromTable(path_table, row_node_corr, count, xpos, ypos, child_rows=None):
+    """DEBUG, choose the path that privilegie speciation only.
+    The paths are generated one by one"""
+
+    case = row_node_corr[xpos].name + ':%i' % (ypos + 1)
+    if(row_node_corr[xpos].is_leaf() and (ypos < 0 or path_table[xpos, ypos] == 0)):
+        yield case
     else:
+        events = path_table[xpos, ypos]
         # each case can have multiple path
-        if 's' in path_table[xpos, ypos]:
-            # this is bad for perfomance
-            spec_pos_1 = [x for x in row_node_corr.keys() if row_node_corr[
-                xpos].get_child_at(0) == row_node_corr[x]][0]
-            spec_pos_2 = [x for x in row_node_corr.keys() if row_node_corr[
-                xpos].get_child_at(1) == row_node_corr[x]][0]
-            snode = row_node_corr[xpos].name
-            nb_node = count[snode]
-            spec_1 = findSpeciationPathFromTable(
-                path_table, row_node_corr, count, spec_pos_1, ypos - nb_node)
+        if events & SPEC:
+            spec_pos_1, spec_pos_2 = _childRows(row_node_corr, xpos, child_rows)
+            nb_node = count[row_node_corr[xpos].name]
             spec_2 = findSpeciationPathFromTable(
-                path_table, row_node_corr, count, spec_pos_2, ypos - nb_node)
+                path_table, row_node_corr, count, spec_pos_2, ypos - nb_node, child_rows)
+            cache = []
             # add all possible path from the children
-            chemin.extend([",".join([row_node_corr[xpos].name + ':%i' %
-                                     (ypos + 1), path1, path2]) for path1 in spec_1 for path2 in spec_2])
-
-        else:
-            c = path_table[xpos, ypos][0]
-            if c == 'd':
-                dup = findSpeciationPathFromTable(
-                    path_table, row_node_corr, count, xpos, ypos + 1)
-                # add possible path of the case that lead to this duplication
-                chemin.extend(
-                    [",".join([row_node_corr[xpos].name + ':%i' % (ypos + 1), path1]) for path1 in dup])
-
-            # instead we found a lost
-            elif c == 'l':
-                lost = findSpeciationPathFromTable(
-                    path_table, row_node_corr, count, xpos, ypos - 1)
-                # add possible path of the case that lead to this lost
-                chemin.extend(
-                    [",".join([row_node_corr[xpos].name + ':%i' % (ypos + 1), path1]) for path1 in lost])
+            for path1 in findSpeciationPathFromTable(path_table, row_node_corr, count, spec_pos_1, ypos - nb_node, child_rows):
+                for path2 in _replay(cache, spec_2):
+                    yield ",".join([case, path1, path2])
 
-    # return a list of path, the path are specially formated string
-    return chemin
+        # the first event found for the case, without speciation
+        elif events:
+            step = 1 if _events(events)[0] == DUP else -1
+            # add possible path of the case that lead to this duplication or lost
+            for path1 in findSpeciationPathFromTable(path_table, row_node_corr, count, xpos, ypos + step, child_rows):
+                yield ",".join([case, path1])
 
 
-def findPathFromTable(path_table, row_node_corr, count, xpos, ypos):
-    """ Find all the possible path from the lower left case to the leaves"""
+def findPathFromTable(path_table, row_node_corr, count, xpos, ypos, child_rows=None):
+    """ Find all the possible path from the lower left case to the leaves.
+    The paths (specially formated strings) are generated one by one, so that only the ones
+    that are used are enumerated"""
 
-    chemin = []
+    case = row_node_corr[xpos].name + ':%i' % (ypos + 1)
     # Case 1: current position correspond to a leaf
-    if(row_node_corr[xpos].is_leaf() and (ypos < 0 or path_table[xpos, ypos] is None)):
-        case = row_node_corr[xpos].name + ':%i' % (ypos + 1)
-        chemin.append(case)
+    if(row_node_corr[xpos].is_leaf() and (ypos < 0 or path_table[xpos, ypos] == 0)):
+        yield case
 
     # Case 2 : this a internal node
     else:
-        # each case can have multiple path
-        for c in path_table[xpos, ypos]:
+        events = path_table[xpos, ypos]
+        # each case can have multiple path, enumerated in the order they were found
+        for event in _events(events):
 
             # we found a speciation
-            if c == 's':
-                # this is bad for perfomance
-                spec_pos_1 = [x for x in row_node_corr.keys() if row_node_corr[
-                    xpos].get_child_at(0) == row_node_corr[x]][0]
-                spec_pos_2 = [x for x in row_node_corr.keys() if row_node_corr[
-                    xpos].get_child_at(1) == row_node_corr[x]][0]
-                snode = row_node_corr[xpos].name
-                nb_node = count[snode]
-                spec_1 = findPathFromTable(
-                    path_table, row_node_corr, count, spec_pos_1, ypos - nb_node)
+            if event == SPEC:
+                spec_pos_1, spec_pos_2 = _childRows(row_node_corr, xpos, child_rows)
+                nb_node = count[row_node_corr[xpos].name]
                 spec_2 = findPathFromTable(
-                    path_table, row_node_corr, count, spec_pos_2, ypos - nb_node)
+                    path_table, row_node_corr, count, spec_pos_2, ypos - nb_node, child_rows)
+                cache = []
                 # add all possible path from the children
-                for path1 in spec_1:
-                    for path2 in spec_2:
-                        chemin.append(
-                            ",".join([row_node_corr[xpos].name + ':%i' % (ypos + 1), path1, path2]))
+                for path1 in findPathFromTable(path_table, row_node_corr, count, spec_pos_1, ypos - nb_node, child_rows):
+                    for path2 in _replay(cache, spec_2):
+                        yield ",".join([case, path1, path2])
 
             # we found a duplication
-            elif c == 'd':
-                dup = findPathFromTable(
-                    path_table, row_node_corr, count, xpos, ypos + 1)
+            elif event == DUP:
                 # add possible path of the case that lead to this duplication
-                for path1 in dup:
-                    chemin.append(
-                        ",".join([row_node_corr[xpos].name + ':%i' % (ypos + 1), path1]))
+                for path1 in findPathFromTable(path_table, row_node_corr, count, xpos, ypos + 1, child_rows):
+                    yield ",".join([case, path1])
 
             # instead we found a lost
-            elif c == 'l':
-                lost = findSpeciationPathFromTable(
-                    path_table, row_node_corr, count, xpos, ypos - 1)
+            elif event == LOST:
                 # add possible path of the case that lead to this lost
-                for path1 in lost:
-                    chemin.append(
-                        ",".join([row_node_corr[xpos].name + ':%i' % (ypos + 1), path1]))
-
-    # return a list of path, the path are specially formated string
-    return chemin
+                for path1 in findSpeciationPathFromTable(path_table, row_node_corr, count, xpos, ypos - 1, child_rows):
+                    yield ",".join([case, path1])
 
 
 def constructFromPath(chemin, genetree, specietree, gene_matrix, node_order, verbose=False, method='upgma', cost=0):
@@ -601,42 +605,64 @@ def _compute_mult(polytomy, lcamap):
 
 
 def findMaxX(polytomy, specietree):
-    """Find Number of Specie and the specie list in order to create and fill the dup/cost matrix"""
+    """Find Number of Specie and the specie list in order to create and fill the dup/cost matrix.
+    The subtree of the species of the polytomy is pruned of the nodes that are not needed.
+    Return (polytomy_name_set, row_node_corr, child_rows), child_rows[n] being the rows of the two
+    children of the species of the row n (-1 for a leaf)"""
     if not polytomy.has_feature('species'):
         lcamap = TreeUtils.lcaMapping(
             polytomy, specietree, multspeciename=False)
 
     polytomy_specie_ancestor = (specietree & polytomy.species)
     polytomy_name_set = set(polytomy.get_children_species())
-
-    for leaf in polytomy_specie_ancestor.traverse("postorder"):
-        parent = leaf.up
-        if(not leaf.is_leaf()):
-            if(len(set(leaf.get_descendant_name()).intersection(polytomy_name_set)) == 0):
-                parent.remove_child(leaf)
-
-            else:
-                polytomy_name_set.add(leaf.name)
-
+    nodes = list(polytomy_specie_ancestor.traverse("postorder"))
+
+    # the subtree of the node contains a species of the polytomy
+    has_species = {}
+    for node in nodes:
+        has_species[node] = node.name in polytomy_name_set or any(has_species[c] for c in node.children)
+
+    # A node is kept when one of its children was kept. Else, it is kept when its parent has
+    # another descendant in polytomy_name_set : a kept sibling before it (the kept nodes are added
+    # to the set), a species of the polytomy after it, or itself
+    kept = []
+    for node in nodes:
+        parent = node.up
+        if node.children or parent is None or node.name in polytomy_name_set:
+            kept.append(node)
+            continue
+        siblings = parent.children
+        i = siblings.index(node)
+        if i > 0 or any(has_species.get(sibling, False) for sibling in siblings[i + 1:]):
+            kept.append(node)
         else:
-            if(parent is not None) and (len(set(parent.get_descendant_name()).intersection(polytomy_name_set)) == 0):
-                parent.remove_child(leaf)
-            else:
-                polytomy_name_set.add(leaf.name)
+            parent.remove_child(node)
+    polytomy_name_set.update(node.name for node in kept)
 
     row_node_corr = {}
+    node_row = {}
     n_row = len(polytomy_name_set) - 1
 
-    for node in specietree.traverse("levelorder"):
-        if(node.name in polytomy_name_set):
-            row_node_corr[n_row] = node
-            n_row -= 1
+    for node in polytomy_specie_ancestor.traverse("levelorder"):
+        row_node_corr[n_row] = node
+        node_row[node] = n_row
+        n_row -= 1
+
+    child_rows = numpy.full((len(row_node_corr), 2), -1, dtype=int)
+    for n, node in row_node_corr.iteritems():
+        if not node.is_leaf():
+            child_rows[n] = node_row[node.get_child_at(0)], node_row[node.get_child_at(1)]
 
-    return polytomy_name_set, row_node_corr
+    return polytomy_name_set, row_node_corr, child_rows
 
 
 def solvePolytomy(genetree, specietree, gene_matrix, node_order, verbose=False, path_limit=-1, method='upgma', sol_limit=-1):
 
+    # The species tree can be given by its SpeciesTreeIndex, the costs being then read from its cost table
+    spindex = specietree if isinstance(specietree, SpeciesTreeIndex) else None
+    if spindex is not None:
+        specietree = spindex.tree
+
     # Start with only one polytomy
 
     nb_polytomy = 0
@@ -657,7 +683,7 @@ def solvePolytomy(genetree, specietree, gene_matrix, node_order, verbose=False,
                 matrice, order = polytomyPreprocess(
                     ptree, sptree, matrice, order, method=method)
                 solution = polySolver(TreeUtils.treeHash(ptree, addinfos=str(
-                    path_limit) + method), ptree, sptree, matrice, order, path_limit, cluster_method=method, verbose=verbose)
+                    path_limit) + method + params.costKey(spindex)), ptree, sptree, matrice, order, path_limit, cluster_method=method, verbose=verbose, spindex=spindex)
                 # solution=polySolver(ptree,sptree, matrice, order,path_limit, cluster_method=method, verbose=verbose)
                 if(poly_parent is None):
                     # Here we have the root. Complete solution are here
@@ -690,6 +716,10 @@ def computePolytomyReconCost(genetree, specietree, verbose=False):
     """This is a copy pasta from the solvePolytomy function that return only the cost of a node
     """
     recon_cost = 0
+    # The species tree can be given by its SpeciesTreeIndex, the costs being then read from its cost table
+    spindex = specietree if isinstance(specietree, SpeciesTreeIndex) else None
+    if spindex is not None:
+        specietree = spindex.tree
     # genetree = origene.copy(method="simplecopy")
     lcamap = TreeUtils.lcaMapping(genetree, specietree, multspeciename=False)
 
@@ -710,7 +740,7 @@ def computePolytomyReconCost(genetree, specietree, verbose=False):
             # find the solution cost at [-1, 0]
             sptree = specietree.copy("simplecopy")
             mat_table, row_node = polySolver(TreeUtils.treeHash(
-                node), node, sptree, None, [], 1, verbose=verbose, mode="none")
+                node, addinfos=params.costKey(spindex)), node, sptree, None, [], 1, verbose=verbose, mode="none", spindex=spindex)
             if(verbose):
                 print(node)
                 pprint(mat_table)
@@ -7,6 +7,8 @@ import os
 import sys
 
 import copy
+import itertools
+import random
 
 from ..TreeLib import *
 from ..TreeLib import TreeUtils, TreeClass
@@ -40,6 +42,8 @@ class PolytomySolver:
         self.dp_values = {}
         self.special_species_dupcost = {}
         self.special_species_losscost = {}
+        # number of k-resolutions of each (species, k), see countResolutions
+        self.counts = {}
 
     def setDupLossCosts(self, dupcost, losscost):
         self.dupcost = dupcost
@@ -78,6 +82,7 @@ class PolytomySolver:
         dp_values = {}
 
         self.computeMultiplicities()
+        self.counts = {}
 
         # for a species s, cup_values[s] = ( bottom plateau value,  breakpt
         # left, breakpt right )
@@ -260,10 +265,23 @@ class PolytomySolver:
     def getAllResolutions(self, limit=100):
         """ Returns the first resolution found in Newick format, assuming that computeCostsTable has been called previously
         """
-        r = self.getResolutions(self.speciestree, 1, limit)
+        return list(itertools.islice(self.iterAllResolutions(), max(limit, 0)))
 
-        # let's hope this doesn't slow down
-        return [row[0] for row in r]
+    def iterAllResolutions(self):
+        """ Generates the resolutions in Newick format one by one, in the order of getAllResolutions
+        """
+        for row in self.iterResolutions(self.speciestree, 1):
+            yield row[0]
+
+    def countAllResolutions(self):
+        """ Returns the number of resolutions given by iterAllResolutions, without enumerating them
+        """
+        return self.countResolutions(self.speciestree, 1)
+
+    def sampleResolution(self, rng=random):
+        """ Returns a resolution in Newick format, drawn uniformly among the ones of iterAllResolutions
+        """
+        return self.sampleResolutions(self.speciestree, 1, rng)[0]
 
     def getResolutions(self, s, k, limit=1):
         """ Returns all possible ways of having k subtrees rooted at s.
@@ -271,6 +289,11 @@ class PolytomySolver:
                 is a k-resolution, which are represented as arrays.
                 These subarrays contain k elements in newick form, one for each subtree.
         """
+        return [list(resz) for resz in itertools.islice(self.iterResolutions(s, k), max(limit, 0))]
+
+    def _species(self, s, k):
+        """ Returns the table values and the costs used to find the k-resolutions of s
+        """
         v = self.getTableValue(s, k)
         vright = self.getTableValue(s, k + 1)
         vleft = self.getTableValue(s, k - 1)
@@ -283,138 +306,180 @@ class PolytomySolver:
         if s in self.special_species_losscost:
             s_dupcost = self.special_species_losscost[s]
 
-        # ------------------------------------------
-        # the leaf case
-        # ------------------------------------------
-        if s.is_leaf():
-
-            trees_to_return = []
-
-            if k == 0:
-                return [trees_to_return]
-
-            if self.debug:
-                print("At leaf s =", s.name, " k =",
-                      k, "v =", v, " vright =", vright)
-
-            if v == 0:
-                trees_to_return = [s.name] * k
-            # get k + 1 guys, merge 2
-            # TODO : we just take one way of doing this
-            elif v == vright + s_dupcost:
-
-                # NOTE the [0] which assumes that there's only one possible k+1
-                # resolution
-                resz = self.getResolutions(s, k + 1, 1)[0]
-                r1 = '(' + resz[0] + ',' + resz[1] + ')'
-                del resz[0]
-                resz[0] = r1
-                trees_to_return = resz
-            # get k - 1 guys, add a loss
-            else:  # v == vleft + s_losscost
-                # NOTE the [0] which assumes that there's only one k-1
-                # resolution
-                resz = self.getResolutions(s, k - 1, 1)[0]
-
-                # resz.append(s.name + '_LOSS')
-
-                trees_to_return = resz
-
-            return [trees_to_return]
-        # ------------------------------------------
-        # the non-leaf case
-        # ------------------------------------------
-        else:
-
-            if self.debug:
-                print("At internal species s =", s.name, "k =", k)
-
-            mult = 0
-            if s in self.multiplicities:
-                mult = self.multiplicities[s]
-
-            s1 = s.get_children()[0]
-            s2 = s.get_children()[1]
-            vup1 = self.getTableValue(s1, k - mult)
-            vup2 = self.getTableValue(s2, k - mult)
+        return v, vright, vleft, s_dupcost, s_losscost
 
-            all_solutions = []  # this is the return value we'll be filling, until we reach the limit
-
-            # speciation path, we must make k joins.
-            # Note that the speciation path is prioritized
-            if k - mult > 0 and v == vup1 + vup2:
-
-                all_resz_s1 = self.getResolutions(s1, k - mult, limit)
-                all_resz_s2 = self.getResolutions(s2, k - mult, limit)
-
-                for s1_iter in range(0, len(all_resz_s1)):
-                    resz_s1 = all_resz_s1[s1_iter]
-
-                    for s2_iter in range(0, len(all_resz_s2)):
-                        resz_s2 = all_resz_s2[s2_iter]
-
-                        if limit > 0:
-
-                            # TODO : here we should also make each s1 - s2 possible combination
-                            # but for now, we just make the obvious joins
-                            resz = []
-
-                            for i in range(0, k):
-                                if i <= k - mult - 1:
-                                    # this can happen when losses were inserted
-                                    if len(resz_s1) > i and len(resz_s2) > i:
-                                        res = '(' + resz_s1[i] + \
-                                            ',' + resz_s2[i] + ')'
-                                        resz.append(res)
-                                    elif len(resz_s1) <= i:
-                                        resz.append(resz_s2[i])
-                                    elif len(resz_s2) <= i:
-                                        resz.append(resz_s1[i])
-                                else:
-                                    # we go here when a child of the polytomy
-                                    # was internal and had species s (mult > 0)
-                                    resz.append(s.name)
-
-                            all_solutions.append(resz)
-                            limit -= 1
-
-            # The duplication case.  We take the first two subtrees from the
-            # right and join them
-            if v == vright + s_dupcost and limit > 0:
-
-                all_resz_dup = self.getResolutions(s, k + 1, limit)
-
-                for resz_iter in range(0, len(all_resz_dup)):
-
-                    if limit > 0:
-                        resz = all_resz_dup[resz_iter]
+    def _events(self, s, k):
+        """ Returns the ways of building the k-resolutions of an internal species s, in the order they are enumerated :
+                a list of (event, k') with event in 'spec', 'dup' and 'loss'. A speciation joins the k' resolutions of
+                the two children of s, a duplication joins two subtrees of the k' resolutions of s, a loss keeps them.
+        """
+        v, vright, vleft, s_dupcost, s_losscost = self._species(s, k)
+
+        mult = 0
+        if s in self.multiplicities:
+            mult = self.multiplicities[s]
+
+        s1 = s.get_children()[0]
+        s2 = s.get_children()[1]
+        vup1 = self.getTableValue(s1, k - mult)
+        vup2 = self.getTableValue(s2, k - mult)
+
+        events = []
+        # speciation path, we must make k joins.
+        # Note that the speciation path is prioritized
+        if k - mult > 0 and v == vup1 + vup2:
+            events.append(('spec', k - mult))
+        # The duplication case.  We take the first two subtrees from the
+        # right and join them
+        if v == vright + s_dupcost:
+            events.append(('dup', k + 1))
+        # The loss case.  Add a loss in s
+        if v == vleft + s_losscost:
+            events.append(('loss', k - 1))
+        return events
+
+    def _leafResolution(self, s, k):
+        """ Returns the only k-resolution of a leaf species s
+        """
+        if k == 0:
+            return []
+
+        v, vright, vleft, s_dupcost, s_losscost = self._species(s, k)
+
+        if self.debug:
+            print("At leaf s =", s.name, " k =",
+                  k, "v =", v, " vright =", vright)
+
+        if v == 0:
+            return [s.name] * k
+        # get k + 1 guys, merge 2
+        # TODO : we just take one way of doing this
+        elif v == vright + s_dupcost:
+            resz = self._leafResolution(s, k + 1)
+            return ['(' + resz[0] + ',' + resz[1] + ')'] + resz[2:]
+        # get k - 1 guys, add a loss
+        else:  # v == vleft + s_losscost
+            return self._leafResolution(s, k - 1)
+
+    def _speciation(self, s, k, resz_s1, resz_s2):
+        """ Joins the k-mult resolutions of the children of s into a k-resolution of s
+        """
+        mult = self.multiplicities.get(s, 0)
+        resz = []
+        for i in range(0, k):
+            if i <= k - mult - 1:
+                # this can happen when losses were inserted
+                if len(resz_s1) > i and len(resz_s2) > i:
+                    resz.append('(' + resz_s1[i] + ',' + resz_s2[i] + ')')
+                elif len(resz_s1) <= i:
+                    resz.append(resz_s2[i])
+                elif len(resz_s2) <= i:
+                    resz.append(resz_s1[i])
+            else:
+                # we go here when a child of the polytomy
+                # was internal and had species s (mult > 0)
+                resz.append(s.name)
+        return resz
+
+    def iterResolutions(self, s, k):
+        """ Generates the ways of having k subtrees rooted at s one by one (see getResolutions), so that
+                only the resolutions that are used are built. The resolutions that are yielded should not be modified.
+        """
+        if s.is_leaf():
+            yield self._leafResolution(s, k)
+            return
 
-                        r1 = '(' + resz[0] + ',' + resz[1] + ')'
-                        del resz[0]
-                        resz[0] = r1
+        if self.debug:
+            print("At internal species s =", s.name, "k =", k)
 
-                        limit -= 1
-                        all_solutions.append(resz)
+        for event, kk in self._events(s, k):
+            if event == 'spec':
+                s1, s2 = s.get_children()[0], s.get_children()[1]
+                # the resolutions of s2 are generated again for each resolution of s1, rather than kept
+                for resz_s1 in self.iterResolutions(s1, kk):
+                    for resz_s2 in self.iterResolutions(s2, kk):
+                        yield self._speciation(s, k, resz_s1, resz_s2)
 
-            # The loss case.  Add a loss in s
-            if v == vleft + s_losscost and limit > 0:
+            elif event == 'dup':
+                for resz in self.iterResolutions(s, kk):
+                    yield ['(' + resz[0] + ',' + resz[1] + ')'] + resz[2:]
 
-                # print "k=", k, " v=",v, " vup1=", vup1, " vup2=", vup2, "
-                # vright=", vright, " vleft=",vleft
+            else:
+                for resz in self.iterResolutions(s, kk):
+                    yield resz
 
-                all_resz_loss = self.getResolutions(s, k - 1, limit)
+    def countResolutions(self, s, k, counts=None):
+        """ Returns the number of k-resolutions of s given by iterResolutions, by dynamic programming over (s, k).
+                The numbers of resolutions of the (species, k) that are needed are kept in the dict counts
+                (by default self.counts, which is reset by computeCostsTable)
+        """
+        if counts is None:
+            counts = self.counts
+        # depth first traversal of the values that are needed, each one being counted after its dependencies
+        stack = [((s, k), False)]
+        while stack:
+            key, ready = stack.pop()
+            if ready:
+                if key[0].is_leaf():
+                    counts[key] = 1
+                else:
+                    counts[key] = sum(weight for event, kk, weight in self._weights(key, counts))
+            elif key not in counts:
+                counts[key] = None
+                stack.append((key, True))
+                if not key[0].is_leaf():
+                    stack.extend((dependency, False) for dependency in self._dependencies(*key) if dependency not in counts)
+        return counts[(s, k)]
+
+    def _dependencies(self, s, k):
+        """ Returns the (species, k) whose resolutions are used to build the k-resolutions of the internal species s
+        """
+        dependencies = []
+        for event, kk in self._events(s, k):
+            if event == 'spec':
+                dependencies.extend((c, kk) for c in s.get_children()[:2])
+            else:
+                dependencies.append((s, kk))
+        return dependencies
 
-                for resz_iter in range(0, len(all_resz_loss)):
+    def _weights(self, key, counts):
+        """ Returns the events of key = (s, k) (see _events) with the number of k-resolutions each one gives,
+                from the counts of its dependencies
+        """
+        s, k = key
+        weights = []
+        for event, kk in self._events(s, k):
+            if event == 'spec':
+                weights.append((event, kk, counts[(s.get_children()[0], kk)] * counts[(s.get_children()[1], kk)]))
+            else:
+                weights.append((event, kk, counts[(s, kk)]))
+        return weights
 
-                    if limit > 0:
-                        resz = all_resz_loss[resz_iter]
+    def sampleResolutions(self, s, k, rng=random, counts=None):
+        """ Returns a k-resolution of s, drawn uniformly among the ones of iterResolutions
+        """
+        if s.is_leaf():
+            return self._leafResolution(s, k)
 
-                        # resz.append('LOSS')
+        if counts is None:
+            counts = self.counts
+        self.countResolutions(s, k, counts)
 
-                        limit -= 1
-                        all_solutions.append(resz)
+        # each event is drawn with the probability of the number of resolutions it gives
+        weights = self._weights((s, k), counts)
+        x = rng.randrange(counts[(s, k)])
+        for event, kk, weight in weights:
+            if x < weight:
+                break
+            x -= weight
 
-            return all_solutions
+        if event == 'spec':
+            s1, s2 = s.get_children()[0], s.get_children()[1]
+            return self._speciation(s, k, self.sampleResolutions(s1, kk, rng, counts), self.sampleResolutions(s2, kk, rng, counts))
+        resz = self.sampleResolutions(s, kk, rng, counts)
+        if event == 'dup':
+            return ['(' + resz[0] + ',' + resz[1] + ')'] + resz[2:]
+        return resz
 
 
 class GeneTreeSolver:
@@ -426,6 +491,9 @@ class GeneTreeSolver:
 
     print "NBSOLS=", len(r)
     print r
+
+    The solutions can also be generated one by one with iterSolutions, counted with countSolutions
+    and drawn uniformly with sampleSolution.
     """
     # EN changed this
     # def __init__(self, genetree, speciestree, lcaMapping):
@@ -439,7 +507,7 @@ class GeneTreeSolver:
         self.dupcost = dupcost
         self.losscost = losscost
         self.use_dp = False
-        self.solutions_per_gene = {}
+        self.solvers = None
 
     def labelInternalNodes(self, tree):
         """ Gives a name to every unlabeled internal node of tree.  Names are of the form [i],
@@ -453,18 +521,27 @@ class GeneTreeSolver:
                 cpt += 1
 
     def solvePolytomies(self, limit=100):
-        """ Solves each polytomy, combines each solution and returns an array of newick strings.
+        """ Solves each polytomy, combines each solution and returns an array of newick strings (the limit first ones).
+            The species tree can be given as a TreeUtils.SpeciesTreeIndex, whose nodes are already labeled.
+        """
+        return list(itertools.islice(self.iterSolutions(), max(limit, 0)))
+
+    def getPolytomySolvers(self):
+        """ Returns the PolytomySolver of each internal node of the genetree, with its costs table computed.
+            They are built once, on the image tree of each node.
         """
-        self.labelInternalNodes(self.speciestree)
+        if self.solvers is not None:
+            return self.solvers
 
-        self.solutions_per_gene = {}
+        if not isinstance(self.speciestree, TreeUtils.SpeciesTreeIndex):
+            self.labelInternalNodes(self.speciestree)
+
+        self.solvers = {}
 
         # TreeUtils.lcaMapping(self.genetree, self.speciestree)
         s_images = TreeUtils.getImageTreeNode(
             self.genetree, self.speciestree, self.lcaMapping)
 
-        remainingLimit = limit
-
         for g in self.genetree.traverse("postorder"):
 
             if not g.is_leaf():
@@ -541,57 +618,62 @@ class GeneTreeSolver:
                 if self.debug:
                     print "COST=", ps.getTableValue(self.speciestree, 1)
 
-                # print remainingLimit
-
-                r = ps.getAllResolutions(remainingLimit)
-
-                # if len(g.get_children()) > 2:
-                #  print "G CHILDREN=", len(g.get_children()), " RLEN=", len(r)
-                #  xstr = ""
-                #  for c in g.get_children():
-                #    xstr += self.lcaMapping[c].name + "  "
-                #  print xstr
-
-                # TODO : limit is not applied so nicely here
-                # TODO : handle the case ( (a,a,a), b, b ) -> here a,a,a makes
-                # a leaf label
-                for gchild in g.get_children():
-
-                    # for each sol of r, we replace the i-th child by each possible solution
-                    # More precisely, if rchild has species [x], then the first occurrence
-                    # of substring [x] in each solution of r gets replaced
-                    # In this manner, the internal children of r get replaced
-                    # incrementally.
-                    if not gchild.is_leaf():
-
-                        r2 = []
-                        for sol in r:
+                self.solvers[g] = ps
 
-                            if limit > 0:
-                                s = self.lcaMapping[gchild]
-                                pos = sol.find(s.name)
+        return self.solvers
 
-                                rchild = self.solutions_per_gene[gchild]
-
-                                for sol_child in rchild:
-
-                                    # sol2 = sol[:pos] + "(" + sol_child + ")" + sol[pos + len(s.name):]
-                                    sol2 = sol[:pos] + sol_child + \
-                                        sol[pos + len(s.name):]
-                                    r2.append(sol2)
-                                    
-
-                                    # limit -= 1
+    def iterSolutions(self, g=None):
+        """ Generates the solutions of the subtree of g (by default the whole genetree) one by one, as newick strings.
+            Each resolution of the polytomy g is combined with each solution of its internal children : the first
+            occurrence of the species of a child in the resolution is replaced by the solution of the child.
+            Only the solutions that are asked for are built.
+        """
+        solvers = self.getPolytomySolvers()
+        if g is None:
+            g = self.genetree
 
-                        # limit = max(limit, 1)
-                        print(gchild)
-                        print(r2)
-                        r = r2
+        internal = [gchild for gchild in g.get_children() if not gchild.is_leaf()]
+        for sol in solvers[g].iterAllResolutions():
+            for combined in self._combine(sol, internal):
+                yield combined
 
-                if len(r) > limit:
-                    r = r[0:limit]
-                self.solutions_per_gene[g] = r
-                remainingLimit = limit - len(r) + 2
-                # remainingLimit = max(remainingLimit, 1)
-            
-        return self.solutions_per_gene[self.genetree]
+    def _combine(self, sol, children):
+        """ Generates the combinations of the resolution sol with the solutions of the internal children
+        """
+        if not children:
+            yield sol
+            return
+
+        name = self.lcaMapping[children[0]].name
+        pos = sol.find(name)
+        for sol_child in self.iterSolutions(children[0]):
+            for combined in self._combine(sol[:pos] + sol_child + sol[pos + len(name):], children[1:]):
+                yield combined
+
+    def countSolutions(self, g=None):
+        """ Returns the number of solutions given by iterSolutions, without enumerating them
+        """
+        solvers = self.getPolytomySolvers()
+        if g is None:
+            g = self.genetree
+
+        count = solvers[g].countAllResolutions()
+        for gchild in g.get_children():
+            if not gchild.is_leaf():
+                count *= self.countSolutions(gchild)
+        return count
+
+    def sampleSolution(self, g=None, rng=random):
+        """ Returns a solution drawn uniformly among the ones of iterSolutions, as a newick string
+        """
+        solvers = self.getPolytomySolvers()
+        if g is None:
+            g = self.genetree
+
+        sol = solvers[g].sampleResolution(rng)
+        for gchild in g.get_children():
+            if not gchild.is_leaf():
+                name = self.lcaMapping[gchild].name
+                pos = sol.find(name)
+                sol = sol[:pos] + self.sampleSolution(gchild, rng) + sol[pos + len(name):]
+        return sol
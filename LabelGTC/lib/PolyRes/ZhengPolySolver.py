@@ -5,49 +5,41 @@ from functools import partial
 import operator
 
 
-def simpleConstruct(nodelist, nodemap, K, T, W, P, root):
-
-    # nodelist ==> nl
-    # K ==> ingene
-    # T ==> outgene
-    # W ==> multiplicity
-    # Fid : Father id
-    # image_nodes ==> P
-    # print(nodelist)
-    # parent = [(node.name, node.parent) for node in nodemap.values() if node.has_feature("parent")]
-    # print(K)
-    # print(T)
-    # print(W)
-    # print(parent)
-    # print(P)
-
-    def insertNode(node, nodes):
-        if len(nodes) == 0:
-            return
-        tmp_node = TreeClass()
-        tmp_node.replace_by(node)
-        node.children = []
-        for n in nodes[0:-1]:
-            new_node = TreeClass()
-            new_node.add_child(tmp_node)
-            new_node.add_child(n)
-            tmp_node = new_node
-
-        node.add_child(tmp_node)
-        node.add_child(nodes[-1])
-
-    # store multiple copy of a node in a list
-    nodes = ddict(partial(np.empty))
-
-    for name in K.keys():
-        nodes[name] = np.empty(int(K[name]), dtype=object)
+def arrayConstruct(nodelist, nodemap, K, T, W, P, root):
+    """Build the resolution of a polytomy given by the tables of its image tree, as an edge list.
 
-    for name in reversed(nodelist):
+    nodelist : the names of the image tree nodes in postorder, and nodemap : the image tree node of each name
+    K : ingene, T : outgene, W : multiplicity, P : the genes mapped to each species (image_nodes)
+
+    Each node of the image tree has K copies, the T first ones being children of the copies of its parent
+    and the others being joined to the node by duplications. The genes mapped to a species replace
+    the last copies of its node (or the node and its copies, for a leaf).
+    Return (parents, genes) in preorder : the index of the parent of each node of the resolution (-1 for
+    the root), and the gene it is (None for the new internal nodes). The nodes with a single child are removed.
+    """
 
-        for j in xrange(K[name]):
-            nodes[name][j] = TreeClass()
+    children = []
+    genes = []
 
+    def newNode(gene=None, nodeChildren=None):
+        children.append(nodeChildren if nodeChildren is not None else [])
+        genes.append(gene)
+        return len(genes) - 1
+
+    ids = dict((name, newNode()) for name in nodelist)
+    for name in nodelist:
         node = nodemap[name]
+        if node.up is not None:
+            children[ids[node.up.name]].append(ids[name])
+
+    # copies of each node
+    copies = {}
+
+    for name in reversed(nodelist):
+
+        u = ids[name]
+        node = nodemap[name]
+        copies[name] = [newNode() for j in xrange(K[name])]
 
         if W[name] > 0:
             if node.is_leaf() and K[name] != W[name] - 1:
@@ -56,31 +48,36 @@ def simpleConstruct(nodelist, nodemap, K, T, W, P, root):
                 raise Exception("This shouldn't happen either")
 
             if node.is_leaf():
-                for j, n in enumerate(nodes[name]):
-                    n.replace_by(P[name][j + 1])
-
-                node.replace_by(P[name][0])
+                for j, c in enumerate(copies[name]):
+                    genes[c] = P[name][j + 1]
+                genes[u] = P[name][0]
 
             else:
                 for j, pnode in enumerate(P[name]):
-                    nodes[name][K[name] - 1 - j].replace_by(pnode)
+                    genes[copies[name][K[name] - 1 - j]] = pnode
 
         if node.up is not None:
-            j = 0
-            while j < T[name] and j < K[name]:
-                nodes[node.parent][j].add_child(nodes[name][j])
-                j += 1
+            for j in xrange(min(T[name], K[name])):
+                children[copies[node.parent][j]].append(copies[name][j])
 
         if T[name] < K[name]:
-            insertNode(node, nodes[name][T[name]:K[name]])
+            tmp = newNode(genes[u], children[u])
+            genes[u] = None
+            for c in copies[name][T[name]:K[name] - 1]:
+                tmp = newNode(None, [tmp, c])
+            children[u] = [tmp, copies[name][K[name] - 1]]
 
-    for name, node in nodemap.items():
-        if len(node.children) == 1:
-            node.replace_by(node.children[0])
+    parents, nodegenes = [], []
+    stack = [(ids[root], -1)]
+    while stack:
+        i, parent = stack.pop()
+        while genes[i] is None and len(children[i]) == 1:
+            i = children[i][0]
+        parents.append(parent)
+        nodegenes.append(genes[i])
+        stack.extend((c, len(parents) - 1) for c in reversed(children[i]))
 
-    nodemap[root].delete_single_child_internal()
-
-    return nodemap[root]
+    return parents, nodegenes
 
 
 class Solver(object):
@@ -99,7 +96,8 @@ class Solver(object):
             W[s.name] += 1
         return W, rW
 
-    def reconstruct(self):
+    def resolve(self):
+        """Resolve the polytomies of the genetree in place, and return it"""
 
         images_trees = TreeUtils.getImageTreeNode(
             self.genetree, self.specietree, self.lcamap)
@@ -111,18 +109,33 @@ class Solver(object):
                         n.add_features(parent=n.up.name)
                 W, rW = self._compute_mult(node)
                 solution = self.compute_table(images_trees[node], W, rW)
-                node.replace_by(solution)
-        return self.genetree.write(format=9)
+                self.splice(node, solution)
+        return self.genetree
+
+    def reconstruct(self):
+        return self.resolve().write(format=9)
 
     def get_solution(self, image_tree, multiplicities, reverse_node_map, outgene, ingene):
-        """Reconstruct a genetree solution"""
+        """Reconstruct a genetree solution, as an edge list (see arrayConstruct)"""
         nodelist = [node.name for node in image_tree.traverse("postorder")]
         nodemap = dict((node.name, node)
                        for node in image_tree.traverse("postorder"))
-        resolution = simpleConstruct(
+        return arrayConstruct(
             nodelist, nodemap, ingene, outgene, multiplicities, reverse_node_map, image_tree.name)
-        # resolution.delete_single_child_internal()
-        return resolution
+
+    def splice(self, node, solution):
+        """Replace the children of the polytomy node by its solution (see get_solution), in one pass"""
+        parents, genes = solution
+        nodes = []
+        for parent, gene in zip(parents, genes):
+            if parent < 0:
+                new = node
+                node.children = []
+                if gene is not None:
+                    node.replace_by(gene)
+            else:
+                new = nodes[parent].add_child(gene)
+            nodes.append(new)
 
 
 class LinPolySolver(Solver):
@@ -217,7 +230,8 @@ class DynPolySolver(Solver):
         self.losscost = losscost
 
     def compute_table(self, image_tree, W, rW):
-        """ Compute table for dynamique programmation"""
+        """ Compute table for dynamique programmation.
+        The vectors U and I of a node are computed for all its inputs at once, with array operations"""
         U = ddict(partial(np.zeros))
         M = ddict(int)
         I = ddict(partial(np.zeros))
@@ -252,62 +266,58 @@ class DynPolySolver(Solver):
         mul = M[image_tree.name]
         C = np.zeros(mul + 1)
 
-        def getCost(inp, out, d):
-            m = min(float(d) * self.losscost, self.dupcost)
-            if inp >= out:
-                return m * float(out)
-            else:
-                return m * float(inp) + self.dupcost * float(out - inp)
+        # number of cells of the cost matrix of a node computed at once
+        block = 1 << 20
 
-        def getMin(node, inp, d):
+        def getCosts(inp, out, m):
+            """Vectorised getCost : cost of each (inp, out) pair of the broadcasted arrays inp and out"""
+            return np.where(inp >= out, m * out, m * inp + self.dupcost * (out - inp))
+
+        def getMin(node, size, d):
+            """U and I of the node for all the inputs 0..size-1 at once : the first output
+            minimizing the cost, and its cost"""
             w = W[node.name]
-            l = C
-            p, m = w, getCost(inp, w, d) + l[w]
-            for out in xrange(w + 1, M[node.name] + 1):
-                t = getCost(inp, out, d) + l[out]
-                if t < m:
-                    p, m = out, t
-            U[node.name][inp] = m
-            I[node.name][inp] = p
+            m = min(float(d) * self.losscost, self.dupcost)
+            out = np.arange(w, M[node.name] + 1, dtype=float)
+            l = C[w:M[node.name] + 1]
+            rows = max(1, block // len(out))
+            for start in xrange(0, size, rows):
+                inp = np.arange(start, min(size, start + rows), dtype=float)[:, None]
+                t = getCosts(inp, out[None, :], m) + l[None, :]
+                p = np.argmin(t, axis=1)
+                U[node.name][start:start + len(inp)] = t[np.arange(len(inp)), p]
+                I[node.name][start:start + len(inp)] = p + w
 
         def getC(node, w):
-            if len(node.get_children()) == 1:
-                left_u = U[node.get_child_at(0).name]
-                for j in xrange(w, M[node.name] + 1):
-                    C[j] = left_u[j - w]
-
-            elif len(node.get_children()) == 2:
-                left_u = U[node.get_child_at(0).name]
-                right_u = U[node.get_child_at(1).name]
-                for j in xrange(w, M[node.name] + 1):
-                    C[j] = left_u[j - w] + right_u[j - w]
+            children = node.get_children()
+            n = M[node.name] - w + 1
+            if len(children) == 1:
+                C[w:M[node.name] + 1] = U[children[0].name][:n]
+            elif len(children) == 2:
+                C[w:M[node.name] + 1] = U[children[0].name][:n] + U[children[1].name][:n]
 
         for node in image_tree.traverse("postorder"):
             mult_node = W[node.name]
 
-            if node.is_leaf():
-                U[node.name] = np.zeros(M[node.parent] - W[node.parent] + 1)
-                I[node.name] = np.zeros(
-                    M[node.parent] - W[node.parent] + 1, dtype=int)
-                depth_diff = node.depth - node.up.depth
-                for j in xrange(0, M[node.parent] - W[node.parent] + 1):
-                    U[node.name][j] = getCost(j, mult_node - 1, depth_diff)
-                    I[node.name][j] = mult_node - 1
-
-            elif node.is_root():
+            if node.is_root():
                 U[node.name] = np.zeros(1)
                 I[node.name] = np.zeros(1, dtype=int)
                 getC(node, mult_node)
-                getMin(node, 0, 0)
+                getMin(node, 1, 0)
 
             else:
-                U[node.name] = np.zeros(M[node.parent] - W[node.parent] + 1)
-                I[node.name] = np.zeros(
-                    M[node.parent] - W[node.parent] + 1, dtype=int)
-                getC(node, mult_node)
+                size = M[node.parent] - W[node.parent] + 1
+                U[node.name] = np.zeros(size)
+                I[node.name] = np.zeros(size, dtype=int)
                 depth_diff = node.depth - node.up.depth
-                for j in xrange(0, M[node.parent] - W[node.parent] + 1):
-                    getMin(node, j, depth_diff)
+
+                if node.is_leaf():
+                    m = min(float(depth_diff) * self.losscost, self.dupcost)
+                    U[node.name][:] = getCosts(np.arange(size, dtype=float), float(mult_node - 1), m)
+                    I[node.name][:] = mult_node - 1
+                else:
+                    getC(node, mult_node)
+                    getMin(node, size, depth_diff)
 
         ingene[image_tree.name] = I[image_tree.name][0]
         outgene[image_tree.name] = 0
@@ -510,7 +520,7 @@ class Dynamiq2(Solver):
         self.dupcost = dupcost
         self.losscost = losscost
 
-    def reconstruct(self):
+    def resolve(self):
         images_trees = TreeUtils.getImageTreeNode(
             self.genetree, self.specietree, self.lcamap)
 
@@ -521,8 +531,8 @@ class Dynamiq2(Solver):
                         n.add_features(parent=n.up.name)
                 W, rW = self._compute_mult(node)
                 solution = self.compute_table(images_trees[node], node, W, rW)
-                node.replace_by(solution)
-        return self.genetree.write(format=9)
+                self.splice(node, solution)
+        return self.genetree
 
     def compute_table(self, image_tree, node, W, rW):
         """Compute cost table"""
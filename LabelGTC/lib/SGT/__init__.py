@@ -1,2 +1,2 @@
-from minSGT import getMinSGT
-__all__ = ['getMinSGT']
\ No newline at end of file
+from minSGT import getMinSGT, getMinSGTFromArrays, SGTCache
+__all__ = ['getMinSGT', 'getMinSGTFromArrays', 'SGTCache']
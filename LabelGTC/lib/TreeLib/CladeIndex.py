@@ -0,0 +1,110 @@
+"""
+Index of the clades of a tree, to answer leaf set and containment queries without listing the leaves of the nodes
+"""
+
+import numpy as np
+from CompactTree import CompactTree
+
+
+class CladeIndex(object):
+
+    """
+    The leaves of the tree are ranked in the order of a depth first traversal, so that the leaves
+    of each node form a contiguous range [lo, hi) of ranks. Arbitrary leaf sets are given as bitsets
+    (python integers, the bit of rank r being the leaf of rank r). It contains :
+    - ctree : the CompactTree of the tree, nodes being given by their id in it or by themselves
+    - lo, hi : the range of the leaf ranks of each node
+    - leafNames : the names of the leaves, by rank, and leafRank : the rank of each leaf name
+
+    The index describes the tree at the time it was built.
+    """
+
+    __slots__ = ('ctree', 'lo', 'hi', 'leafNames', 'leafRank', '_ids')
+
+    def __init__(self, tree):
+        """Build the index of a TreeClass, or of a CompactTree"""
+
+        ctree = tree if isinstance(tree, CompactTree) else CompactTree.fromTreeClass(tree, keepNodes=True)
+        self.ctree = ctree
+
+        # the leaves of the subtree of the node i have the ids [i, end[i]) in preorder
+        isleaf = ctree.isLeaf()
+        before = np.concatenate(([0], np.cumsum(isleaf)))
+        self.lo = before[:-1]
+        self.hi = before[ctree.end]
+
+        leaves = np.nonzero(isleaf)[0]
+        self.leafNames = [ctree.names[j] for j in ctree.name[leaves].tolist()]
+        self.leafRank = dict((name, r) for r, name in enumerate(self.leafNames))
+        self._ids = dict((node, i) for i, node in enumerate(ctree.nodes)) if ctree.nodes is not None else {}
+
+
+    def __len__(self):
+        return len(self.leafNames)
+
+
+    def nodeId(self, node):
+        """Return the id of a node, given either by itself or by its id"""
+        return self._ids[node] if node in self._ids else node
+
+
+    def leaves(self, node):
+        """Return the names of the leaves of the node, in O(k)"""
+        i = self.nodeId(node)
+        return self.leafNames[self.lo[i]:self.hi[i]]
+
+
+    def contains(self, a, b):
+        """Return True if the clade of the node b is contained in the clade of the node a, in O(1)"""
+        i, j = self.nodeId(a), self.nodeId(b)
+        return self.lo[i] <= self.lo[j] and self.hi[j] <= self.hi[i]
+
+
+    def leafRange(self, names):
+        """Return the smallest range (lo, hi) of leaf ranks that contains the leaves names,
+        or None if one of them is not a leaf of the tree, in O(k)"""
+        try:
+            ranks = [self.leafRank[name] for name in names]
+        except KeyError:
+            return None
+        return (min(ranks), max(ranks) + 1) if ranks else None
+
+
+    def isUnder(self, leafRange, node):
+        """Return True if the leaves of the range given by leafRange are all leaves of the node, in O(1)"""
+        i = self.nodeId(node)
+        return leafRange is not None and self.lo[i] <= leafRange[0] and leafRange[1] <= self.hi[i]
+
+
+    def bitset(self, names):
+        """Return the bitset of a set of leaves names of the tree"""
+        bits = 0
+        for name in names:
+            bits |= 1 << self.leafRank[name]
+        return bits
+
+
+    def nodeBitset(self, node):
+        """Return the bitset of the leaves of the node"""
+        i = self.nodeId(node)
+        return (1 << int(self.hi[i])) - (1 << int(self.lo[i]))
+
+
+    @staticmethod
+    def bitsets(leafSets):
+        """Return the bitsets of several sets of leaves names, that are not necessarily leaves of the same tree,
+        the leaves being ranked in the order they are first met"""
+        rank = {}
+        bitsets = []
+        for names in leafSets:
+            bits = 0
+            for name in names:
+                bits |= 1 << rank.setdefault(name, len(rank))
+            bitsets.append(bits)
+        return bitsets
+
+
+    @staticmethod
+    def isSubset(bits1, bits2):
+        """Return True if the leaf set of the bitset bits1 is contained in the one of bits2"""
+        return bits1 & ~bits2 == 0
@@ -27,6 +27,8 @@ except ImportError:
 np.set_printoptions(precision=3)
 numerictypes = np.core.numerictypes.sctype2char
 Float = numerictypes(float)
+# number of nodes under which NJ_cluster computes the sums of the rows again
+NJ_EXACT_ROW_SUMS = 64
 
 
 def find_smallest_index(matrice):
@@ -52,14 +54,13 @@ def condense_matrix(matrice, smallest_index, method='upgma'):
     """
     first_index, second_index = smallest_index
     # get the rows and make a new vector by updating distance
-    rows = np.take(matrice, smallest_index, 1)
+    rows = matrice[:, first_index] + matrice[:, second_index]
     # default we use upgma
     if(method.lower() == 'nj'):
-        new_vector = (
-            np.sum(rows, 1) - matrice[first_index, second_index]) * 0.5
+        new_vector = (rows - matrice[first_index, second_index]) * 0.5
 
     else:
-        new_vector = np.average(rows, 1)
+        new_vector = rows / 2.0
 
     # replace info in the row and column for first index with new_vector
     matrice[second_index] = new_vector
@@ -91,16 +92,42 @@ def calculate_Q_matrix(matrice):
 
     """
     n = matrice.shape[0]
-    Q_matrix = np.zeros(shape=matrice.shape)
-    it = np.nditer(matrice, flags=['multi_index'])
-    while not it.finished:
-        ind = it.multi_index
-        Q_matrix[ind] = calculate_Q_ij(matrice, ind, n)
-        it.iternext()
-
+    row_sums = np.sum(matrice, 1)
+    Q_matrix = matrice * (n - 2)
+    Q_matrix -= row_sums[:, np.newaxis]
+    Q_matrix -= row_sums
     return Q_matrix
 
 
+def find_smallest_Q_index(matrice, row_sums, block_size=2 ** 16):
+    """Return the i,j index (i > j) of the smallest value of the Q_matrix of matrice,
+    as find_smallest_index(calculate_Q_matrix(matrice)) when row_sums are the sums of the rows.
+
+    The lower triangle of the Q_matrix is computed by blocks of rows of about
+    block_size values, so that each block stays in the cache.
+    """
+    n = matrice.shape[0]
+    rows = min(n, max(1, block_size // n))
+    buffer = np.empty(rows * n)
+    upper = ~np.tri(rows, k=-1, dtype=bool)
+    smallest, smallest_index = np.inf, (1, 0)
+    for start in range(1, n, rows):
+        stop = min(start + rows, n)
+        Q_block = np.multiply(matrice[start:stop, :stop], n - 2,
+                              out=buffer[:(stop - start) * stop].reshape(stop - start, stop))
+        Q_block -= row_sums[start:stop, np.newaxis]
+        Q_block -= row_sums[:stop]
+        # the diagonal and the upper triangle are ignored
+        np.copyto(Q_block[:, start:], np.inf,
+                  where=upper[:stop - start, :stop - start])
+        index = Q_block.argmin()
+        # the first smallest value is kept, as argmin
+        if Q_block.flat[index] < smallest:
+            smallest = Q_block.flat[index]
+            smallest_index = (start + index // stop, index % stop)
+    return smallest_index
+
+
 def paired_node_distance(matrice, smallest_index):
     i, j = smallest_index
     # i, j are the index of the recently joined node
@@ -124,6 +151,22 @@ def paired_node_distance(matrice, smallest_index):
         return distance / 2.0, distance / 2.0
 
 
+def join_nodes(node1, node2, dist):
+    """Combine node1 and node2 into a new TreeClass node, the branch lengths
+    of node1 and node2 being the two values of dist"""
+    nodes = [node1, node2]
+    pos = [0, 1]
+
+    for ind in pos:
+        nodes[ind].add_features(length=dist[ind])
+    # combine the two nodes into a new TreeNode object
+    new_node = TreeClass()
+    new_node.add_child(node1)
+    new_node.add_child(node2)
+    new_node.add_features(length=sum(dist))
+    return new_node
+
+
 def condense_node_order(matrice, smallest_index, node_order, method='upgma'):
     """
     condenses two nodes in node_order based on smallest_index info
@@ -150,16 +193,7 @@ def condense_node_order(matrice, smallest_index, node_order, method='upgma'):
     else:
         dist = (0, 0)
 
-    nodes = [node1, node2]
-    pos = [0, 1]
-
-    for ind in pos:
-        nodes[ind].add_features(length=dist[ind])
-    # combine the two nodes into a new TreeNode object
-    new_node = TreeClass()
-    new_node.add_child(node1)
-    new_node.add_child(node2)
-    new_node.add_features(length=sum(dist))
+    new_node = join_nodes(node1, node2, dist)
     # replace the object at index1 with the combined node
     node_order[index2] = new_node
     # replace the object at index2 with None
@@ -173,6 +207,12 @@ def NJ_cluster(matrice, node_order, nj_depth=None):
     matrice is a np array.
     node_order is a list of PhyloNode objects corresponding to the matrice.
 
+    The Q_matrix is searched by blocks with find_smallest_Q_index. The sums of
+    the rows are updated at each join, and computed again from the matrice
+    when less than NJ_EXACT_ROW_SUMS nodes are left, so that the small
+    matrices have the same ties (always the case of the last four nodes)
+    as with calculate_Q_matrix.
+
     WARNING: Changes matrice in-place.
     before this function is called.
     """
@@ -184,22 +224,81 @@ def NJ_cluster(matrice, node_order, nj_depth=None):
 
     tree = None
     smallest_index = []
+    row_sums = np.sum(matrice, 1)
     for i in range(nj_depth):
-        Q_matrix = calculate_Q_matrix(matrice)
-        index_1, index_2 = find_smallest_index(Q_matrix)
+        if matrice.shape[0] <= NJ_EXACT_ROW_SUMS:
+            row_sums = np.sum(matrice, 1)
+        index_1, index_2 = find_smallest_Q_index(matrice, row_sums)
         smallest_index = (index_1, index_2)
         row_order = condense_node_order(
             matrice, smallest_index, node_order, method='nj')
+        # the distances of the joined node replace the distances to index_1 and index_2
+        row_sums -= matrice[:, index_1] + matrice[:, index_2]
         matrice = condense_matrix(matrice, smallest_index, method='nj')
+        row_sums = np.delete(row_sums, index_1)
+        row_sums += matrice[:, index_2]
+        row_sums[index_2] = np.sum(matrice[index_2])
         tree = node_order[smallest_index[1]]
     return tree, matrice, smallest_index
 
 
+def find_row_minima(matrice):
+    """Return the smallest distance of each row i to the rows j < i, and its
+    first index j. The first row has no such distance (inf, -1)
+    """
+    n = matrice.shape[0]
+    lower = np.where(np.tri(n, k=-1, dtype=bool), matrice, np.inf)
+    row_arg = lower.argmin(1)
+    row_min = lower[np.arange(n), row_arg]
+    if n:
+        row_arg[0] = -1
+    return row_min, row_arg
+
+
+def find_row_minimum(matrice, active_index, i):
+    """Return the smallest distance of row i to the active rows j < i, and its first index j"""
+    index = active_index[:np.searchsorted(active_index, i)]
+    if not len(index):
+        return np.inf, -1
+    j = matrice[i, index].argmin()
+    return matrice[i, index[j]], index[j]
+
+
+def update_row_minima(matrice, row_min, row_arg, active, smallest_index):
+    """Update the row minima after rows i and j (i > j) were merged into row j,
+    and row i was removed from the active rows.
+
+    Only the rows whose minimum was at i or j, and that are not still reached
+    by the new distance to j, are searched again.
+    """
+    i, j = smallest_index
+    active_index = np.flatnonzero(active)
+    row_min[j], row_arg[j] = find_row_minimum(matrice, active_index, j)
+    rows = active_index[active_index > j]
+    new_dist = matrice[rows, j]
+    # the new distance to j is the new minimum of the row
+    better = (new_dist < row_min[rows]) | (
+        (new_dist == row_min[rows]) & (j < row_arg[rows]))
+    # the minimum was at i or j and is replaced by a larger distance
+    lost = ~better & ((row_arg[rows] == i) | (
+        (row_arg[rows] == j) & (new_dist != row_min[rows])))
+    row_min[rows[better]] = new_dist[better]
+    row_arg[rows[better]] = j
+    for k in rows[lost]:
+        row_min[k], row_arg[k] = find_row_minimum(matrice, active_index, k)
+
+
 def UPGMA_cluster(matrice, node_order, upgma_depth=None):
     """cluster with UPGMA
     matrice is a np array.
     node_order is a list of TreeClass objects corresponding to the matrice.
 
+    The matrice is not condensed at each join : the merged distances are written
+    in place, the removed rows are masked, and the smallest distance of each row
+    to the previous rows is kept, so that the closest pair is found in O(n).
+    The joins, the condensed matrice and the last smallest_index are the same as
+    with find_smallest_index and condense_matrix.
+
     WARNING: Changes matrice in-place.
     before this function is called.
     """
@@ -208,14 +307,37 @@ def UPGMA_cluster(matrice, node_order, upgma_depth=None):
         upgma_depth = num_entries - 1  # default, do all
     tree = None
     smallest_index = []
-    for i in range(upgma_depth):
-        index_1, index_2 = find_smallest_index(matrice)
-        smallest_index = (index_1, index_2)
-        assert(index_1 > index_2)
-        row_order = condense_node_order(
-            matrice, smallest_index, node_order, method='upgma')
-        matrice = condense_matrix(matrice, smallest_index, method='upgma')
-        tree = node_order[smallest_index[1]]
+    if upgma_depth < 1:
+        return tree, matrice, smallest_index
+
+    active = np.ones(num_entries, dtype=bool)
+    nodes = list(node_order)
+    row_min, row_arg = find_row_minima(matrice)
+    for step in range(upgma_depth):
+        # first row with the smallest distance, as find_smallest_index
+        rows = np.flatnonzero(active)[1:]
+        index_1 = rows[row_min[rows].argmin()]
+        index_2 = row_arg[index_1]
+        smallest_index = (np.count_nonzero(active[:index_1]),
+                          np.count_nonzero(active[:index_2]))
+        distance = matrice[index_1, index_2]
+        tree = join_nodes(nodes[index_1], nodes[index_2],
+                          (distance / 2.0, distance / 2.0))
+        nodes[index_2] = tree
+        # average distance of the new node, in the row and column of index_2
+        new_vector = (matrice[:, index_1] + matrice[:, index_2]) / 2.0
+        matrice[index_2] = new_vector
+        matrice[:, index_2] = new_vector
+        matrice[index_2, index_2] = 0
+        active[index_1] = False
+        if step < upgma_depth - 1:
+            update_row_minima(matrice, row_min, row_arg,
+                              active, (index_1, index_2))
+
+    node_order[:] = [node for node, keep in zip(nodes, active) if keep]
+    active_index = np.flatnonzero(active)
+    matrice = matrice[np.ix_(active_index, active_index)]
+    np.fill_diagonal(matrice, 0)
     return tree, matrice, smallest_index
 
 
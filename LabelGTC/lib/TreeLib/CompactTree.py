@@ -0,0 +1,240 @@
+"""
+Compact array representation of a tree, used by the correction steps that only read the topology and labels of a genes tree
+"""
+
+import numpy as np
+from collections import deque
+from TreeClass import TreeClass
+
+
+class CompactTree(object):
+
+    """
+    Tree stored as arrays indexed by node ids, the id of a node being its rank in preorder
+    (so that the subtree of the node i is the range [i, end[i]) of ids) :
+    - parent : the parent id of each node (-1 for the root)
+    - firstChild, nextSibling : the first child and the next sibling of each node (-1 if none)
+    - end : the end of the range of ids of the subtree of each node
+    - support : the support of each node
+    - species : the id of the species of each leaf in a SpeciesTreeIndex (-1 if unknown, and for internal nodes)
+    - name : the id of the name of each node in names
+    - labels : dict of integer label arrays (e.g. 'cst', 'binconfidence', 'lcse'), used instead of the features of TreeClass
+    - nodes : the TreeClass node of each id, when asked for when the tree was built from a TreeClass (None otherwise)
+
+    A node takes a few dozen bytes, instead of the hundreds of bytes of a TreeClass node and its features.
+    """
+
+    __slots__ = ('parent', 'firstChild', 'nextSibling', 'end', 'support', 'species', 'name', 'names', 'labels', 'nodes')
+
+    def __init__(self, parent, support=None, name=None, names=None, species=None):
+        """Build the tree from the parent id of each node (in preorder, -1 for the root)"""
+
+        n = len(parent)
+        self.parent = np.asarray(parent, dtype=np.int32)
+        self.support = np.ones(n) if support is None else np.asarray(support, dtype=float)
+        self.name = np.zeros(n, dtype=np.int32) if name is None else np.asarray(name, dtype=np.int32)
+        self.names = [""] if names is None else names
+        self.species = np.full(n, -1, dtype=np.int32) if species is None else np.asarray(species, dtype=np.int32)
+        self.labels = {}
+        self.nodes = None
+
+        # the children are linked in reverse, so that the first child has the smallest id
+        firstChild = np.full(n, -1, dtype=np.int32)
+        nextSibling = np.full(n, -1, dtype=np.int32)
+        end = np.arange(1, n + 1, dtype=np.int32)
+        parent = self.parent.tolist()
+        for i in xrange(n - 1, 0, -1):
+            p = parent[i]
+            nextSibling[i] = firstChild[p]
+            firstChild[p] = i
+            if end[p] < end[i]:
+                end[p] = end[i]
+        self.firstChild = firstChild
+        self.nextSibling = nextSibling
+        self.end = end
+
+
+    @classmethod
+    def fromTreeClass(cls, tree, spindex=None, features=(), keepNodes=False):
+        """Build the compact tree of a TreeClass. The species of the leaves are read from the
+        'species' feature (or from the name of the leaf, gene_species) and given by their id in the SpeciesTreeIndex spindex.
+        The integer features listed in features are copied in labels (0 for the nodes without the feature).
+        The TreeClass nodes are only kept in nodes if keepNodes is True"""
+
+        nodes, parent = [], []
+        stack = [(tree, -1)]
+        while stack:
+            node, p = stack.pop()
+            parent.append(p)
+            nodes.append(node)
+            stack.extend((child, len(nodes) - 1) for child in reversed(node.children))
+
+        names, name2id = [], {}
+        name = []
+        for node in nodes:
+            if node.name not in name2id:
+                name2id[node.name] = len(names)
+                names.append(node.name)
+            name.append(name2id[node.name])
+
+        species = None
+        if spindex is not None:
+            species = []
+            for node in nodes:
+                if node.children:
+                    species.append(-1)
+                else:
+                    sp = node.species if 'species' in node.features else node.name.split("_", 1)[-1]
+                    species.append(spindex.name2id.get(sp, -1))
+
+        ctree = cls(parent, [node.support for node in nodes], name, names, species)
+        for feature in features:
+            ctree.labels[feature] = np.array([getattr(node, feature, 0) for node in nodes], dtype=np.int8)
+        if keepNodes:
+            ctree.nodes = nodes
+        return ctree
+
+
+    def toTreeClass(self, i=0, features=()):
+        """Build the TreeClass of the subtree of the node i, with the names and supports of the nodes
+        and the labels listed in features as features"""
+
+        nodes = []
+        end = self.end[i]
+        support = self.support[i:end].tolist()
+        name = self.name[i:end].tolist()
+        for k, p in enumerate(self.parent[i:end].tolist()):
+            node = TreeClass() if k == 0 else nodes[p - i].add_child()
+            node.name = self.names[name[k]]
+            node.support = support[k]
+            nodes.append(node)
+        for feature in features:
+            for node, value in zip(nodes, self.labels[feature][i:end].tolist()):
+                node.add_features(**{feature: value})
+        return nodes[0] if nodes else None
+
+
+    def subtree(self, i):
+        """Return the compact tree of the subtree of the node i, with the same names and labels"""
+
+        end = self.end[i]
+        parent = self.parent[i:end] - i
+        parent[0] = -1
+        ctree = CompactTree(parent, self.support[i:end], self.name[i:end], self.names, self.species[i:end])
+        for feature, values in self.labels.iteritems():
+            ctree.labels[feature] = values[i:end].copy()
+        return ctree
+
+
+    @staticmethod
+    def parentArray(subtrees):
+        """Encode a forest of subtrees, given as (ctree, node id) pairs, as TreeUtils.toParentArray
+        (only the leaves being named). Return (parents, labels, leaves), leaves being the list of the
+        indexes of the leaves"""
+
+        parents, labels, leaves = [], [], []
+        for ctree, i in subtrees:
+            end = ctree.end[i]
+            offset = len(parents) - i
+            isleaf = ctree.firstChild[i:end] < 0
+            parent = ctree.parent[i:end] + offset
+            parent[0] = -1
+            parents.extend(parent.tolist())
+            for j, leaf in zip(ctree.name[i:end].tolist(), isleaf.tolist()):
+                if leaf:
+                    leaves.append(len(labels))
+                    labels.append(ctree.names[j])
+                else:
+                    labels.append("")
+        return parents, labels, leaves
+
+
+    def __len__(self):
+        return len(self.parent)
+
+
+    def __repr__(self):
+        return "CompactTree(%d nodes, %d leaves)" % (len(self), np.count_nonzero(self.isLeaf()))
+
+
+    @property
+    def nbytes(self):
+        """Memory used by the arrays of the tree"""
+        return sum(a.nbytes for a in (self.parent, self.firstChild, self.nextSibling, self.end,
+                                      self.support, self.species, self.name)) + sum(a.nbytes for a in self.labels.values())
+
+
+    def isLeaf(self):
+        """Return the boolean array of the leaves"""
+        return self.firstChild < 0
+
+
+    def children(self, i):
+        """Return the list of the children ids of the node i"""
+        children = []
+        c = self.firstChild[i]
+        while c >= 0:
+            children.append(c)
+            c = self.nextSibling[c]
+        return children
+
+
+    def leaves(self, i):
+        """Return the ids of the leaves of the subtree of the node i"""
+        ids = np.arange(i, self.end[i])
+        return ids[self.firstChild[ids] < 0]
+
+
+    def leafNames(self, i):
+        """Return the names of the leaves of the subtree of the node i"""
+        return [self.names[self.name[j]] for j in self.leaves(i)]
+
+
+    def topologyIds(self, shapes):
+        """Return the list of the topology id of the subtree of each node : two subtrees have the same id
+        if and only if they have the same rooted topology and leaf names. The ids are given by shapes,
+        a dict from the canonical form of a subtree (the name of a leaf, or the sorted tuple of the ids
+        of the children) to its id, that is completed as needed and can be shared by several trees
+        to compare their subtrees. Each node is handled once, after its children"""
+        n = len(self)
+        parent = self.parent.tolist()
+        name = self.name.tolist()
+        children = [[] for i in xrange(n)]
+        ids = [0] * n
+        # the children have larger ids than their parent in preorder
+        for i in xrange(n - 1, -1, -1):
+            if children[i]:
+                children[i].sort()
+                key = tuple(children[i])
+            else:
+                key = self.names[name[i]]
+            ids[i] = shapes.setdefault(key, len(shapes))
+            if parent[i] >= 0:
+                children[parent[i]].append(ids[i])
+        return ids
+
+
+    def postorder(self):
+        """Return the ids of the nodes in postorder"""
+        order = []
+        stack = [0] if len(self) else []
+        visited = np.zeros(len(self), dtype=bool)
+        while stack:
+            i = stack[-1]
+            if visited[i]:
+                order.append(stack.pop())
+            else:
+                visited[i] = True
+                stack.extend(reversed(self.children(i)))
+        return np.array(order, dtype=int)
+
+
+    def levelorder(self, i=0):
+        """Return the ids of the nodes of the subtree of the node i in levelorder (the order of TreeClass.traverse("levelorder"))"""
+        order = []
+        queue = deque([i] if len(self) else [])
+        while queue:
+            i = queue.popleft()
+            order.append(i)
+            queue.extend(self.children(i))
+        return np.array(order, dtype=int)
@@ -0,0 +1,166 @@
+"""
+Immutable index of a species tree, built once and shared by all the gene families corrected against it
+"""
+
+import numpy as np
+
+
+def sparseTable(values):
+    """Return the sparse table of the position of the minimum of values :
+    row k gives, for each position i such that i + 2**k <= len(values), the position of the
+    minimum of values[i:i+2**k] (the first one in case of ties). Each row is computed from
+    the previous one with a single vectorised comparison"""
+    values = np.asarray(values)
+    n = len(values)
+    table = np.zeros((max(1, n.bit_length()), n), dtype=int)
+    table[0] = np.arange(n)
+    for k in xrange(1, table.shape[0]):
+        half = 1 << (k - 1)
+        m = n - (1 << k) + 1
+        left = table[k - 1, :m]
+        right = table[k - 1, half:half + m]
+        table[k, :m] = np.where(values[left] <= values[right], left, right)
+    return table
+
+
+class SpeciesTreeIndex(object):
+
+    """
+    Index of the nodes of a species tree by integer ids, the id of a node being its rank in preorder,
+    so that the parent of a node always has a smaller id. It contains :
+    - nodes : the species tree node of each id, and names : the name of each node
+    - parent : the parent id of each node (-1 for the root), and depth : the depth of each node
+    - children : the tuple of the children ids of each node
+    - postorder : the node ids in postorder
+    - euler : the euler tour of the tree, first : the first position of each node in it,
+      and sparse : the sparse table of the minimal depth of the tour, used to answer lca queries in O(1),
+      log2 giving the row of the sparse table to use for each length of range
+    - name2id : the id of each node name (leaves names and internal labels)
+
+    The internal nodes of the species tree are labeled and their depth is set when the index is built,
+    the tree should not be modified afterwards. The index itself can't be modified.
+    """
+
+    def __init__(self, tree):
+
+        self.tree = tree.label_internal_node()
+
+        # nodes in preorder, the parent id is carried along the traversal
+        nodes, parent = [], []
+        stack = [(tree, -1)]
+        while stack:
+            node, p = stack.pop()
+            parent.append(p)
+            nodes.append(node)
+            stack.extend((child, len(nodes) - 1) for child in reversed(node.children))
+
+        n = len(nodes)
+        self.nodes = tuple(nodes)
+        self.names = tuple(node.name for node in nodes)
+        self.name2id = dict((name, i) for i, name in enumerate(self.names))
+        self._node2id = dict((node, i) for i, node in enumerate(nodes))
+
+        self.parent = self._frozen(np.array(parent, dtype=int))
+        children = [[] for i in xrange(n)]
+        depth = np.zeros(n, dtype=int)
+        for i in xrange(1, n):
+            children[parent[i]].append(i)
+            depth[i] = depth[parent[i]] + 1
+        self.children = tuple(tuple(c) for c in children)
+        self.depth = self._frozen(depth)
+
+        for node, d in zip(nodes, depth):
+            node.add_features(depth=int(d))
+
+        # postorder and euler tour, from the children lists
+        postorder, euler = [], []
+        stack = [(0, 0)]
+        while stack:
+            i, k = stack.pop()
+            euler.append(i)
+            if k < len(self.children[i]):
+                stack.append((i, k + 1))
+                stack.append((self.children[i][k], 0))
+            else:
+                postorder.append(i)
+        self.postorder = self._frozen(np.array(postorder, dtype=int))
+        self.euler = self._frozen(np.array(euler, dtype=int))
+
+        first = np.full(n, len(euler), dtype=int)
+        np.minimum.at(first, self.euler, np.arange(len(euler)))
+        self.first = self._frozen(first)
+        self.sparse = self._frozen(sparseTable(depth[self.euler]))
+        # floor(log2(l)) for each length l of a range of the euler tour
+        log2 = np.zeros(len(euler) + 1, dtype=int)
+        for k in xrange(1, self.sparse.shape[0]):
+            log2[1 << k:] += 1
+        self.log2 = self._frozen(log2)
+
+        self._locked = True
+
+
+    @staticmethod
+    def _frozen(array):
+        array.flags.writeable = False
+        return array
+
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_locked', False):
+            raise AttributeError("SpeciesTreeIndex can't be modified")
+        object.__setattr__(self, name, value)
+
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+    def __repr__(self):
+        return "SpeciesTreeIndex(%d nodes, %d leaves)" % (len(self.nodes), sum(1 for c in self.children if not c))
+
+
+    def nodeId(self, node):
+        """Return the id of a species tree node, given either by itself or by its name"""
+        if isinstance(node, basestring):
+            return self.name2id[node]
+        return self._node2id[node]
+
+
+    def getNode(self, i):
+        """Return the species tree node with the given id or name"""
+        if isinstance(i, basestring):
+            i = self.name2id[i]
+        return self.nodes[i]
+
+
+    def lcaId(self, ids):
+        """Return the id of the lca of the nodes with the given ids"""
+        first = self.first
+        i = int(min(first[s] for s in ids))
+        j = int(max(first[s] for s in ids))
+        k = (j - i + 1).bit_length() - 1
+        a = self.sparse[k, i]
+        b = self.sparse[k, j - (1 << k) + 1]
+        return int(self.euler[a if self.depth[self.euler[a]] <= self.depth[self.euler[b]] else b])
+
+
+    def rangeLca(self, i, j):
+        """Vectorised lca query : return the array of the ids of the lca of the nodes visited
+        between the positions i[k] and j[k] (included) of the euler tour, for each k"""
+        i = np.asarray(i, dtype=int)
+        j = np.asarray(j, dtype=int)
+        k = self.log2[j - i + 1]
+        a = self.euler[self.sparse[k, i]]
+        b = self.euler[self.sparse[k, j - (1 << k) + 1]]
+        return np.where(self.depth[a] <= self.depth[b], a, b)
+
+
+    def lca(self, species):
+        """Return the lca of a list of species tree nodes, given by themselves or by their names"""
+        return self.nodes[self.lcaId([self.nodeId(s) for s in species])]
+
+
+    def parentArray(self):
+        """Encode the species tree as a parent index array with its node names (see TreeUtils.toParentArray).
+        Return (parents, labels, name2id)"""
+        return self.parent.tolist(), list(self.names), self.name2id
@@ -17,6 +17,7 @@ import urllib2
 import numpy as np
 import random
 from TreeClass import TreeClass
+from SpeciesTreeIndex import SpeciesTreeIndex, sparseTable
 from collections import defaultdict as ddict
 from ete3 import Phyloxml, Tree
 from ete3 import orthoxml
@@ -301,29 +302,17 @@ def lcaPreprocess(tree):
     # print tree.get_ascii(show_internal= True, attributes=['name', 'euler_visit', 'depth'])
     # number of element in array
     n = len(node_visited)
-    m = int(np.ceil(np.log2(n)))
-    rmq_array = np.zeros((n, m), dtype=int)
-    for i in xrange(n):
-        rmq_array[i, 0] = i
-    for j in xrange(1, m):
-        i = 0
-        while(i + 2**j < n - 1):
-            if(node_visited[rmq_array[i, j - 1]].depth < node_visited[rmq_array[(i + 2**(j - 1)), j - 1]].depth):
-                rmq_array[i, j] = rmq_array[i, j - 1]
-            else:
-                rmq_array[i, j] = rmq_array[i + 2**(j - 1), j - 1]
-            i += 1
+    # rmq_array[i, j] is the position of the min depth in node_visited[i:i+2**j],
+    # each column being computed at once from the depth array
+    depths = np.fromiter((node.depth for node in node_visited), dtype=int, count=n)
+    rmq_array = sparseTable(depths).T
 
     node_map = ddict()
     name2ind = ddict()
     for i in xrange(n):
         cur_node = node_visited[i]
-        # bad practice
-        try:
-            node_map[cur_node] = min(node_map[cur_node], i)
-        except:
-            node_map[cur_node] = i
-        name2ind[cur_node.name] = node_map[cur_node]
+        # the first visit of a node is its index
+        name2ind[cur_node.name] = node_map.setdefault(cur_node, i)
 
     tree.add_features(lcaprocess=True)
     tree.add_features(rmqmat=rmq_array)
@@ -332,9 +321,22 @@ def lcaPreprocess(tree):
     tree.add_features(name2ind=name2ind)
 
 
+def getSpeciesTreeIndex(specietree):
+    """Return the SpeciesTreeIndex of specietree. The index is built once and kept on the tree.
+    specietree can also be the index itself"""
+    if isinstance(specietree, SpeciesTreeIndex):
+        return specietree
+    if not specietree.has_feature('spindex'):
+        specietree.add_features(spindex=SpeciesTreeIndex(specietree))
+    return specietree.spindex
+
+
 def getLca(sptree, species):
     """This should be a faster lcamapping
-    species should be a list of node"""
+    species should be a list of node
+    sptree can also be a SpeciesTreeIndex"""
+    if isinstance(sptree, SpeciesTreeIndex):
+        return sptree.lca(species)
     if not sptree.has_feature('lcaprocess', True):
         lcaPreprocess(sptree)
     A = sptree.ind2node
@@ -365,10 +367,13 @@ def getLca(sptree, species):
 def lcaMapping(genetree, specietree, multspeciename=True):
     """LCA mapping between a genetree and a specietree
     :argument genetree: your genetree, All leave in the genetree should already have feature 'specie' (set_specie was called)
-    :argument specietree: your specietree
+    :argument specietree: your specietree, or its SpeciesTreeIndex
     :argument multspeciename: A flag to use in order to accept multi specie name at genetree internal node.
     """
 
+    if isinstance(specietree, SpeciesTreeIndex):
+        return _indexLcaMapping(genetree, specietree, multspeciename)
+
     smap = {}  # a dict that map specie name to specie node in specietree
     mapping = {}
     if not specietree.has_feature('lcaprocess', True):
@@ -392,6 +397,69 @@ def lcaMapping(genetree, specietree, multspeciename=True):
     return mapping
 
 
+def lcaMappingIds(genetree, specietree):
+    """Batch LCA mapping of a whole genetree on the node ids of a SpeciesTreeIndex
+    :argument genetree: your genetree, All leave in the genetree should already have feature 'species' (set_species was called)
+    :argument specietree: your specietree, or its SpeciesTreeIndex
+    Return (nodes, ids) : the nodes of genetree in postorder, and the integer array of the species id each one is mapped to.
+    The leaves are mapped by name, then the internal nodes one level (height in the genetree) at a time,
+    with a single vectorised lca query on the euler tour ranges of the level
+    """
+    spindex = getSpeciesTreeIndex(specietree)
+    nodes = list(genetree.traverse("postorder"))
+    n = len(nodes)
+    pos = dict((node, i) for i, node in enumerate(nodes))
+    parent = [pos[node.up] for node in nodes[:-1]] + [-1]
+
+    # the children come before their parent in postorder
+    height = [0] * n
+    for i in xrange(n - 1):
+        if height[parent[i]] <= height[i]:
+            height[parent[i]] = height[i] + 1
+    parent = np.array(parent, dtype=int)
+    height = np.array(height, dtype=int)
+
+    ids = np.zeros(n, dtype=int)
+    leaves = np.nonzero(height == 0)[0]
+    ids[leaves] = [spindex.name2id[nodes[i].species] for i in leaves]
+
+    # range of the euler tour that covers the images of the leaves of each subtree
+    lo = np.full(n, len(spindex.euler), dtype=int)
+    hi = np.full(n, -1, dtype=int)
+    lo[leaves] = hi[leaves] = spindex.first[ids[leaves]]
+
+    # the nodes grouped by height, and the non root nodes grouped by the height of their parent
+    levels = np.argsort(height, kind='mergesort')
+    lbounds = np.searchsorted(height[levels], np.arange(height[-1] + 2))
+    children = np.argsort(height[parent[:-1]], kind='mergesort')
+    cbounds = np.searchsorted(height[parent[children]], np.arange(height[-1] + 2))
+    for h in xrange(1, height[-1] + 1):
+        c = children[cbounds[h]:cbounds[h + 1]]
+        np.minimum.at(lo, parent[c], lo[c])
+        np.maximum.at(hi, parent[c], hi[c])
+        level = levels[lbounds[h]:lbounds[h + 1]]
+        ids[level] = spindex.rangeLca(lo[level], hi[level])
+
+    return nodes, ids
+
+
+def _indexLcaMapping(genetree, spindex, multspeciename=True):
+    """LCA mapping between a genetree and the species tree of a SpeciesTreeIndex, done on the node ids"""
+    nodes, ids = lcaMappingIds(genetree, spindex)
+    mapping = dict(itertools.izip(nodes, (spindex.nodes[i] for i in ids)))
+    names = spindex.names
+    for node, i in itertools.izip(nodes, ids):
+        if not node.is_leaf():
+            if(multspeciename):
+                node.add_features(
+                    species=",".join(sorted(set([mapping[n].name for n in node.get_children()]))))
+            else:
+                node.add_features(species=names[i])
+
+    genetree.add_features(lcaMap=mapping)
+    return mapping
+
+
 def reconcile(genetree=None, lcaMap=None, lost=False, lost_label_fn=None):
     """Reconcile genetree topology to a specietree, using an adequate mapping obtained with lcaMapping.
     'reconcile' will infer evolutionary events like gene lost, gene speciation and gene duplication with distinction between AD and NAD
@@ -502,12 +570,16 @@ def reconcile(genetree=None, lcaMap=None, lost=False, lost_label_fn=None):
     genetree.add_features(reconciled=True)
 
 
-def computeDLScore(genetree, lcaMap=None, dupcost=None, losscost=None):
+def computeDLScore(genetree, lcaMap=None, dupcost=None, losscost=None, spindex=None):
     """
     Compute the reconciliation cost
+    When the SpeciesTreeIndex spindex of the species tree is given, the losses are
+    counted on the parent ids of the index
     """
     if not lcaMap and genetree.has_feature('lcaMap'):
         lcaMap = genetree.lcaMap
+    if lcaMap and spindex is not None:
+        return _indexDLScore(genetree, lcaMap, dupcost, losscost, spindex)
     dup_score = 0
     loss_score = 0
     if lcaMap:
@@ -539,7 +611,45 @@ def computeDLScore(genetree, lcaMap=None, dupcost=None, losscost=None):
     return dup_score, loss_score
 
 
+def _indexDLScore(genetree, lcaMap, dupcost, losscost, spindex):
+    """computeDLScore using the parent ids of the SpeciesTreeIndex spindex, and its params.costTable"""
+    parent = spindex.parent
+    children = spindex.children
+    costs = params.costTable(spindex)
+    dup_score = 0
+    loss_score = 0
+    for node in genetree.traverse("levelorder"):
+        s = spindex.nodeId(lcaMap[node])
+        child_ids = [spindex.nodeId(lcaMap[child]) for child in node.get_children()]
+        node_is_dup = 0
+        if s in child_ids:
+            node_is_dup = costs.dup[s]
+            dup_score += (dupcost if dupcost else node_is_dup)
+
+        for c in child_ids:
+            # walking up from the image of the child to the image of node (or one of its children)
+            while c != s and (node_is_dup or parent[c] != s):
+                p = parent[c]
+                if losscost:
+                    loss_score += (len(children[p]) - 1) * losscost
+                else:
+                    loss_score += np.sum([costs.loss[l] for l in children[p] if l != c])
+                c = p
+    return dup_score, loss_score
+
+
 def computeDTLScore(genetree, speciestree, Dc=1, Tc=1, Lc=1, flag=True):
+    """speciestree can also be a SpeciesTreeIndex, in which case it is not preprocessed again"""
+    if isinstance(speciestree, SpeciesTreeIndex):
+        spindex = speciestree
+        speciestree = spindex.tree
+        leafMap = {}
+        for leaf in genetree:
+            if not leaf.has_feature('species'):
+                raise ValueError("You should set species before calling")
+            leafMap[leaf] = spindex.getNode(leaf.species)
+        return _computeDTLScore(genetree, speciestree, leafMap, Dc, Tc, Lc, flag)
+
     if not speciestree.has_feature('lcaprocess', True):
         speciestree.label_internal_node()
         lcaPreprocess(speciestree)
@@ -548,7 +658,10 @@ def computeDTLScore(genetree, speciestree, Dc=1, Tc=1, Lc=1, flag=True):
         if not leaf.has_feature('species'):
             raise ValueError("You should set species before calling")
         leafMap[leaf] = speciestree&leaf.species
-    
+    return _computeDTLScore(genetree, speciestree, leafMap, Dc, Tc, Lc, flag)
+
+
+def _computeDTLScore(genetree, speciestree, leafMap, Dc, Tc, Lc, flag):
     cost_table = MatrixRep(genetree, speciestree, np.inf)
     spec_table = MatrixRep(genetree, speciestree, np.inf)
     dup_table = MatrixRep(genetree, speciestree, np.inf)
@@ -833,74 +946,82 @@ def getReverseMap(lcamap, use_name=False):
     return reversedmap
 
 
+def getImageTreeArrays(genetree, specietree, lcamap):
+    """Compressed child-image subtrees I(g) of the internal nodes g of genetree, on the node ids of
+    the SpeciesTreeIndex of specietree (specietree can also be the index itself).
+    Return a dict that maps each internal node g to (ids, parent) : the integer arrays of the species ids
+    of the nodes of I(g) in preorder, and of the position of the parent of each node in ids (-1 for the root).
+
+    I(g) contains the images of the children of g and the lca of each pair of them, which are the lca of the
+    consecutive images in preorder. In a set of species closed under lca and sorted in preorder, the parent of
+    a node is the lca of the node and of the one before it, so all the I(g) are built together with a few
+    vectorised lca queries, without copying the species tree nodes."""
+
+    spindex = getSpeciesTreeIndex(specietree)
+    first = spindex.first
+    n = len(spindex)
+
+    gnodes = [node for node in genetree.traverse("postorder") if not node.is_leaf()]
+    gids, sids = [], []
+    for g, node in enumerate(gnodes):
+        for child in node.children:
+            gids.append(g)
+            sids.append(spindex.nodeId(lcamap[child]))
+
+    def sortedKeys(keys):
+        # the species of each gene node, in preorder (the ids of the index are preorder ranks) and without repeats
+        keys = np.unique(keys)
+        return keys // n, keys % n
+
+    gids, sids = sortedKeys(np.array(gids, dtype=int) * n + np.array(sids, dtype=int))
+
+    # lca of the consecutive images of each gene node
+    same = np.nonzero(gids[1:] == gids[:-1])[0]
+    lcas = spindex.rangeLca(first[sids[same]], first[sids[same + 1]])
+    gids, sids = sortedKeys(np.concatenate((gids * n + sids, gids[same] * n + lcas)))
+    keys = gids * n + sids
+
+    # parent of each node, the first node of each gene node being the root of its image tree
+    bounds = np.searchsorted(gids, np.arange(len(gnodes) + 1))
+    parent = np.full(len(sids), -1, dtype=int)
+    same = np.nonzero(gids[1:] == gids[:-1])[0] + 1
+    parent[same] = np.searchsorted(keys, gids[same] * n + spindex.rangeLca(first[sids[same - 1]], first[sids[same]]))
+    parent[same] -= bounds[gids[same]]
+
+    return dict((node, (sids[bounds[g]:bounds[g + 1]], parent[bounds[g]:bounds[g + 1]])) for g, node in enumerate(gnodes))
+
+
 def getImageTreeNode(genetree, specietree, lcamap):
-    """ Get the specie image tree node of a genetree"""
+    """ Get the specie image tree node of a genetree
+    specietree can also be a SpeciesTreeIndex.
+    The image trees are built from getImageTreeArrays, their nodes are new nodes
+    with the name and the depth of the species"""
+
+    spindex = getSpeciesTreeIndex(specietree)
+    spnodes = spindex.nodes
 
-    # get pre(s) for each  node in specietree
-    reversedmap = getReverseMap(lcamap)
     k = 0
-    # Traverse G in df order and set ih to 0 for internal node
     for node in genetree.iter_internal_node("levelorder", enable_root=True):
-        node.add_features(i_h=0)
         if not node.name or node.name=="NoName":
             node.name = 'n%d' % k
 
     # Arange the children of each node in G according to the position of their images
     # in post-order traversal of S
-    for snode in specietree.traverse("postorder"):
-        for gnode in reversedmap[snode]:
-            p_gnode = gnode.up
-            if(p_gnode):
-                gnode_ind = [x for x in xrange(len(p_gnode.children)) if p_gnode.children[
-                    x] == gnode][0]
-                p_gnode.children[gnode_ind], p_gnode.children[
-                    p_gnode.i_h] = p_gnode.children[p_gnode.i_h], p_gnode.children[gnode_ind]
-                p_gnode.i_h += 1
-
-    # compute B(s) that contains all the gene tree nodes g / s in I(g) for s
-    # in S
-    B_array = ddict(list)
+    rank = np.empty(len(spindex), dtype=int)
+    rank[spindex.postorder] = np.arange(len(spindex))
     for node in genetree.traverse("postorder"):
-        childlist = node.get_children()
-        for child in childlist:
-            B_array[lcamap[child]].append(node)
-        for i in xrange(0, len(childlist) - 1):
-            B_array[getLca(specietree, [lcamap[childlist[i]],
-                                        lcamap[childlist[i + 1]]])].append(node)
-
-    # Store all the specie tree nodes of the compresses child-image subtree I(g)
-    # and construct all I(g)
-    # At this step, we are actually certain that the euler tour of S was
-    # already computed
-    image_tree_nodes = ddict(list)
-    for s in specietree.ind2node:
-        for h in B_array[s]:
-            image_tree_nodes[h].append(s)
-
-    # Here we are going to construct the tree
+        if len(node.children) > 1:
+            node.children.sort(key=lambda child: rank[spindex.nodeId(lcamap[child])])
+
     image_tree = {}
-    for node in genetree.traverse("postorder"):
-        nodecopied = {}
-        if not image_tree_nodes[node]:
-            continue
-        el1 = image_tree_nodes[node].pop()
-        a = el1._copy_node(features=['name', 'depth'])
-        nodecopied[el1] = a
-        while len(image_tree_nodes[node]) > 0:
-            el2 = image_tree_nodes[node].pop()
-            b = nodecopied.get(el2, None)
-            if not b:
-                b = el2._copy_node(features=['name', 'depth'])
-                nodecopied[el2] = b
-            if (a != b):
-                if a.depth < b.depth:
-                    if(b not in a.get_children()):
-                        a.add_child(b)
-                elif a.depth > b.depth:
-                    if(a not in b.get_children()):
-                        b.add_child(a)
-            a = b
-        image_tree[node] = a.get_tree_root()
+    for node, (ids, parent) in getImageTreeArrays(genetree, spindex, lcamap).iteritems():
+        copies = []
+        for s, p in itertools.izip(ids.tolist(), parent.tolist()):
+            copy = spnodes[s]._copy_node(features=['name', 'depth'])
+            if p >= 0:
+                copies[p].add_child(copy)
+            copies.append(copy)
+        image_tree[node] = copies[0]
     return image_tree
 
 
@@ -921,6 +1042,42 @@ def treeHash(tree, addinfos=''):
     return hashlib.sha384(newick_str + addinfos).hexdigest()
 
 
+def toParentArray(trees, internalLabels=False):
+    """Encode a forest in preorder, as a parent index array (-1 for the roots) and the list of the node names
+    (empty for internal nodes, unless internalLabels is True). The parent of a node always comes before it.
+    Return (parents, labels, nodes), nodes being the node at each index"""
+    parents, labels, nodes = [], [], []
+    for tree in trees:
+        # the parent index is carried along the traversal, rather than read from node.up
+        stack = [(tree, -1)]
+        while stack:
+            node, parent = stack.pop()
+            ind = len(nodes)
+            parents.append(parent)
+            labels.append(node.name if (internalLabels or node.is_leaf()) else "")
+            nodes.append(node)
+            stack.extend((child, ind) for child in reversed(node.children))
+    return parents, labels, nodes
+
+
+def fromParentArray(parents, labels):
+    """Build a TreeClass from its encoding in preorder as a parent index array (see toParentArray).
+    Only the leaves are named. Return (tree, nodes), nodes being the node at each index"""
+    nodes = []
+    for p in parents:
+        nodes.append(TreeClass() if p < 0 else nodes[p].add_child())
+    for node, label in itertools.izip(nodes, labels):
+        if node.is_leaf():
+            node.name = label
+    return (nodes[0] if nodes else None), nodes
+
+
+def speciesParentArray(specietree):
+    """Encode the specietree (or its SpeciesTreeIndex) as a parent index array with its node names (see toParentArray).
+    Return (parents, labels, name2ind), name2ind being the index of each node name"""
+    return getSpeciesTreeIndex(specietree).parentArray()
+
+
 def newickPreprocessing(newick, gene_sep=None):
     """Newick format pre-processing in order to assure its correctness"""
     DEF_SEP_LIST = [';;', '-', '|', '%', ':', ';', '+', '/']
@@ -1,7 +1,10 @@
 from TreeClass import TreeClass
+from SpeciesTreeIndex import SpeciesTreeIndex
+from CompactTree import CompactTree
+from CladeIndex import CladeIndex
 import TreeUtils
 import ClusterUtils
 import SimulModel
 from memorize import memorize
 import params
-__all__= ["TreeUtils", "ClusterUtils", "TreeClass", "memorize", "params", 'SimulModel']
+__all__= ["TreeUtils", "ClusterUtils", "TreeClass", "SpeciesTreeIndex", "CompactTree", "CladeIndex", "memorize", "params", 'SimulModel']
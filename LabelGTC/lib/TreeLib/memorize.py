@@ -1,37 +1,149 @@
+import sys
+import time
+import threading
 from collections import Hashable as hashable
-from functools import partial
+from collections import OrderedDict
+from functools import partial, update_wrapper
+
+
+def sizeof(value):
+    """Estimate the memory used by a cached value : the bytes of the numpy arrays,
+    and the size of the containers and of their content"""
+    if hasattr(value, 'nbytes'):
+        return value.nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeof(k) + sizeof(v) for k, v in value.iteritems())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sizeof(x) for x in value)
+    return size
 
 
 class memorize(object):
     """Cache function output when it's called and return it
     later when the same function is called with the same input,
     in this case, memorize use a hash to determine value to reevalute
+
+    By default, the hash is given as the first argument of each call, and is not passed to the function
+    (a None or unhashable hash disables the cache for the call). When key is given, the hash is
+    computed by key(*args, **kwargs) instead, and the function gets all the arguments.
+
+    The cache keeps at most maxsize entries and maxbytes bytes (estimated by sizeof),
+    the least recently used entries being evicted first, and an entry expires ttl seconds
+    after it was computed (None for no limit). It can be used by several threads.
+
+    Usage :
+        @memorize
+        def f(x): ...
+        f(hash, x)
+
+        @memorize(maxsize=128, key=lambda x: x)
+        def g(x): ...
+        g(x)
     """
 
-    def __init__(self, function):
+    def __new__(cls, function=None, **options):
+        if function is None:
+            # used as @memorize(...), the function is given to the returned decorator
+            return lambda function: cls(function, **options)
+        return object.__new__(cls)
+
+    def __init__(self, function=None, maxsize=None, maxbytes=None, ttl=None, key=None, sizeof=sizeof):
         self.function = function
-        self.cache = {}
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.key = key
+        self.sizeof = sizeof
+        # hash -> (output, size, time of the call), from the least to the most recently used
+        self.cache = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = threading.RLock()
+        if hasattr(function, '__name__'):
+            update_wrapper(self, function)
 
-    def __call__(self, hash, *args, **kwargs):
+    def __call__(self, *args, **kwargs):
         """Call to memorize, (as decorator)"""
 
-        if hash in self.cache:
-            return self.cache[hash]
+        if self.key is None:
+            hash, args = args[0], args[1:]
+        else:
+            hash = self.key(*args, **kwargs)
 
-        elif not isinstance(hash, hashable) or hash is None:
+        if hash is None or not isinstance(hash, hashable):
             # hash is None or uncachable
             return self.function(*args, **kwargs)
 
-        else:
-            output = self.function(*args, **kwargs)
-            self.cache[hash] = output
-            return output
+        with self.lock:
+            entry = self.cache.pop(hash, None)
+            if entry is not None and self.ttl is not None and time.time() - entry[2] > self.ttl:
+                self.nbytes -= entry[1]
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self.cache[hash] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # the function is called without holding the lock, so that other calls are not blocked
+        output = self.function(*args, **kwargs)
+        size = self.sizeof(output) if self.maxbytes is not None else 0
+
+        with self.lock:
+            old = self.cache.pop(hash, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self.cache[hash] = (output, size, time.time())
+            self.nbytes += size
+            self._evict()
+        return output
+
+    def _evict(self):
+        """Evict the least recently used entries until the cache fits in its bounds"""
+        while self.cache and ((self.maxsize is not None and len(self.cache) > self.maxsize) or
+                              (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+            _, entry = self.cache.popitem(last=False)
+            self.nbytes -= entry[1]
+            self.evictions += 1
+
+    def __contains__(self, hash):
+        return hash in self.cache
+
+    def __len__(self):
+        return len(self.cache)
+
+    def clear(self):
+        """Remove all the cached outputs, and reset the counters"""
+        with self.lock:
+            self.cache.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.expirations = 0
+
+    def stats(self):
+        """Return the size of the cache and its hit, miss, eviction and expiration counters"""
+        with self.lock:
+            return {'size': len(self.cache), 'maxsize': self.maxsize, 'nbytes': self.nbytes, 'maxbytes': self.maxbytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'expirations': self.expirations}
 
     def __repr__(self):
         """Return cached data"""
-        for hash, data in self.cache:
-            print hash, '=============>\n', data
+        with self.lock:
+            lines = ["%s =============>\n%s" % (hash, entry[0]) for hash, entry in self.cache.iteritems()]
+        return "\n".join(["memorize(%s, %s)" % (getattr(self.function, '__name__', self.function), self.stats())] + lines)
 
     def __get__(self, obj, objtype):
         """Instance methods support"""
+        if obj is None:
+            return self
+        if self.key is None:
+            # the hash stays the first argument of the call
+            return lambda hash, *args, **kwargs: self(hash, obj, *args, **kwargs)
         return partial(self.__call__, obj)
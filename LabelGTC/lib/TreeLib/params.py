@@ -5,22 +5,42 @@
 __author__ = "Emmanuel Noutahi"
 
 import hashlib
+import weakref
+import itertools
 import numpy as np
+from memorize import memorize
 
 cdup, closs = 1, 1
 dupcost, losscost = {}, {}
 internal_type = 0
 
+# incremented by set, so that the cost tables built with the previous costs are rebuilt
+_version = 0
+# cost table of each SpeciesTreeIndex, built from the costs of set (with their version) or given by setBranchCosts
+_tables = weakref.WeakKeyDictionary()
+_attached = weakref.WeakKeyDictionary()
+# serial number of each CostTable, that identifies the costs it holds
+_serials = itertools.count()
+
 
 def set(dup, loss, constdlcost=(1, 1), internal_mode='default'):
     global dupcost, losscost
     global cdup, closs
     global internal_type
+    global _version
     dupcost, losscost = dup, loss
     cdup, closs = constdlcost
     internal_type = 1 if internal_mode == 'mean' else 0
+    _version += 1
+
 
+def _hashKey(splist):
+    """The species list, as a sorted tuple, whose hash is remembered by get_hash"""
+    return splist if isinstance(splist, basestring) else tuple(sorted(splist))
 
+
+# the hashes of the species lists met most recently, so that getdup and getloss don't compute a sha384 for every lookup
+@memorize(maxsize=4096, key=_hashKey)
 def get_hash(splist):
     if not isinstance(splist, basestring):
         splist = ",".join(sorted(splist))
@@ -56,3 +76,59 @@ def get_internal(specie, costfun, ctype="loss"):
     else:
         defcost = closs if ctype == 'loss' else cdup
     return defcost
+
+
+class CostTable(object):
+    """Duplication and loss cost of each node of a species tree, in arrays indexed by the node ids
+    of its SpeciesTreeIndex, so that a cost is read in O(1).
+    dup and loss give the cost of some nodes (a dict by node name, or an array by node id),
+    the others having the cost given by getdup and getloss"""
+
+    def __init__(self, spindex, dup=None, loss=None):
+        self.spindex = spindex
+        self.serial = next(_serials)
+        self.dup = self._costs(spindex, dup, getdup)
+        self.loss = self._costs(spindex, loss, getloss)
+
+    @staticmethod
+    def _costs(spindex, given, costfun):
+        if given is not None and not isinstance(given, dict):
+            return np.asarray(given)
+        given = given or {}
+        return np.array([given[name] if name in given else costfun(node) for node, name in zip(spindex.nodes, spindex.names)])
+
+    def getdup(self, specie):
+        """Duplication cost of a species node, given by its id, its name or itself"""
+        return self.dup[specie if isinstance(specie, (int, long, np.integer)) else self.spindex.nodeId(specie)]
+
+    def getloss(self, specie):
+        """Loss cost of a species node, given by its id, its name or itself"""
+        return self.loss[specie if isinstance(specie, (int, long, np.integer)) else self.spindex.nodeId(specie)]
+
+
+def setBranchCosts(spindex, dup=None, loss=None):
+    """Attach per-branch costs to a SpeciesTreeIndex (see CostTable), used instead of the costs of set
+    for this species tree. Return the CostTable"""
+    table = CostTable(spindex, dup, loss)
+    _attached[spindex] = table
+    return table
+
+
+def costTable(spindex):
+    """Return the CostTable of a SpeciesTreeIndex : the one attached by setBranchCosts,
+    or the one of the costs of set, built once for each call to set"""
+    if spindex in _attached:
+        return _attached[spindex]
+    version, table = _tables.get(spindex, (None, None))
+    if version != _version:
+        table = CostTable(spindex)
+        _tables[spindex] = (_version, table)
+    return table
+
+
+def costKey(spindex=None):
+    """Identifier of the costs used for the species tree of a SpeciesTreeIndex (or for the costs of set, without index),
+    that changes whenever these costs are changed by set or setBranchCosts. Results memorized for some costs are keyed on it"""
+    if spindex is None:
+        return "v%d" % _version
+    return "t%d" % costTable(spindex).serial
@@ -205,6 +205,159 @@ string DoSuperGeneTree(string gcontent, string scontent, bool preserveDupSpec, s
 
 
 
+/**
+  Build the trees of a forest encoded in preorder as a parent index array.
+  nodes is filled with the node created for each index, and the roots are returned.
+  **/
+vector<Node*> TreesFromParentArray(vector<int> &parents, vector<string> &labels, vector<Node*> &nodes, bool maintainTreeInfo = false)
+{
+    vector<Node*> roots;
+    nodes.resize(parents.size(), NULL);
+
+    for (int i = 0; i < parents.size(); i++)
+    {
+        Node* n;
+        if (parents[i] < 0)
+        {
+            n = new Node(maintainTreeInfo);
+            roots.push_back(n);
+        }
+        else
+        {
+            if (parents[i] >= i)
+            {
+                for (int r = 0; r < roots.size(); r++)
+                    delete roots[r];
+                throw invalid_argument("Trees must be given in preorder (parent index lower than node index)");
+            }
+            n = nodes[parents[i]]->InsertChild(nodes[parents[i]]->GetNbChildren());
+        }
+
+        if (i < labels.size())
+            n->SetLabel(labels[i]);
+
+        nodes[i] = n;
+    }
+
+    return roots;
+}
+
+
+/**
+  Encode a tree in preorder as a parent index array, nodes is filled with the node at each index.
+  **/
+void TreeToParentArray(Node* root, vector<int> &parents, vector<string> &labels, vector<Node*> &nodes)
+{
+    vector< pair<Node*, int> > stack;
+    stack.push_back(make_pair(root, -1));
+
+    while (!stack.empty())
+    {
+        pair<Node*, int> cur = stack.back();
+        stack.pop_back();
+
+        int index = parents.size();
+        parents.push_back(cur.second);
+        labels.push_back(cur.first->GetLabel());
+        nodes.push_back(cur.first);
+
+        for (int c = cur.first->GetNbChildren() - 1; c >= 0; c--)
+            stack.push_back(make_pair(cur.first->GetChild(c), index));
+    }
+}
+
+
+vector<int> DoSuperGeneTreeFromArrays(vector<int> &gparents, vector<string> &glabels, vector<int> &gspecies,
+                                      vector<int> &sparents, vector<string> &slabels, bool preserveDupSpec,
+                                      vector<int> &cparents, vector<string> &clabels,
+                                      vector<string> &outlabels, vector<int> &outspecies)
+{
+    vector<int> outparents;
+
+    vector<Node*> speciesNodes;
+    vector<Node*> speciesRoots = TreesFromParentArray(sparents, slabels, speciesNodes, true);
+    if (speciesRoots.size() != 1)
+    {
+        for (int i = 0; i < speciesRoots.size(); i++)
+            delete speciesRoots[i];
+        throw invalid_argument("The species tree should have a single root");
+    }
+    Node* speciesTree = speciesRoots[0];
+
+    vector<Node*> geneNodes;
+    vector<Node*> geneTrees = TreesFromParentArray(gparents, glabels, geneNodes);
+
+    vector<Node*> cladeNodes;
+    vector<Node*> clades = TreesFromParentArray(cparents, clabels, cladeNodes);
+    vector<Node*> trees;
+
+    //the species of the gene leaves are given, no need to parse the labels
+    unordered_map<Node*, Node*> leavesMapping;
+    unordered_map<string, int> labelSpecies;
+    string error = "";
+    for (int i = 0; i < geneNodes.size() && error == ""; i++)
+    {
+        if (geneNodes[i]->IsLeaf())
+        {
+            if (i >= gspecies.size() || gspecies[i] < 0 || gspecies[i] >= speciesNodes.size())
+                error = "No valid species for gene " + geneNodes[i]->GetLabel();
+            else
+            {
+                leavesMapping[geneNodes[i]] = speciesNodes[gspecies[i]];
+                labelSpecies[geneNodes[i]->GetLabel()] = gspecies[i];
+            }
+        }
+    }
+
+    vector< unordered_map<Node*, Node*> > lca_mappings;
+    if (error == "")
+    {
+        for (int i = 0; i < geneTrees.size(); i++)
+            lca_mappings.push_back(GeneSpeciesTreeUtil::Instance()->GetLCAMapping(geneTrees[i], speciesTree, leavesMapping));
+
+        SuperGeneTreeMaker sgtMaker;
+        pair<Node*, int> res = sgtMaker.GetSuperGeneTreeMinDL(geneTrees, clades, trees, lca_mappings, speciesTree, preserveDupSpec, true);
+        Node* superTree = res.first;
+
+        if (superTree)
+        {
+            vector<Node*> outNodes;
+            TreeToParentArray(superTree, outparents, outlabels, outNodes);
+
+            unordered_map<Node*, int> speciesIndex;
+            for (int i = 0; i < speciesNodes.size(); i++)
+                speciesIndex[speciesNodes[i]] = i;
+
+            unordered_map<Node*, Node*> newLeavesMapping;
+            for (int i = 0; i < outNodes.size(); i++)
+            {
+                if (outNodes[i]->IsLeaf())
+                    newLeavesMapping[outNodes[i]] = speciesNodes[labelSpecies[outNodes[i]->GetLabel()]];
+            }
+            unordered_map<Node*, Node*> lcamap_new = GeneSpeciesTreeUtil::Instance()->GetLCAMapping(superTree, speciesTree, newLeavesMapping);
+
+            for (int i = 0; i < outNodes.size(); i++)
+                outspecies.push_back(speciesIndex[lcamap_new[outNodes[i]]]);
+
+            delete superTree;
+        }
+    }
+
+    for (int i = 0; i < geneTrees.size(); i++)
+        delete geneTrees[i];
+    for (int i = 0; i < clades.size(); i++)
+        delete clades[i];
+    delete speciesTree;
+
+    if (error != "")
+        throw invalid_argument(error);
+
+    return outparents;
+}
+
+
+
+
 
 void DoPolytomyCorrection(string gcontent, string scontent)
 {
@@ -9,12 +9,28 @@
 #include <iostream>
 #include <string>
 #include <map>
+#include <vector>
+#include <stdexcept>
 #include <time.h>
 #include "div/tinydir.h"
 
 using namespace std;
 
 string DoSuperGeneTree(string gcontent, string scontent, bool preserveDupSpec, string clades_to_preserve, string treated_trees, string outputmode="");
+
+/**
+  Same as DoSuperGeneTree, but the trees are given as arrays instead of newick strings.
+  A forest is encoded in preorder : parents[i] is the index of the parent of node i (parents[i] < i), or -1 if node i is a root.
+  gspecies[i] is the index, in the species tree arrays, of the species of the gene leaf i (ignored for internal nodes).
+  Labels are only used to identify the leaves, they are not parsed.
+  The resulting tree is returned the same way : the parents array is returned, and its labels and species indexes are written in
+  outlabels and outspecies (species indexes are given for every node, according to the lca mapping).
+  An empty vector is returned if no tree could be built.
+  **/
+vector<int> DoSuperGeneTreeFromArrays(vector<int> &gparents, vector<string> &glabels, vector<int> &gspecies,
+                                      vector<int> &sparents, vector<string> &slabels, bool preserveDupSpec,
+                                      vector<int> &cparents, vector<string> &clabels,
+                                      vector<string> &outlabels, vector<int> &outspecies);
 string DoSubtreeCorrection(string gcontent, string scontent, bool preserveDupSpec, string markedNodesMode = "", string outputmode = "tree");
 
 string DoSGTOnHighSpecs(string gcontent, string scontent, string clades_to_preserve, string treated_trees, bool preserveDupSpec, int maxNBLeaves = 999999, int maxNBSubtrees = 999999);
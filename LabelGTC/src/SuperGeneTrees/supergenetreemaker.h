@@ -54,6 +54,7 @@ private:
 
     TreeLabelIntersectionInfo intersectionInfo;
 
+    //only shared by the recursive calls of a single GetSuperGeneTreeMinDL, use one SuperGeneTreeMaker per thread
     unordered_map<string, pair<Node*, int> > recursionCache;
 
 
@@ -18,9 +18,13 @@ private:
     GeneSpeciesTreeUtil();
 
 public:
+    /**
+      One instance per thread, since LASTNBDUPS and LASTNBLOSSES are written by GetDLScore.
+      This allows the trees to be corrected in several threads at the same time.
+      **/
     static GeneSpeciesTreeUtil* Instance()
     {
-        static GeneSpeciesTreeUtil instance;
+        static thread_local GeneSpeciesTreeUtil instance;
 
         return &instance;
     }
@@ -2,12 +2,170 @@ from libcpp.vector cimport vector
 from libcpp.string cimport string
 from libcpp cimport bool
 
-cdef extern from "SuperGeneTrees/minSGT.h":
-	string DoSuperGeneTree(string gcontent, string scontent, bool preserveDupSpec, string outputmode, string clades_to_preserve, string treated_trees)
+import threading
+from collections import OrderedDict
+
+cdef extern from "SuperGeneTrees/minSGT.h" nogil:
+	string DoSuperGeneTree(string gcontent, string scontent, bool preserveDupSpec, string outputmode, string clades_to_preserve, string treated_trees) except +
+	vector[int] DoSuperGeneTreeFromArrays(vector[int] &gparents, vector[string] &glabels, vector[int] &gspecies, vector[int] &sparents, vector[string] &slabels, bool preserveDupSpec, vector[int] &cparents, vector[string] &clabels, vector[string] &outlabels, vector[int] &outspecies) except +
 
 
 cpdef getMinSGT(string gcontent, string scontent, bool preserveDupSpec, string clades, string trees, string outmode=""):
 
+	cdef string res
+
+	# the GIL is released, so that several trees can be corrected at the same time in different threads
+	with nogil:
+		res = DoSuperGeneTree(gcontent, scontent, preserveDupSpec, clades, trees, outmode)
+	return res
+
+
+cdef class SGTCache:
+	"""Bounded cache of minSGT results that persists between calls (LRU eviction).
+	A result is stored once for a set of covering subtrees that is identical up to leaf relabelling :
+	the key is the canonical form of the subtrees with the species of their leaves, of the relevant clades to preserve,
+	of the species tree and of preserveDupSpec.
+	The cache can be shared by several threads"""
+
+	cdef public object entries
+	cdef public object species
+	cdef public long maxsize
+	cdef public long hits
+	cdef public long misses
+	cdef public object lock
+
+	def __init__(self, maxsize=1024):
+		self.entries = OrderedDict()
+		self.species = {}
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		# reentrant, so that a subclass can hold it while calling these methods
+		self.lock = threading.RLock()
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __repr__(self):
+		return "SGTCache(maxsize=%d, size=%d, hits=%d, misses=%d)" % (self.maxsize, len(self.entries), self.hits, self.misses)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.species.clear()
+			self.hits = 0
+			self.misses = 0
+
+	def stats(self):
+		with self.lock:
+			return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize}
+
+	def speciesId(self, sparents, slabels):
+		"""Small identifier of a species tree, so that it is not stored in every key"""
+		sptree = (tuple(sparents), tuple(slabels))
+		with self.lock:
+			return self.species.setdefault(sptree, len(self.species))
+
+	def get(self, key):
+		with self.lock:
+			value = self.entries.pop(key, None)
+			if value is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+				self.entries[key] = value
+			return value
+
+	def put(self, key, value):
+		with self.lock:
+			self.entries.pop(key, None)
+			self.entries[key] = value
+			while len(self.entries) > self.maxsize:
+				self.entries.popitem(last=False)
+
+
+def _canonicalForest(parents, leafKeys):
+	"""Canonical string of each node of a forest given in preorder, children being sorted by their canonical string.
+	Leaves are written with leafKeys (None for a leaf makes its ancestors None).
+	Return (canon, children), children being sorted in canonical order"""
+
+	cdef int n = len(parents)
+	cdef int i
+	children = [[] for i in range(n)]
+	for i in range(n):
+		if parents[i] >= 0:
+			children[parents[i]].append(i)
+
+	canon = [None] * n
+	for i in range(n - 1, -1, -1):
+		if children[i]:
+			if any(canon[c] is None for c in children[i]):
+				continue
+			children[i].sort(key=canon.__getitem__)
+			canon[i] = "(" + ",".join([canon[c] for c in children[i]]) + ")"
+		else:
+			canon[i] = leafKeys[i]
+	return canon, children
+
+
+def _canonicalProblem(gparents, glabels, gspecies, cparents, clabels):
+	"""Canonical form of a minSGT problem, up to leaf relabelling.
+	Return (forest key, clades key, labels of the leaves in canonical order)"""
+
+	canon, children = _canonicalForest(gparents, [str(s) for s in gspecies])
+	roots = sorted([i for i in range(len(gparents)) if gparents[i] < 0], key=canon.__getitem__)
+
+	# leaves numbered in the canonical order of the forest
+	leaves = []
+	stack = list(reversed(roots))
+	while stack:
+		i = stack.pop()
+		if children[i]:
+			stack.extend(reversed(children[i]))
+		else:
+			leaves.append(glabels[i])
+	position = dict((label, "%d" % pos) for pos, label in enumerate(leaves))
+
+	# only the clades made of these leaves can be preserved
+	ccanon, cchildren = _canonicalForest(cparents, [position.get(label) for label in clabels])
+	clades = sorted([ccanon[i] for i in range(len(cparents)) if cparents[i] < 0 and ccanon[i] is not None])
+
+	return "|".join([canon[i] for i in roots]), "|".join(clades), leaves
+
+
+cpdef getMinSGTFromArrays(vector[int] gparents, vector[string] glabels, vector[int] gspecies, vector[int] sparents, vector[string] slabels, bool preserveDupSpec, vector[int] cparents=[], vector[string] clabels=[], SGTCache cache=None):
+	"""Same as getMinSGT, with array-encoded trees instead of newick strings.
+	Each forest is given in preorder, as a parent index array (-1 for the roots) and the label of each node.
+	gspecies gives the index in the species tree arrays of the species of each gene leaf.
+	When a cache is given, the result is looked up there first, and stored there otherwise.
+	Return the (parents, labels, species) arrays of the resulting tree, species being the lca mapping of each node"""
+
+	cdef vector[string] outlabels
+	cdef vector[int] outspecies
+	cdef vector[int] outparents
+
+	if cache is not None:
+		forest, clades, leaves = _canonicalProblem(gparents, glabels, gspecies, cparents, clabels)
+		key = (cache.speciesId(sparents, slabels), preserveDupSpec, forest, clades)
+		value = cache.get(key)
+		if value is not None:
+			parents, labels, species = value
+			# the leaves are stored by their position in the canonical order
+			return list(parents), [leaves[l] if isinstance(l, int) else l for l in labels], list(species)
+
+	with nogil:
+		outparents = DoSuperGeneTreeFromArrays(gparents, glabels, gspecies, sparents, slabels, preserveDupSpec, cparents, clabels, outlabels, outspecies)
+
+	if cache is not None and outparents.size() > 0:
+		position = {}
+		for pos, label in enumerate(leaves):
+			position[label] = pos
+		labels = []
+		for i in range(outparents.size()):
+			if i + 1 < outparents.size() and outparents[i + 1] == i:
+				labels.append(outlabels[i])
+			else:
+				labels.append(position.get(outlabels[i], outlabels[i]))
+		cache.put(key, (tuple(outparents), tuple(labels), tuple(outspecies)))
 
-	res = DoSuperGeneTree(gcontent, scontent, preserveDupSpec, clades, trees, outmode)
-	return res
\ No newline at end of file
+	return outparents, outlabels, outspecies
@@ -23,3 +23,31 @@ print "\nTest without clade to preserve"
 print '------------------------------------------------------'
 
 print getMinSGT(gcontent, scontent, True, "", treated_trees, "")
+
+print "\nTest with array-encoded trees"
+print '------------------------------------------------------'
+
+from ..lib.SGT import getMinSGTFromArrays
+from ..lib.TreeLib import TreeUtils, TreeClass
+
+# same trees, the species of each gene leaf being given by its index in the species tree arrays
+sparents, slabels, snodes = TreeUtils.toParentArray([TreeClass(sptree.write(format=9)).label_internal_node()], internalLabels=True)
+name2ind = dict((name, i) for i, name in enumerate(slabels) if name)
+gparents, glabels, gnodes = TreeUtils.toParentArray(gtreelist)
+gspecies = [name2ind[g.name.split("__")[1]] if g.is_leaf() else -1 for g in gnodes]
+cparents, clabels, cnodes = TreeUtils.toParentArray([Tree(clades_to_preserve)])
+
+parents, labels, species = getMinSGTFromArrays(gparents, glabels, gspecies, sparents, slabels, True, cparents, clabels)
+print TreeUtils.fromParentArray(parents, labels)[0].write(format=9)
+print "Species : ", [slabels[s] for s in species]
+
+print "\nTest with a cache of minSGT results"
+print '------------------------------------------------------'
+
+from ..lib.SGT import SGTCache
+
+cache = SGTCache(16)
+first = getMinSGTFromArrays(gparents, glabels, gspecies, sparents, slabels, True, cparents, clabels, cache)
+second = getMinSGTFromArrays(gparents, glabels, gspecies, sparents, slabels, True, cparents, clabels, cache)
+print TreeUtils.fromParentArray(second[0], second[1])[0].write(format=9)
+print cache
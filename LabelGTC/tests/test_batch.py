@@ -0,0 +1,95 @@
+from ..lib.LabelGTC import BatchUtils
+from ..lib.TreeLib import TreeClass
+
+from io import BytesIO
+
+import time
+
+"""
+The records of a batch manifest : comments and blank lines are ignored, the threshold of a family
+defaults to the one given to readManifest, and malformed lines are rejected with their line number.
+The families corrected by parallelCorrection are the same with one or several worker processes, in input order,
+and a family that can't be corrected is reported with its traceback without stopping the others.
+The cache of resolutions can't be saved to a file with several jobs
+"""
+
+SPECIESTREE = "((A,B),C);"
+GENETREE = "((((a_A,x_B)0.2,(b_B,e_C)0.2)0.2,y_C)0.2,((i_B,k_A)0.1,((c_C, j_A)0.1,(d_B,(g_C,h_A)0.2)0.8)0.2)0.8)0.2;"
+COVSET = "a_A;x_B;y_C;(b_B,e_C);(c_C,j_A);(g_C,h_A);d_B;(i_B,k_A);"
+
+def records(manifest, threshold=None):
+    return list(BatchUtils.readManifest(BytesIO(manifest), threshold))
+
+def rejected(manifest, threshold=None):
+    try:
+        records(manifest, threshold)
+    except ValueError as e:
+        return str(e)
+    raise AssertionError("The manifest was accepted:\n%s" % manifest)
+
+def main():
+    tps1 = time.clock()
+
+    manifest = "\n".join([
+        "# genetree\tcovering set\tthreshold\toutput",
+        "",
+        "g1.nw\tc1.txt\t0.5\tout1.nw",
+        "   ",
+        "  # indented comment",
+        "g2.nw\tc2.txt",
+        "g3.nw\tc3.txt\t\tout3.nw",
+        "g4.nw\tc4.txt\t0.9\r",
+    ])
+    assert records(manifest, 0.7) == [("g1.nw", "c1.txt", 0.5, "out1.nw"), ("g2.nw", "c2.txt", 0.7, None),
+                                      ("g3.nw", "c3.txt", 0.7, "out3.nw"), ("g4.nw", "c4.txt", 0.9, None)]
+
+    #Errors, with the line number of the record (comments and blank lines included)
+    assert rejected("# comment\n\ng1.nw\tc1.txt\t0.5\ng2.nw\tc2.txt", None) == "No threshold given for line 4 of the manifest"
+    assert rejected("g1.nw\tc1.txt\t0.5\ng2.nw", 0.5) == "Line 2 of the manifest should at least contain a genetree and a covering set"
+    assert rejected("g1.nw\tc1.txt\t0.5\ng2.nw\tc2.txt\thigh", 0.5) == "Invalid threshold on line 2 of the manifest"
+    assert records("# only comments\n\n", 0.5) == []
+
+    #batchCorrection corrects the families one after the other
+    corrected = list(BatchUtils.batchCorrection(SPECIESTREE, records("%s\t%s\n%s\t%s\t0.5\n" % (GENETREE, COVSET, GENETREE, COVSET), 0.7)))
+    assert [record[2] for record, tree in corrected] == [0.7, 0.5]
+    for record, tree in corrected:
+        assert sorted(tree.get_leaf_names()) == sorted(TreeClass(GENETREE).get_leaf_names())
+    try:
+        list(BatchUtils.batchCorrection(SPECIESTREE, [("((a_A,b_B),c_C);", "(a_A,zz_B);c_C", 0.5, None)]))
+    except ValueError as e:
+        print("Invalid family rejected : %s" % str(e).splitlines()[0])
+    else:
+        raise AssertionError("An invalid family was corrected")
+
+    #A small manifest with a broken family (zz_B is not a leaf of its genetree) between two valid ones
+    manifest = "\n".join([
+        "%s\t%s\t0.7" % (GENETREE, COVSET),
+        "((a_A,b_B),c_C);\t(a_A,zz_B);c_C\t0.5",
+        "((((a_A,x_B)0.2,(b_B,e_C)0.9)0.8,y_C)0.2,((i_B,k_A)0.1,((c_C, j_A)0.2,(d_B,(g_C,h_A)0.2)0.2)0.9)0.2)0.2;\t"
+        "y_C;((b_B,e_C),(a_A,x_B));(c_C,j_A);((g_C,h_A),d_B);(i_B,k_A);",
+    ])
+    results = {}
+    for jobs in [1, 2]:
+        results[jobs] = list(BatchUtils.parallelCorrection(SPECIESTREE, records(manifest, 0.7), jobs))
+        assert [record for record, newick, error in results[jobs]] == records(manifest, 0.7)
+        (_, first, error1), (_, broken, error2), (_, last, error3) = results[jobs]
+        assert first and last and broken is None
+        assert error1 is None and error3 is None
+        assert error2.startswith("Traceback") and "covering set" in error2
+    assert results[1] == results[2]
+    print("Families corrected with 1 and 2 jobs : %s" % [newick for record, newick, error in results[2]])
+
+    #The caches of several workers can't be saved to the same file
+    try:
+        list(BatchUtils.parallelCorrection(SPECIESTREE, records(manifest, 0.7), 2, sgtCacheSize=10, cacheFile="cache.pkl"))
+    except ValueError as e:
+        print("Cache file with 2 jobs rejected : %s" % e)
+    else:
+        raise AssertionError("A cache file was accepted with 2 jobs")
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+from ..lib.LabelGTC import LabelGTC, LabelGTCContext, ResolutionCache
+
+import os
+import sys
+
+import time
+import tempfile
+
+from ..lib.TreeLib import *
+from ..lib.TreeLib import TreeUtils, TreeClass
+
+"""
+The resolutions cached for a gene family should be reused for the identical subproblems of the next families,
+whatever the names of their genes
+"""
+
+def correct(s, gtree, cstlist, seuil, cache):
+    lgtc = LabelGTC(s, TreeClass(gtree), [TreeClass(t) for t in cstlist], seuil, context=LabelGTCContext(sgtCache=cache))
+    lgtc.mergeResolutions()
+    return lgtc.getResultedTree()
+
+def dlCost(s, tree):
+    tree = TreeClass(tree.write(format=9))
+    tree.set_species()
+    lcamap = TreeUtils.lcaMapping(tree, s, multspeciename=False)
+    return sum(TreeUtils.computeDL(tree, lcamap))
+
+def main():
+    tps1 = time.clock()
+
+    s = TreeClass("((A,B),C);")
+    s.label_internal_node()
+    seuil = 0.7
+
+    #The second family only differs from the first one by the names of its genes
+    families = [("((((a_A,x_B)0.2,(b_B,e_C)0.2)0.2,y_C)0.2,((i_B,k_A)0.1,((c_C, j_A)0.1,(d_B,(g_C,h_A)0.2)0.8)0.2)0.8)0.2;",
+                 ["a_A;", "x_B;", "y_C;", "(b_B,e_C);", "(c_C,j_A);", "(g_C,h_A);", "d_B;", "(i_B,k_A);"]),
+                ("((((a2_A,x2_B)0.2,(b2_B,e2_C)0.2)0.2,y2_C)0.2,((i2_B,k2_A)0.1,((c2_C, j2_A)0.1,(d2_B,(g2_C,h2_A)0.2)0.8)0.2)0.8)0.2;",
+                 ["a2_A;", "x2_B;", "y2_C;", "(b2_B,e2_C);", "(c2_C,j2_A);", "(g2_C,h2_A);", "d2_B;", "(i2_B,k2_A);"]),
+                ("((((a_A,x_B)0.8,(b_B,e_C)0.9)0.8,y_C)0.2,((i_B,k_A)0.1,((c_C, j_A)0.2,(d_B,(g_C,h_A)0.2)0.2)0.9)0.2)0.2;",
+                 ["y_C;", "((b_B,e_C),(a_A,x_B));", "(c_C,j_A);", "((g_C,h_A),d_B);", "(i_B,k_A);"]),
+                #Two families resolved with M-PolyRes, with the same polytomies
+                ("((a_A,(b_B,c_C)0.9)0.2,(d_A,e_B)0.8)0.2;", ["a_A;", "b_B;", "c_C;", "d_A;", "e_B;"]),
+                ("((v_A,(w_B,x_C)0.8)0.1,(y_A,z_B)0.9)0.5;", ["v_A;", "w_B;", "x_C;", "y_A;", "z_B;"])]
+
+    cache = ResolutionCache(64)
+    for g, cst in families:
+        res = correct(s, g, cst, seuil, cache)
+        print(res.write(format=9))
+
+        #The cached resolutions give the same cost as the correction without cache
+        assert set(res.get_leaf_names()) == set(TreeClass(g).get_leaf_names())
+        assert dlCost(s, res) == dlCost(s, correct(s, g, cst, seuil, None))
+
+    stats = cache.stats()
+    print(cache)
+    print(stats)
+    assert stats['hits'] > 0
+    assert stats['m-polyres']['hits'] > 0
+    assert stats['minsgt']['hits'] + stats.get('polyres', {}).get('hits', 0) + stats.get('m-polyres', {}).get('hits', 0) == stats['hits']
+
+    #The cache is saved and loaded again
+    path = os.path.join(tempfile.mkdtemp(), "cache.pkl")
+    cache.save(path)
+    loaded = ResolutionCache(64, path=path)
+    assert len(loaded) == len(cache)
+    res = correct(s, families[0][0], families[0][1], seuil, loaded)
+    assert loaded.stats()['misses'] == 0
+    os.remove(path)
+
+    #The cache is bounded by its number of nodes
+    small = ResolutionCache(64, maxnodes=10)
+    for g, cst in families:
+        correct(s, g, cst, seuil, small)
+    assert len(small) == 1 or small.nodes <= 10
+    print(small.stats())
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+from ..lib.LabelGTC import LabelGTC
+from ..lib.TreeLib import TreeClass, TreeUtils, CompactTree, CladeIndex
+
+import random
+import time
+
+"""
+The compact representation of a tree and its clade index should give the same leaves,
+subtrees and containments as the TreeClass they were built from, on random trees.
+A large genes tree is labeled by LabelGTC on its compact representation only, without adding any feature to its nodes
+"""
+
+def main():
+    tps1 = time.clock()
+
+    random.seed(7)
+
+    for rep in xrange(100):
+        tree = TreeClass()
+        tree.populate(random.randint(1, 40), random_branches=True)
+        nodes = list(tree.traverse())
+
+        #Round trip through the compact representation
+        ctree = CompactTree.fromTreeClass(tree, keepNodes=True)
+        copy = ctree.toTreeClass()
+        assert copy.write(format=9) == tree.write(format=9)
+        assert [n.support for n in copy.traverse()] == [n.support for n in nodes]
+        assert [ctree.nodes[i] for i in ctree.levelorder()] == list(tree.traverse("levelorder"))
+        assert [ctree.nodes[i] for i in ctree.postorder()] == list(tree.traverse("postorder"))
+
+        #Subtrees, as TreeClass, CompactTree and parent arrays
+        for i, node in enumerate(ctree.nodes):
+            assert ctree.toTreeClass(i).write(format=9) == node.write(format=9)
+            assert ctree.subtree(i).toTreeClass().write(format=9) == node.write(format=9)
+            parents, labels, leaves = CompactTree.parentArray([(ctree, i), (ctree, 0)])
+            assert (parents, labels) == TreeUtils.toParentArray([node, tree])[:2]
+            assert [labels[k] for k in leaves] == node.get_leaf_names() + tree.get_leaf_names()
+
+        #Topology ids : a copy of a subtree with its children swapped has the id of the subtree
+        shapes = {}
+        topology = ctree.topologyIds(shapes)
+        for i, node in enumerate(ctree.nodes):
+            copy = node.copy()
+            for n in copy.traverse():
+                n.children.reverse()
+            assert CompactTree.fromTreeClass(copy).topologyIds(shapes)[0] == topology[i]
+
+        #Clade queries
+        clades = CladeIndex(ctree)
+        for node in nodes:
+            assert clades.leaves(node) == node.get_leaf_names()
+            assert clades.nodeBitset(node) == clades.bitset(node.get_leaf_names())
+            for other in random.sample(nodes, min(5, len(nodes))):
+                contained = set(other.get_leaf_names()).issubset(set(node.get_leaf_names()))
+                assert clades.isUnder(clades.leafRange(other.get_leaf_names()), node) == contained
+                assert CladeIndex.isSubset(clades.nodeBitset(other), clades.nodeBitset(node)) == contained
+                assert clades.contains(node, other) == (node is other or node in other.get_ancestors())
+
+    #Labeling of a large genes tree
+    s = TreeClass("((A,B),C);")
+    s.label_internal_node()
+    big = TreeClass()
+    big.populate(20000, names_library=["g%d_%s" % (i, random.choice("ABC")) for i in xrange(20000)], random_branches=True)
+    lgtc = LabelGTC(s, big, [child.copy() for child in big.children], 0.5)
+    ctree = lgtc.ctree
+    lgtc.binaryLabeling()
+    edges = lgtc.largerCSE()
+    assert lgtc.ctree is ctree and ctree.nodes is None
+    assert sorted(edges) == [1, ctree.end[1]]
+    assert not any(node.has_feature('cst') or node.has_feature('binconfidence') or node.has_feature('lcse') for node in big.traverse())
+    assert ctree.nbytes < 64 * len(ctree)
+    print("%s : %d bytes" % (ctree, ctree.nbytes))
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
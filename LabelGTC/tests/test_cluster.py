@@ -0,0 +1,68 @@
+from ..lib.TreeLib import ClusterUtils, TreeClass
+
+import numpy
+import random
+import time
+
+"""
+The UPGMA clustering of ClusterUtils.UPGMA_cluster, which keeps the smallest distance of each row,
+should give the same joins, condensed matrice and last smallest_index as condensing the matrice
+with find_smallest_index at each join, for a full or partial (depth) clustering, with ties
+"""
+
+def naiveUPGMA(matrice, node_order, depth):
+    tree = None
+    smallest_index = []
+    for i in range(depth):
+        smallest_index = tuple(ClusterUtils.find_smallest_index(matrice))
+        ClusterUtils.condense_node_order(matrice, smallest_index, node_order, method='upgma')
+        matrice = ClusterUtils.condense_matrix(matrice, smallest_index, method='upgma')
+        tree = node_order[smallest_index[1]]
+    return tree, matrice, smallest_index
+
+def randomMatrix(n, ties):
+    if ties:
+        matrice = numpy.random.randint(1, 5, size=(n, n)).astype(float)
+    else:
+        matrice = numpy.random.rand(n, n)
+    matrice = matrice + matrice.T
+    numpy.fill_diagonal(matrice, 0)
+    return matrice
+
+def write(tree):
+    return tree.write(format=1, features=["length"]) if tree else None
+
+def main():
+    tps1 = time.clock()
+
+    random.seed(7)
+    numpy.random.seed(7)
+    nclusters = 0
+
+    for n in [3, 4, 5, 8, 13, 40, 100]:
+        for ties in [True, False]:
+            matrice = randomMatrix(n, ties)
+            for depth in [None, 1, 2, n / 2, n - 1, n + 3]:
+                node_order = [TreeClass("g%d;" % i) for i in xrange(n)]
+                expected = naiveUPGMA(matrice.copy(), list(node_order), min(depth or n - 1, n - 1))
+                got = ClusterUtils.UPGMA_cluster(matrice.copy(), node_order, depth)
+                assert write(got[0]) == write(expected[0])
+                assert numpy.array_equal(got[1], expected[1])
+                assert tuple(got[2]) == tuple(expected[2])
+                assert len(node_order) == len(got[1])
+                nclusters += 1
+
+    print("%d clusterings checked" % nclusters)
+
+    matrice = randomMatrix(2000, False)
+    tps = time.clock()
+    tree = ClusterUtils.UPGMA_cluster(matrice, [TreeClass("g%d;" % i) for i in xrange(2000)])[0]
+    assert len(tree) == 2000
+    print("UPGMA on 2000 genes: %f" % (time.clock() - tps))
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+from ..lib.LabelGTC import LabelGTC
+
+import random
+
+import time
+
+from ..lib.TreeLib import *
+from ..lib.TreeLib import TreeClass
+
+"""
+The cst labels given by checkCovSetTree, through the topology ids of the subtrees, should be the ones found
+by comparing each tree of the covering set with each subtree of the tree of genes with has_same_topo,
+on random binary trees, and the covering trees with polytomies should be matched regardless of the order of the children
+"""
+
+def reference(gtree, cstlist):
+    """The cst labels of the nodes of gtree in preorder, and whether the covering set is conform, with has_same_topo"""
+    cst = dict((node, 0) for node in gtree.traverse())
+    cpt = 0
+    for subtree in cstlist:
+        for node in gtree.traverse("postorder"):
+            if node.has_same_topo(subtree):
+                cpt += 1
+                if cst[node] == 0:
+                    cst[node] = 2
+                for descendant in node.get_descendants():
+                    cst[descendant] = 1
+    leaves = [leaf for subtree in cstlist for leaf in subtree.get_leaf_names()]
+    conform = cpt == len(cstlist) and len(leaves) == len(gtree) and set(leaves) == set(gtree.get_leaf_names())
+    return [cst[node] for node in gtree.traverse("preorder")], conform
+
+def check(s, gtree, cstlist):
+    """The cst labels of the nodes of gtree in preorder, and whether the covering set is conform, with checkCovSetTree"""
+    lgtc = LabelGTC(s, gtree.copy(), cstlist, 0.7)
+    conform = lgtc.checkCovSetTree()
+    return lgtc.ctree.labels['cst'].tolist(), conform
+
+def shuffled(tree):
+    """A copy of tree with the children of each node shuffled"""
+    copy = tree.copy()
+    for node in copy.traverse():
+        random.shuffle(node.children)
+    return copy
+
+def main():
+    tps1 = time.clock()
+
+    random.seed(11)
+    s = TreeClass("((A,B),C);")
+    s.label_internal_node()
+
+    conform = 0
+    for rep in xrange(100):
+        gtree = TreeClass()
+        n = random.randint(1, 25)
+        gtree.populate(n, names_library=["g%d_%s" % (i, random.choice("ABC")) for i in xrange(n)])
+
+        #A covering set cutting the tree at random, whose trees are given with their children in any order
+        cstlist = []
+        def cut(node):
+            if node.is_leaf() or random.random() < 0.3:
+                cstlist.append(shuffled(node))
+            else:
+                for child in node.children:
+                    cut(child)
+        cut(gtree)
+
+        #Replacing some trees by random trees on the same leaves, that may no longer be subtrees of the tree of genes
+        for i, subtree in enumerate(cstlist):
+            if len(subtree) > 2 and random.random() < 0.3:
+                cstlist[i] = TreeClass()
+                cstlist[i].populate(len(subtree), names_library=subtree.get_leaf_names())
+
+        expected = reference(gtree, cstlist)
+        assert check(s, gtree, cstlist) == expected
+        conform += expected[1]
+
+    print("%d conform covering sets out of 100" % conform)
+    assert 0 < conform < 100
+
+    #Polytomies, in the tree of genes and in a covering tree, with their children in another order
+    gtree = TreeClass("((a_A,b_B,c_C),(d_A,(e_B,f_C)));")
+    cst, ok = check(s, gtree, [TreeClass("(c_C,a_A,b_B);"), TreeClass("d_A;"), TreeClass("(f_C,e_B);")])
+    assert ok and cst == [0, 2, 1, 1, 1, 0, 2, 2, 1, 1]
+
+    #A binary tree is not a subtree of a polytomy
+    cst, ok = check(s, gtree, [TreeClass("(a_A,(b_B,c_C));"), TreeClass("d_A;"), TreeClass("(e_B,f_C);")])
+    assert not ok and cst == [0, 0, 0, 0, 0, 0, 2, 2, 1, 1]
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
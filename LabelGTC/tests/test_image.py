@@ -0,0 +1,83 @@
+from ..lib.TreeLib import TreeUtils, TreeClass, SpeciesTreeIndex
+from .test_lca import naiveLca
+
+import random
+import time
+
+"""
+The compressed child-image subtrees given by TreeUtils.getImageTreeArrays and getImageTreeNode should contain
+the images of the children of each node of the genes tree and the lca of each pair of them, each node being
+attached to its deepest ancestor in the image tree, on random trees with polytomies
+"""
+
+def naiveImageTree(node, lcamap):
+    images = set(lcamap[child] for child in node.children)
+    nodes = set(naiveLca([a, b]) for a in images for b in images)
+    parents = {}
+    for s in nodes:
+        ancestors = [a for a in s.get_ancestors() if a in nodes]
+        parents[s] = ancestors[0] if ancestors else None
+    return parents
+
+def randomGeneTree(species, ngenes):
+    genetree = TreeClass()
+    if ngenes > 1:
+        genetree.populate(ngenes)
+    #Contract some internal nodes to make polytomies
+    for node in list(genetree.traverse("postorder")):
+        if not node.is_leaf() and not node.is_root() and random.random() < 0.4:
+            node.delete()
+    for leaf in genetree:
+        leaf.add_features(species=random.choice(species))
+    return genetree
+
+def main():
+    tps1 = time.clock()
+
+    random.seed(11)
+    nimages = 0
+
+    for size in [1, 2, 3, 5, 8, 20, 64]:
+        for rep in xrange(5):
+            specietree = TreeClass()
+            if size > 1:
+                specietree.populate(size, names_library=["s%d" % i for i in xrange(size)])
+            else:
+                specietree.name = "s0"
+            spindex = SpeciesTreeIndex(specietree)
+
+            for ngenes in [1, 2, 7, 30, 100]:
+                genetree = randomGeneTree(specietree.get_leaf_names(), ngenes)
+                lcamap = TreeUtils.lcaMapping(genetree, spindex, multspeciename=False)
+
+                arrays = TreeUtils.getImageTreeArrays(genetree, spindex, lcamap)
+                assert set(arrays) == set(node for node in genetree.traverse() if not node.is_leaf())
+                for node, (ids, parent) in arrays.iteritems():
+                    parents = naiveImageTree(node, lcamap)
+                    snodes = [spindex.nodes[i] for i in ids]
+                    assert set(snodes) == set(parents)
+                    assert list(ids) == sorted(ids)
+                    for s, p in zip(snodes, parent):
+                        assert (snodes[p] if p >= 0 else None) is parents[s]
+                    nimages += 1
+
+                images = TreeUtils.getImageTreeNode(genetree, spindex, lcamap)
+                for node, image in images.iteritems():
+                    parents = naiveImageTree(node, lcamap)
+                    assert sorted(n.name for n in image.traverse()) == sorted(s.name for s in parents)
+                    for n in image.traverse():
+                        assert n.depth == (specietree & n.name).depth
+                        assert (n.up.name if n.up else None) == (parents[specietree & n.name].name if parents[specietree & n.name] else None)
+                    #The children are sorted by the postorder of their image
+                    postorder = list(specietree.traverse("postorder"))
+                    ranks = [postorder.index(lcamap[child]) for child in node.children]
+                    assert ranks == sorted(ranks)
+
+    print("%d image trees checked" % nimages)
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+from ..lib.TreeLib import TreeUtils, TreeClass, SpeciesTreeIndex
+
+import random
+import time
+
+"""
+The lca given by the sparse table of the euler tour (TreeUtils.getLca, SpeciesTreeIndex
+and the batch mapping TreeUtils.lcaMappingIds) should be the one found by intersecting
+the ancestors of the nodes, on random trees
+"""
+
+def naiveLca(nodes):
+    common = None
+    for node in nodes:
+        ancestors = [node] + node.get_ancestors()
+        if common is None:
+            common = ancestors
+        else:
+            common = [a for a in ancestors if a in set(common)]
+    #The deepest common ancestor comes first
+    return common[0]
+
+def main():
+    tps1 = time.clock()
+
+    random.seed(42)
+    nqueries = 0
+
+    for size in [1, 2, 3, 4, 5, 8, 16, 17, 33, 64, 100, 257]:
+        for rep in xrange(5):
+            specietree = TreeClass()
+            if size > 1:
+                specietree.populate(size, names_library=["s%d" % i for i in xrange(size)])
+            else:
+                specietree.name = "s0"
+            specietree.label_internal_node()
+            TreeUtils.lcaPreprocess(specietree)
+            spindex = SpeciesTreeIndex(specietree)
+
+            nodes = list(specietree.traverse())
+            for query in xrange(50):
+                species = random.sample(nodes, random.randint(1, min(4, len(nodes))))
+                lca = naiveLca(species)
+                assert TreeUtils.getLca(specietree, species) is lca, (specietree.write(format=8), species)
+                assert spindex.lca(species) is lca
+                nqueries += 1
+
+            #Queries given by a single leaf name
+            for leaf in specietree:
+                assert TreeUtils.getLca(specietree, [leaf.name]) is leaf
+                assert spindex.lca([leaf.name]) is leaf
+
+            #Batch lca mapping of random genes trees, the single gene tree included
+            for ngenes in [1, 2, 7, 30]:
+                genetree = TreeClass()
+                if ngenes > 1:
+                    genetree.populate(ngenes)
+                for leaf in genetree:
+                    leaf.add_features(species=random.choice(specietree.get_leaf_names()))
+                gnodes, ids = TreeUtils.lcaMappingIds(genetree, spindex)
+                assert len(gnodes) == len(ids) == len(list(genetree.traverse()))
+                for gnode, i in zip(gnodes, ids):
+                    assert spindex.nodes[i] is naiveLca([specietree & leaf.species for leaf in gnode])
+                    nqueries += 1
+
+    print("%d lca queries checked" % nqueries)
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import os
+import sys
+
+import time
+import threading
+
+from ..lib.TreeLib import memorize
+
+"""
+memorize should keep the most recently used outputs within its bounds, and count its hits and misses
+"""
+
+def main():
+    tps1 = time.clock()
+
+    calls = []
+
+    @memorize(maxsize=2)
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    #The hash is given as first argument
+    assert square("a", 2) == 4
+    assert square("a", 2) == 4
+    assert square("b", 3) == 9
+    assert square("a", 2) == 4
+    #"b" is the least recently used output, it is evicted
+    assert square("c", 4) == 16
+    assert "b" not in square and "a" in square
+    assert square("b", 3) == 9
+    assert calls == [2, 3, 4, 3]
+    #No hash, no cache
+    assert square(None, 5) == 25 and square(None, 5) == 25
+    assert calls[-2:] == [5, 5]
+    print(square.stats())
+    assert square.stats()['hits'] == 2 and square.stats()['evictions'] == 2
+    print(repr(square))
+
+    #The hash computed from the arguments, with a budget of bytes
+    @memorize(maxbytes=1000, key=lambda n: n)
+    def zeros(n):
+        return [0] * n
+
+    zeros(10)
+    zeros(10)
+    zeros(100)
+    assert zeros.stats()['hits'] == 1
+    assert zeros.stats()['nbytes'] <= 1000
+
+    #The outputs expire after ttl seconds
+    @memorize(ttl=0.05, key=lambda x: x)
+    def now(x):
+        return time.time()
+
+    first = now(1)
+    assert now(1) == first
+    time.sleep(0.1)
+    assert now(1) != first
+    assert now.stats()['expirations'] == 1
+
+    now.clear()
+    assert len(now) == 0 and now.stats()['hits'] == 0
+
+    #Concurrent calls
+    @memorize(maxsize=50, key=lambda x: x)
+    def double(x):
+        return 2 * x
+
+    def work():
+        for i in xrange(1000):
+            assert double(i % 100) == 2 * (i % 100)
+
+    threads = [threading.Thread(target=work) for i in xrange(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(double) <= 50
+    stats = double.stats()
+    assert stats['hits'] + stats['misses'] == 4000
+    print(stats)
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
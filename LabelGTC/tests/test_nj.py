@@ -0,0 +1,97 @@
+from ..lib.TreeLib import ClusterUtils, TreeClass
+
+import numpy
+import random
+import sys
+import time
+
+"""
+The NJ clustering of ClusterUtils.NJ_cluster, which searches the Q_matrix by blocks with the sums of the rows
+updated at each join, should give the same trees as computing each value of the Q_matrix with calculate_Q_ij,
+for a full or partial (depth) clustering, the ties of the last four nodes included, and the same trees as
+calculate_Q_matrix on larger matrices without ties.
+The time of the NJ clustering of random matrices of 500 to 5000 genes is given by : python -m LabelGTC.tests.test_nj bench
+"""
+
+def naiveQ(matrice):
+    n = matrice.shape[0]
+    Q_matrix = numpy.zeros(shape=matrice.shape)
+    for ind in numpy.ndindex(*matrice.shape):
+        Q_matrix[ind] = ClusterUtils.calculate_Q_ij(matrice, ind, n)
+    return Q_matrix
+
+def naiveNJ(matrice, node_order, depth, Q=naiveQ):
+    tree = None
+    smallest_index = []
+    for i in range(depth):
+        Q_matrix = Q(matrice)
+        smallest_index = tuple(ClusterUtils.find_smallest_index(Q_matrix))
+        ClusterUtils.condense_node_order(matrice, smallest_index, node_order, method='nj')
+        matrice = ClusterUtils.condense_matrix(matrice, smallest_index, method='nj')
+        tree = node_order[smallest_index[1]]
+    return tree, matrice, smallest_index
+
+def randomMatrix(n):
+    matrice = numpy.random.rand(n, n)
+    matrice = matrice + matrice.T
+    numpy.fill_diagonal(matrice, 0)
+    return matrice
+
+def lengths(tree):
+    return [node.length for node in tree.traverse("preorder")]
+
+def benchmark(sizes):
+    for n in sizes:
+        matrice = randomMatrix(n)
+        tps = time.clock()
+        tree = ClusterUtils.NJ_cluster(matrice, [TreeClass("g%d;" % i) for i in xrange(n)])[0]
+        assert len(tree) == n
+        print("NJ on %d genes: %f" % (n, time.clock() - tps))
+
+def main():
+    tps1 = time.clock()
+
+    random.seed(3)
+    numpy.random.seed(3)
+    nclusters = 0
+
+    for n in [3, 4, 5, 8, 13, 30]:
+        for rep in xrange(3):
+            matrice = randomMatrix(n)
+            for depth in [None, 1, 2, n / 2, n - 1, n + 3]:
+                node_order = [TreeClass("g%d;" % i) for i in xrange(n)]
+                expected = naiveNJ(matrice.copy(), list(node_order), min(depth or n - 1, n - 1))
+                got = ClusterUtils.NJ_cluster(matrice.copy(), node_order, depth)
+                assert got[0].write(format=9) == expected[0].write(format=9)
+                assert lengths(got[0]) == lengths(expected[0])
+                assert numpy.array_equal(got[1], expected[1])
+                assert tuple(got[2]) == tuple(expected[2])
+                assert len(node_order) == len(got[1])
+                nclusters += 1
+
+    for n in [5, 30, 100]:
+        matrice = randomMatrix(n)
+        assert numpy.array_equal(ClusterUtils.calculate_Q_matrix(matrice), naiveQ(matrice))
+
+    for n in [65, 100, 300]:
+        matrice = randomMatrix(n)
+        for depth in [None, 1, n / 2]:
+            node_order = [TreeClass("g%d;" % i) for i in xrange(n)]
+            expected = naiveNJ(matrice.copy(), list(node_order), depth or n - 1, ClusterUtils.calculate_Q_matrix)
+            got = ClusterUtils.NJ_cluster(matrice.copy(), node_order, depth)
+            assert got[0].write(format=9) == expected[0].write(format=9)
+            assert lengths(got[0]) == lengths(expected[0])
+            assert numpy.array_equal(got[1], expected[1])
+            assert tuple(got[2]) == tuple(expected[2])
+            nclusters += 1
+
+    print("%d clusterings checked" % nclusters)
+
+    benchmark([500] if sys.argv[1:] != ["bench"] else [500, 1000, 2000, 5000])
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+from ..lib.TreeLib import TreeUtils, TreeClass, SpeciesTreeIndex, params
+from ..lib.PolyRes import Multipolysolver
+
+import time
+
+"""
+The cost table of a species tree index should give the costs of params.getdup and params.getloss,
+follow params.set, and give the per-branch costs attached to the index to the reconciliation and to polySolver.
+The tables memorized by polySolver are not reused once the costs have been changed by set or setBranchCosts.
+The hash of a species list doesn't depend on the order of the species, and only the most recent ones are remembered
+"""
+
+def main():
+    tps1 = time.clock()
+
+    s = TreeClass("((A,B),(C,D));")
+    spindex = SpeciesTreeIndex(s)
+
+    genetree = TreeClass("((a_A,b_A),(c_C,d_D));")
+    genetree.set_species()
+    lcamap = TreeUtils.lcaMapping(genetree, spindex, multspeciename=False)
+
+    try:
+        for mode in ['default', 'mean']:
+            params.set({params.get_hash(["A"]): 3}, {params.get_hash(["B"]): 2}, (1, 1), mode)
+            table = params.costTable(spindex)
+            for i, node in enumerate(spindex.nodes):
+                assert table.getdup(i) == params.getdup(node)
+                assert table.getloss(node) == params.getloss(node)
+            print("%s : dup %s, loss %s" % (mode, table.dup.tolist(), table.loss.tolist()))
+
+        #The table is built once for each call to set
+        assert params.costTable(spindex) is table
+
+        #The hashes of the species lists are remembered by sorted list, in a bounded cache
+        assert params.get_hash(["B", "A"]) == params.get_hash(["A", "B"]) == params.get_hash("A,B")
+        assert ("A", "B") in params.get_hash and ("B", "A") not in params.get_hash
+        assert params.get_hash.maxsize is not None
+
+        #One duplication in A and the loss of B
+        params.set({}, {}, (1, 1))
+        assert TreeUtils.computeDLScore(genetree, lcamap, spindex=spindex) == TreeUtils.computeDLScore(genetree, lcamap)
+        print(TreeUtils.computeDLScore(genetree, lcamap, spindex=spindex))
+
+        #polySolver reads the costs of its rows by species id in the cost table of the index, or from params without it
+        polytomy = TreeClass("(a_A,b_A,c_C,d_D,e_C);")
+        polytomy.set_species()
+        plain, _ = Multipolysolver.polySolver.function(polytomy, s.copy("newick"), None, [], 1, mode="none")
+        indexed, _ = Multipolysolver.polySolver.function(polytomy, s.copy("newick"), None, [], 1, mode="none", spindex=spindex)
+        assert (plain == indexed).all()
+        #Solved once with the default costs, through the memorized polySolver
+        assert Multipolysolver.computePolytomyReconCost(polytomy.copy(), spindex) == plain[-1, 0]
+
+        #Per-branch costs attached to the index
+        params.setBranchCosts(spindex, dup={"A": 5, "C": 5}, loss={"B": 0.5})
+        dup, loss = TreeUtils.computeDLScore(genetree, lcamap, spindex=spindex)
+        print(dup, loss)
+        assert dup == 5
+        assert loss == 0.5
+
+        indexed, _ = Multipolysolver.polySolver.function(polytomy, s.copy("newick"), None, [], 1, mode="none", spindex=spindex)
+        #A duplication in A costs 5 and the loss of B 0.5 in the table of the index, not in the one of params
+        assert plain[1, 0] == plain[2, 0] == 1
+        assert indexed[1, 0] == 5 and indexed[2, 0] == 0.5
+
+        #The same polytomy solved again after the costs of the index or of params are changed
+        assert Multipolysolver.computePolytomyReconCost(polytomy.copy(), spindex) == indexed[-1, 0]
+        params.setBranchCosts(spindex, dup=[50.] * len(spindex.nodes), loss=[50.] * len(spindex.nodes))
+        assert Multipolysolver.computePolytomyReconCost(polytomy.copy(), spindex) == 50 * plain[-1, 0]
+        assert Multipolysolver.computePolytomyReconCost(polytomy.copy(), s) == plain[-1, 0]
+        params.set({}, {}, (2, 2))
+        assert Multipolysolver.computePolytomyReconCost(polytomy.copy(), s) == 2 * plain[-1, 0]
+    finally:
+        params.set({}, {}, (1, 1))
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
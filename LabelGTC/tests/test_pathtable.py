@@ -0,0 +1,87 @@
+from ..lib.PolyRes import Multipolysolver
+from ..lib.TreeLib import TreeClass
+
+import itertools
+import numpy
+import random
+import time
+
+"""
+The path table of Multipolysolver.polySolver is a bitmask of the events (SPEC, LOST, DUP) that reach each case.
+The paths of a case are enumerated in the order its events were found : the speciation, then the duplication
+and the lost, unless the lost was found first (LOST_FIRST). Without speciation, the first of them is followed.
+The paths are generated one by one : the first ones don't depend on how many are enumerated, and a limit
+only builds the first solutions. The rows of the children of each species are given by findMaxX
+"""
+
+def randomPolytomy(specietree, ngenes):
+    names = ["g%d_%s" % (i, random.choice(specietree.get_leaf_names())) for i in xrange(ngenes)]
+    genetree = TreeClass("(%s);" % ",".join(names))
+    genetree.set_species()
+    matrix = numpy.random.rand(ngenes, ngenes)
+    matrix = (matrix + matrix.T) / 2
+    numpy.fill_diagonal(matrix, 0)
+    return genetree, matrix, names
+
+def main():
+    tps1 = time.clock()
+
+    random.seed(5)
+    numpy.random.seed(5)
+    npaths = 0
+
+    for nspecies in [2, 3, 5, 8]:
+        specietree = TreeClass()
+        specietree.populate(nspecies, names_library=["S%d" % i for i in xrange(nspecies)])
+        specietree.label_internal_node()
+
+        for ngenes in [3, 6, 12]:
+            genetree, matrix, names = randomPolytomy(specietree, ngenes)
+
+            _, row_node_corr, child_rows = Multipolysolver.findMaxX(genetree, specietree.copy("newick"))
+            for n, node in row_node_corr.iteritems():
+                #The children have smaller rows than their parent
+                assert [row_node_corr[c] for c in child_rows[n]] == node.children if not node.is_leaf() else list(child_rows[n]) == [-1, -1]
+                assert all(c < n for c in child_rows[n])
+
+            paths = list(Multipolysolver.polySolver.function(genetree, specietree.copy("newick"), matrix, names[:]))
+            assert paths, genetree
+
+            #The limited enumeration gives the first solutions
+            for limit in [1, 2]:
+                first = Multipolysolver.polySolver.function(genetree, specietree.copy("newick"), matrix, names[:], limit=limit)
+                assert [t.write(format=9) for t in first] == [t.write(format=9) for t in paths[:limit]]
+            npaths += len(paths)
+
+    #The generators only compute the paths that are asked for
+    path_table = numpy.zeros((3, 4), dtype=numpy.uint8)
+    s = TreeClass("(A,B)AB;", format=1)
+    row_node_corr = {2: s & "A", 1: s & "B", 0: s}
+    path_table[2, 1:] = Multipolysolver.LOST
+    path_table[1, 1:] = Multipolysolver.LOST
+    path_table[0, :] = Multipolysolver.SPEC
+    path_table[0, :2] |= Multipolysolver.DUP
+    count = {"AB": 0, "A": 1, "B": 1}
+    allpaths = list(Multipolysolver.findPathFromTable(path_table, row_node_corr, count, 0, 0))
+    paths = Multipolysolver.findPathFromTable(path_table, row_node_corr, count, 0, 0)
+    assert next(paths) == allpaths[0]
+    assert list(itertools.islice(paths, 2)) == allpaths[1:3]
+
+    #The order of the events of a case, whatever the order of their bits
+    path_table = numpy.zeros((3, 4), dtype=numpy.uint8)
+    path_table[0, :3] = Multipolysolver.SPEC
+    dup, lost, spec = "AB:2,AB:3,A:3,B:3", "AB:2,AB:1,A:1,B:1", "AB:2,A:2,B:2"
+    for lostFirst, order in [(0, [spec, dup, lost]), (Multipolysolver.LOST_FIRST, [spec, lost, dup])]:
+        path_table[0, 1] = Multipolysolver.SPEC | Multipolysolver.LOST | Multipolysolver.DUP | lostFirst
+        assert list(Multipolysolver.findPathFromTable(path_table, row_node_corr, count, 0, 1)) == order
+        path_table[0, 1] = Multipolysolver.LOST | Multipolysolver.DUP | lostFirst
+        assert list(Multipolysolver.findSpeciationPathFromTable(path_table, row_node_corr, count, 0, 1)) == order[1:2]
+
+    print("%d solutions checked" % npaths)
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
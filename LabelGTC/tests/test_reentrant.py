@@ -0,0 +1,59 @@
+from ..lib.LabelGTC import LabelGTC
+
+import os
+import sys
+
+import time
+
+from ..lib.TreeLib import *
+from ..lib.TreeLib import TreeUtils, TreeClass
+
+"""
+Several genes trees corrected one after the other in the same process should not share any state
+"""
+
+def correct(s, gtree, cstlist, seuil):
+    lgtc = LabelGTC(s, TreeClass(gtree), [TreeClass(t) for t in cstlist], seuil)
+    lgtc.mergeResolutions()
+    return lgtc
+
+def main():
+    tps1 = time.clock()
+
+    s = TreeClass("((A,B),C);")
+    s.label_internal_node()
+    seuil = 0.7
+
+    g = "((((a_A,x_B)0.2,(b_B,e_C)0.2)0.2,y_C)0.2,((i_B,k_A)0.1,((c_C, j_A)0.1,(d_B,(g_C,h_A)0.2)0.8)0.2)0.8)0.2;"
+    cst = ["a_A;", "x_B;", "y_C;", "(b_B,e_C);", "(c_C,j_A);", "(g_C,h_A);", "d_B;", "(i_B,k_A);"]
+
+    first = correct(s, g, cst, seuil)
+    second = correct(s, g, cst, seuil)
+
+    print("-----FIRST CORRECTION-----")
+    print(first.getResultedTree())
+    print("-----SECOND CORRECTION-----")
+    print(second.getResultedTree())
+
+    #Each correction has its own context, the second one starting from a clean state
+    assert first.getContext() is not second.getContext()
+    assert second.id == 1
+    assert first.getCase() == second.getCase()
+    assert first.getContext().nbCalls == second.getContext().nbCalls
+    assert len(first.getContext().clades_to_preserve_sgt) == len(second.getContext().clades_to_preserve_sgt)
+    assert set(first.getResultedTree().get_leaf_names()) == set(second.getResultedTree().get_leaf_names())
+
+    #The covering set of trees is checked for every correction, not only for the first one
+    try:
+        correct(s, g, ["(a_A,b_B);", "x_B;", "y_C;", "e_C;", "(c_C,j_A);", "(g_C,h_A);", "d_B;", "(i_B,k_A);"], seuil)
+    except Exception as e:
+        print("Invalid covering set rejected : %s" % e)
+    else:
+        raise AssertionError("An invalid covering set of trees was accepted")
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
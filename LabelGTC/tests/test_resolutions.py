@@ -0,0 +1,61 @@
+from ..lib.PolyRes import PS
+from ..lib.TreeLib import TreeUtils, TreeClass
+
+import itertools
+import random
+import time
+
+"""
+The optimal resolutions of PolySolver.GeneTreeSolver are generated one by one : countSolutions should give
+the number of solutions of iterSolutions without enumerating them, solvePolytomies the first ones, and
+sampleSolution one of them drawn uniformly
+"""
+
+SPECIESTREE = "((S3,S2),(S1,S0));"
+#Polytomies with 8 optimal resolutions, for a duplication cost of 2 and a loss cost of 1
+GENETREE = "(((a_S3,b_S1,c_S0),d_S2,(e_S3,f_S1,g_S1,h_S0,i_S3)),j_S3,((k_S2,l_S1),m_S0),n_S0,o_S3,p_S0,((q_S0,r_S3,s_S0,t_S3),u_S2,v_S3,(w_S1,x_S3,y_S2,z_S2)))"
+
+def solver(newick, dupcost, losscost):
+    s = TreeClass(SPECIESTREE)
+    genetree = TreeClass(newick)
+    genetree.set_species()
+    lcamap = TreeUtils.lcaMapping(genetree, s, multspeciename=False)
+    gts = PS.GeneTreeSolver(genetree, s, lcamap, dupcost, losscost)
+    gts.use_dp = dupcost != losscost
+    return gts
+
+def main():
+    tps1 = time.clock()
+
+    rng = random.Random(3)
+
+    gts = solver(GENETREE + ";", 2, 1)
+    solutions = list(gts.iterSolutions())
+    print("%d solutions" % len(solutions))
+    assert gts.countSolutions() == len(solutions) == 8
+    assert gts.solvePolytomies(3) == solutions[:3]
+
+    #The solutions are drawn uniformly
+    draws = [gts.sampleSolution(rng=rng) for i in xrange(4000)]
+    frequencies = [draws.count(sol) for sol in solutions]
+    print(frequencies)
+    assert set(draws) == set(solutions)
+    assert all(abs(f - 500) < 150 for f in frequencies)
+
+    #Several copies of the genes tree : the number of solutions is the product of the numbers of each copy,
+    #and is counted without enumerating them
+    copies = ",".join(GENETREE.replace("_", "%d_" % i) for i in xrange(6))
+    gts = solver("(%s);" % copies, 2, 1)
+    count = gts.countSolutions()
+    print("%d solutions for 6 copies" % count)
+    assert count % (8 ** 6) == 0
+    first = list(itertools.islice(gts.iterSolutions(), 5))
+    assert first == gts.solvePolytomies(5)
+    assert len(TreeClass(gts.sampleSolution(rng=rng) + ";")) == 26 * 6
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+from ..lib.LabelGTC import LabelGTC, LabelGTCContext
+from ..lib.LabelGTC.Scheduler import SubtreeScheduler, SerialExecutor
+
+import random
+
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from ..lib.TreeLib import *
+from ..lib.TreeLib import TreeClass
+
+"""
+The scheduler resolves the instances bottom-up without recursion : a genes tree with hundreds of nested subtrees,
+far more than the Python stack would allow, is corrected the same way in the current thread, with a pool of
+threads and with an executor given to the context. After the correction, the genes tree of the root instance
+holds the resolved subtrees in place of the subtrees
+"""
+
+class Instance(object):
+
+    """An instance with a list of subinstances, that resolves its subtree as the sorted list of the resolutions of its subinstances"""
+
+    def __init__(self, name, subinstances, log):
+        self.name = name
+        self.subinstances = subinstances
+        self.log = log
+        self.resolved = None
+
+    def getResolvedSubtree(self):
+        return self.resolved
+
+    def resolveSteps(self):
+        #A nested generator of steps, and a step without any subtree to resolve
+        yield self.emptySteps()
+        resolved = yield self.subinstances
+        self.log.append(self.name)
+        self.resolved = (self.name, sorted(resolved))
+
+    def emptySteps(self):
+        resolved = yield []
+        assert resolved == []
+
+
+def nested(n):
+    """A caterpillar genes tree with n leaves whose labels give n - 2 nested subtrees, and its covering set of trees"""
+    random.seed(n)
+    gtree = TreeClass()
+    node = gtree
+    for i in xrange(n - 1, 1, -1):
+        node.support = 1.0
+        node.add_child(name="a%d_%s" % (i, random.choice("ABC")))
+        node = node.add_child()
+    node.support = 1.0
+    node.add_child(name="a0_A")
+    node.add_child(name="a1_B")
+    cstlist = [TreeClass("(a0_A,a1_B);")] + [TreeClass("%s;" % leaf.name) for leaf in gtree if leaf.name not in ("a0_A", "a1_B")]
+    return gtree, cstlist
+
+def correct(s, gtree, cstlist, context):
+    lgtc = LabelGTC(s, gtree.copy(), cstlist, 0.5, context=context)
+    lgtc.mergeResolutions()
+    return lgtc
+
+def main():
+    tps1 = time.clock()
+
+    #The steps of the instances are run bottom-up, each instance being resumed with the resolutions of its subinstances in order
+    for executor, threads in [(None, 1), (None, 3), (SerialExecutor(), 1)]:
+        log = []
+        leaves = [Instance("leaf%d" % i, [], log) for i in xrange(4)]
+        inner = Instance("inner", leaves[:3], log)
+        root = Instance("root", [inner, leaves[3]], log)
+        SubtreeScheduler(executor, threads).run(root, root.resolveSteps())
+        assert sorted(log[:4]) == ["leaf0", "leaf1", "leaf2", "leaf3"] and log[4:] == ["inner", "root"]
+        assert root.resolved == ("root", [("inner", [("leaf0", []), ("leaf1", []), ("leaf2", [])]), ("leaf3", [])])
+
+    s = TreeClass("((A,B),C);")
+    s.label_internal_node()
+    gtree, cstlist = nested(500)
+
+    pool = ThreadPool(2)
+    corrections = [correct(s, gtree, cstlist, context) for context in [LabelGTCContext(), LabelGTCContext(4), LabelGTCContext(executor=pool)]]
+    #The executor given is not closed by the scheduler
+    assert pool.map(len, ["a", "bc"]) == [1, 2]
+    pool.close()
+    pool.join()
+
+    results = [lgtc.getResultedTree().write(format=9) for lgtc in corrections]
+    print("%d nested instances, corrected tree of %d leaves" % (corrections[0].getContext().maxDepth, len(corrections[0].getResultedTree())))
+    for lgtc in corrections:
+        assert lgtc.getCase() == "global"
+        assert lgtc.getContext().nbCalls == 498 and lgtc.getContext().maxDepth == 497
+        assert lgtc.getResultedTree().write(format=9) == results[0]
+
+    #The genes tree of the root instance holds the resolved subtree, in place of the subtree
+    lgtc = corrections[0]
+    genesTree = lgtc.getGenesTree()
+    assert sorted(genesTree.get_leaf_names()) == sorted(gtree.get_leaf_names())
+    assert len(lgtc.resolvedSubtrees) == 1
+    for i, resolved in lgtc.resolvedSubtrees.items():
+        name = lgtc.ctree.names[lgtc.ctree.name[i]]
+        assert genesTree.children[1].name == name
+        assert genesTree.children[1].write(format=9) == resolved.toTreeClass().write(format=9)
+        assert genesTree.children[1].write(format=9) != gtree.children[1].write(format=9)
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+from ..lib.LabelGTC import LabelGTC
+
+import os
+import sys
+
+import time
+
+from ..lib.TreeLib import *
+from ..lib.TreeLib import TreeUtils, TreeClass
+
+"""
+Correcting a genes tree with several thresholds at once should give the same costs as the corrections with each threshold
+"""
+
+def dlCost(s, tree):
+    tree = TreeClass(tree.write(format=9))
+    tree.set_species()
+    lcamap = TreeUtils.lcaMapping(tree, s, multspeciename=False)
+    return sum(TreeUtils.computeDL(tree, lcamap))
+
+def main():
+    tps1 = time.clock()
+
+    s = TreeClass("((A,B),C);")
+    s.label_internal_node()
+    thresholds = [0.1, 0.3, 0.5, 0.7, 0.75, 0.9]
+
+    g = "((((a_A,x_B)0.2,(b_B,e_C)0.9)0.8,y_C)0.2,((i_B,k_A)0.1,((c_C, j_A)0.2,(d_B,(g_C,h_A)0.2)0.2)0.9)0.2)0.2;"
+    cst = ["y_C;", "((b_B,e_C),(a_A,x_B));", "(c_C,j_A);", "((g_C,h_A),d_B);", "(i_B,k_A);"]
+
+    gtree = TreeClass(g)
+    results = LabelGTC.sweepThresholds(s, gtree, [TreeClass(t) for t in cst], thresholds)
+
+    #The genes tree given to the sweep is not modified
+    assert gtree.write(format=2) == TreeClass(g).write(format=2)
+
+    for (threshold, tree, case), seuil in zip(results, thresholds):
+        lgtc = LabelGTC(s, TreeClass(g), [TreeClass(t) for t in cst], seuil)
+        lgtc.mergeResolutions()
+
+        print("-----THRESHOLD %s (%s)-----" % (threshold, case))
+        print(tree)
+
+        assert threshold == seuil
+        assert case == lgtc.getCase()
+        assert set(tree.get_leaf_names()) == set(lgtc.getResultedTree().get_leaf_names())
+        assert dlCost(s, tree) == dlCost(s, lgtc.getResultedTree())
+
+    #The covering set of trees is checked once for the whole sweep
+    try:
+        LabelGTC.sweepThresholds(s, TreeClass(g), [TreeClass(t) for t in cst[1:]], thresholds)
+    except Exception as e:
+        print("Invalid covering set rejected : %s" % e)
+    else:
+        raise AssertionError("An invalid covering set of trees was accepted")
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+from ..lib.LabelGTC import LabelGTC, LabelGTCContext
+
+import random
+import sys
+import threading
+
+import time
+
+from ..lib.TreeLib import *
+from ..lib.TreeLib import TreeClass
+from ..lib.SGT import SGTCache
+
+"""
+A genes tree corrected with several threads, the independent subtrees being resolved concurrently (and minSGT
+running without the GIL), should give the same result as the one corrected in the current thread only.
+A plain SGTCache shared by several threads keeps its entries, counters and species ids consistent
+"""
+
+def family(seed, nsp=8, ngenes=20):
+    #A random genes tree whose covering set of trees cuts it in many independent subtrees. With a threshold of 0.7,
+    #most of the nodes of a family of 20 genes are contracted and a single polytomy can take tens of seconds to
+    #resolve, so the threshold is drawn between 0.3 and 0.5 to keep every family quick
+    rnd = random.Random(seed)
+    random.seed(seed)
+    s = TreeClass()
+    s.populate(nsp, names_library=["S%d" % i for i in xrange(nsp)], random_branches=False)
+    species = s.get_leaf_names()
+    g = TreeClass()
+    g.populate(ngenes, names_library=["g%d" % i for i in xrange(ngenes)])
+    for i, leaf in enumerate(g):
+        leaf.name = "g%d_%s" % (i, rnd.choice(species))
+    for node in g.traverse():
+        node.support = round(rnd.random(), 2)
+    cstlist = []
+    def cut(node):
+        if node.is_leaf() or rnd.random() < 0.3:
+            cstlist.append(node.write(format=9))
+        else:
+            for child in node.children:
+                cut(child)
+    for child in g.children:
+        cut(child)
+    return s.write(format=9), g.write(format=2), cstlist, rnd.choice([0.3, 0.5])
+
+def hammer(cache, nthreads=8, ncalls=2000):
+    #Each thread gives its own species trees, and gets and puts keys shared by all the threads
+    ids = [[] for i in xrange(nthreads)]
+    def run(t):
+        for i in xrange(ncalls):
+            ids[t].append(cache.speciesId([-1, 0, 0], ["s%d" % t, "a%d" % (i % 50), "b"]))
+            key = ("key", i % 100)
+            if cache.get(key) is None:
+                cache.put(key, (t, i))
+    threads = [threading.Thread(target=run, args=(t,)) for t in xrange(nthreads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return ids
+
+def correct(family, context):
+    s, gtree, cstlist, seuil = family
+    s = TreeClass(s)
+    s.label_internal_node()
+    lgtc = LabelGTC(s, TreeClass(gtree), [TreeClass(t) for t in cstlist], seuil, context=context)
+    lgtc.mergeResolutions()
+    return lgtc
+
+def main():
+    tps1 = time.clock()
+
+    #Switching threads as often as possible, for the interleavings to be many
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    try:
+        cache = SGTCache(64)
+        ids = hammer(cache)
+    finally:
+        sys.setcheckinterval(interval)
+    print(cache)
+    #A single id for each species tree, and different ids for different species trees
+    for t, tids in enumerate(ids):
+        assert tids[:50] == tids[50:100] and len(set(tids[:50])) == 50
+    assert sorted(i for tids in ids for i in tids[:50]) == range(8 * 50)
+    assert cache.hits + cache.misses == 8 * 2000
+    assert len(cache) == len(cache.entries) == 64
+
+    subtrees = []
+    for seed in xrange(20):
+        f = family(seed)
+        subtrees.append(len(f[2]))
+        serial = correct(f, LabelGTCContext())
+        threaded = correct(f, LabelGTCContext(4))
+        #The same correction with the minSGT results of all the families in a single cache
+        shared = correct(f, LabelGTCContext(4, cache))
+        assert shared.getResultedTree().write(format=9) == serial.getResultedTree().write(format=9)
+        assert serial.getResultedTree().write(format=9) == threaded.getResultedTree().write(format=9)
+        assert serial.getCase() == threaded.getCase()
+        assert serial.getContext().nbCalls == threaded.getContext().nbCalls
+        assert serial.getContext().cases == threaded.getContext().cases
+        print("Family %d (%d subtrees) : %s" % (seed, len(f[2]), threaded.getResultedTree().write(format=9)))
+    assert sum(n > 5 for n in subtrees) > 10
+    assert cache.hits + cache.misses > 8 * 2000
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+from ..lib.PolyRes import ZhengPS
+from ..lib.TreeLib import TreeUtils, TreeClass
+
+from collections import defaultdict as ddict
+from functools import partial
+
+import numpy as np
+
+import random
+import time
+import types
+
+"""
+The vectorised DynPolySolver.compute_table should give the same tables and resolution costs as the
+original implementation (one call to getMin per cell), on random polytomies.
+The resolutions spliced into the tree of genes should be binary and keep all its genes
+"""
+
+def loopComputeTable(self, image_tree, W, rW):
+    """The original implementation of DynPolySolver.compute_table"""
+    U = ddict(partial(np.zeros))
+    M = ddict(int)
+    I = ddict(partial(np.zeros))
+
+    outgene = ddict(int)
+    ingene = ddict(int)
+
+    for node in image_tree.traverse("postorder"):
+        mult_node = W[node.name]
+        if node.is_leaf():
+            M[node.name] = mult_node - 1
+        elif len(node.get_children()) == 1:
+            M[node.name] = M[node.get_child_at(0).name] + mult_node
+        else:
+            M[node.name] = mult_node + max(M[node.get_child_at(0).name], M[node.get_child_at(1).name])
+
+    if image_tree.is_root() and image_tree.is_leaf():
+        outgene[image_tree.name] = 0
+        ingene[image_tree.name] = W[image_tree.name] - 1
+        return self.get_solution(image_tree, W, rW, outgene, ingene)
+
+    C = np.zeros(M[image_tree.name] + 1)
+
+    def getCost(inp, out, d):
+        m = min(float(d) * self.losscost, self.dupcost)
+        if inp >= out:
+            return m * float(out)
+        else:
+            return m * float(inp) + self.dupcost * float(out - inp)
+
+    def getMin(node, inp, d):
+        w = W[node.name]
+        p, m = w, getCost(inp, w, d) + C[w]
+        for out in xrange(w + 1, M[node.name] + 1):
+            t = getCost(inp, out, d) + C[out]
+            if t < m:
+                p, m = out, t
+        U[node.name][inp] = m
+        I[node.name][inp] = p
+
+    def getC(node, w):
+        for j in xrange(w, M[node.name] + 1):
+            C[j] = sum(U[child.name][j - w] for child in node.get_children())
+
+    for node in image_tree.traverse("postorder"):
+        mult_node = W[node.name]
+        if node.is_leaf():
+            size = M[node.parent] - W[node.parent] + 1
+            U[node.name] = np.zeros(size)
+            I[node.name] = np.zeros(size, dtype=int)
+            for j in xrange(0, size):
+                U[node.name][j] = getCost(j, mult_node - 1, node.depth - node.up.depth)
+                I[node.name][j] = mult_node - 1
+        elif node.is_root():
+            U[node.name] = np.zeros(1)
+            I[node.name] = np.zeros(1, dtype=int)
+            getC(node, mult_node)
+            getMin(node, 0, 0)
+        else:
+            size = M[node.parent] - W[node.parent] + 1
+            U[node.name] = np.zeros(size)
+            I[node.name] = np.zeros(size, dtype=int)
+            getC(node, mult_node)
+            for j in xrange(0, size):
+                getMin(node, j, node.depth - node.up.depth)
+
+    ingene[image_tree.name] = I[image_tree.name][0]
+    outgene[image_tree.name] = 0
+    for node in reversed(image_tree.get_descendants("postorder")):
+        outgene[node.name] = ingene[node.parent] - W[node.parent]
+        if ((node.depth - node.up.depth) * self.losscost) > self.dupcost:
+            outgene[node.name] = 0
+        ingene[node.name] = I[node.name][outgene[node.name]]
+
+    return self.get_solution(image_tree, W, rW, outgene, ingene)
+
+def solve(s, newick, dupcost, losscost, loops):
+    """Resolve the polytomies of the tree, return the resolution and the in/out genes of each image tree"""
+    genetree = TreeClass(newick)
+    genetree.set_species()
+    lcamap = TreeUtils.lcaMapping(genetree, s, multspeciename=False)
+    solver = ZhengPS.DynPolySolver(genetree, s, lcamap, dupcost, losscost)
+    if loops:
+        solver.compute_table = types.MethodType(loopComputeTable, solver)
+
+    tables = []
+    get_solution = solver.get_solution
+    def recordSolution(image_tree, W, rW, outgene, ingene):
+        tables.append((sorted(outgene.items()), sorted((k, int(v)) for k, v in ingene.items())))
+        return get_solution(image_tree, W, rW, outgene, ingene)
+    solver.get_solution = recordSolution
+
+    #The polytomies are not always resolved in the same order
+    return solver.reconstruct(), sorted(tables)
+
+def dlCost(s, newick):
+    tree = TreeClass(newick)
+    tree.set_species()
+    lcamap = TreeUtils.lcaMapping(tree, s, multspeciename=False)
+    return TreeUtils.computeDLScore(tree, lcamap)
+
+def randomPolytomy(species, size, nested):
+    """Newick of a random tree of genes with a polytomy of size children at the root, some of them being polytomies"""
+    genes = ["g%d_%s" % (i, random.choice(species)) for i in xrange(size)]
+    children = []
+    while genes:
+        k = random.randint(2, 6) if nested and len(genes) > 1 and random.random() < 0.2 else 1
+        group, genes = genes[:k], genes[k:]
+        children.append(group[0] if len(group) == 1 else "(%s)" % ",".join(group))
+    if len(children) == 1:
+        children.append("x_%s" % random.choice(species))
+    return "(%s);" % ",".join(children)
+
+def main():
+    tps1 = time.clock()
+
+    random.seed(7)
+    npolytomies = 0
+
+    for nspecies in [2, 3, 5, 8, 13, 20]:
+        s = TreeClass()
+        s.populate(nspecies, names_library=["S%d" % i for i in xrange(nspecies)], random_branches=False)
+        s.label_internal_node()
+        species = s.get_leaf_names()
+
+        for size in [2, 3, 5, 10, 40, 150]:
+            for dupcost, losscost in [(1, 1), (2, 1), (1, 3)]:
+                newick = randomPolytomy(species, size, size > 5)
+                vectorised, vtables = solve(s, newick, dupcost, losscost, False)
+                loops, ltables = solve(s, newick, dupcost, losscost, True)
+                assert vtables == ltables, newick
+                #The genes of a species can be placed differently in the resolutions
+                assert dlCost(s, vectorised) == dlCost(s, loops), newick
+                for resolution in [vectorised, loops]:
+                    tree = TreeClass(resolution)
+                    assert all(len(node.children) in (0, 2) for node in tree.traverse()), resolution
+                    assert sorted(tree.get_leaf_names()) == sorted(TreeClass(newick).get_leaf_names()), resolution
+                npolytomies += len(vtables)
+
+    print("%d polytomies resolved identically" % npolytomies)
+
+    tps2 = time.clock()
+    print("Time to compute:")
+    print(tps2 - tps1)
+
+if __name__ == '__main__':
+    main()